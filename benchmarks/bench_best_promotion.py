@@ -0,0 +1,36 @@
+"""
+Compare the sequential best-promotion loop with the branch-and-bound selection over generated promotion sets.
+
+    python -m benchmarks.bench_best_promotion
+"""
+import time
+from benchmarks.fixtures import generate_promotions, generate_requests
+from utils.promotion_compiler import CompiledPromotion, PromotionCandidates, select_best_promotion
+
+SIZES = [10, 100, 1000, 5000]
+REQUESTS = 500
+
+
+def main():
+    requests = generate_requests(REQUESTS)
+    print(f"{'promotions':>10}{'sequential (us)':>18}{'branch & bound (us)':>22}{'speedup':>10}")
+    for size in SIZES:
+        promotions = [CompiledPromotion(promotion) for promotion in generate_promotions(size)]
+        candidates = PromotionCandidates(promotions)
+        for amount, info in requests:
+            assert candidates.select_best(amount, info) == select_best_promotion(promotions, amount, info)
+
+        start = time.perf_counter()
+        for amount, info in requests:
+            select_best_promotion(promotions, amount, info)
+        sequential = (time.perf_counter() - start) / REQUESTS
+
+        start = time.perf_counter()
+        for amount, info in requests:
+            candidates.select_best(amount, info)
+        bounded = (time.perf_counter() - start) / REQUESTS
+        print(f"{size:>10}{sequential * 1e6:>18.1f}{bounded * 1e6:>22.1f}{sequential / bounded:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
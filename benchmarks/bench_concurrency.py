@@ -0,0 +1,107 @@
+"""
+Requests per second of one worker (one event loop) against the number of requests in flight, for the
+same credit lookup served the old way, a sync session queried from the async route so every query blocks
+the loop, and through the asyncpg session, where the loop serves other requests while a query waits.
+
+Requests go through the ASGI app in process (no sockets or HTTP parsing), each looking up a random
+reference with CreditService.get_item_by_reference. --latency-ms adds a pg_sleep to every request,
+standing in for a slower query or a database further away. Both sides get their own engine with a pool
+as large as the largest concurrency, so the pool is not what limits them.
+
+    python -m benchmarks.bench_concurrency [--concurrency 1,2,4,8,16,32,64] [--requests 2000] [--latency-ms 5]
+"""
+import argparse
+import asyncio
+import time
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+from config import database
+from config.database import SQLALCHEMY_DATABASE_URL
+from schemas.credit import CreditReference
+from services.credit import CreditService, AsyncCreditService
+from utils.misc import generate_reference
+
+CONCURRENCY = [1, 2, 4, 8, 16, 32, 64]
+REQUESTS = 2000
+LATENCY_MS = 5.0
+
+
+def reference() -> CreditReference:
+    item = CreditReference(reference=generate_reference())
+    item.set_partner_code("DBS")
+    return item
+
+
+def create_app(pool_size: int, latency: float) -> tuple[FastAPI, list]:
+    sync_engine = create_engine(SQLALCHEMY_DATABASE_URL, pool_size=pool_size, max_overflow=0)
+    asyncpg_engine = create_async_engine(database.async_engine.url, pool_size=pool_size, max_overflow=0)
+    SyncSession = sessionmaker(sync_engine, autoflush=False)
+    AsyncSession = async_sessionmaker(asyncpg_engine, autoflush=False, expire_on_commit=False)
+    sleep = text("SELECT pg_sleep(:seconds)").bindparams(seconds=latency)
+    app = FastAPI()
+
+    @app.get("/sync")
+    async def sync_lookup():
+        with SyncSession() as db:
+            if latency:
+                db.execute(sleep)
+            return {"found": CreditService(db).get_item_by_reference(reference()).success}
+
+    @app.get("/async")
+    async def async_lookup():
+        async with AsyncSession() as db:
+            if latency:
+                await db.execute(sleep)
+            return {"found": (await AsyncCreditService(db).get_item_by_reference(reference())).success}
+
+    return app, [sync_engine, asyncpg_engine]
+
+
+async def throughput(client: httpx.AsyncClient, path: str, concurrency: int, requests: int) -> float:
+    remaining = iter(range(requests))
+
+    async def worker():
+        for _ in remaining:
+            response = await client.get(path)
+            response.raise_for_status()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return requests / (time.perf_counter() - started)
+
+
+async def bench(concurrency: list[int], requests: int, latency: float):
+    app, engines = create_app(max(concurrency), latency)
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app), base_url="http://bench") as client:
+            # open the pools' connections before timing anything
+            await throughput(client, "/sync", max(concurrency), max(concurrency))
+            await throughput(client, "/async", max(concurrency), max(concurrency))
+            print(f"{'in flight':>10}{'sync (req/s)':>16}{'async (req/s)':>16}{'speedup':>10}")
+            for in_flight in concurrency:
+                sync_rate = await throughput(client, "/sync", in_flight, requests)
+                async_rate = await throughput(client, "/async", in_flight, requests)
+                print(f"{in_flight:>10}{sync_rate:>16,.0f}{async_rate:>16,.0f}{async_rate / sync_rate:>10.2f}")
+    finally:
+        engines[0].dispose()
+        await engines[1].dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default=",".join(map(str, CONCURRENCY)),
+                        help="comma separated numbers of requests in flight")
+    parser.add_argument("--requests", type=int, default=REQUESTS, help="requests per measurement")
+    parser.add_argument("--latency-ms", type=float, default=LATENCY_MS,
+                        help="extra database time per request, 0 for none")
+    args = parser.parse_args()
+    database.init_engines()
+    asyncio.run(bench([int(value) for value in args.concurrency.split(",")], args.requests,
+                      args.latency_ms / 1000))
+
+
+if __name__ == "__main__":
+    main()
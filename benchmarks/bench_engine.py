@@ -0,0 +1,77 @@
+"""
+Micro-benchmarks of the promotion engine over generated promotion sets, without a database. Each
+benchmark times a batch of calls (e.g. 100 requests), not a single call.
+
+    python -m benchmarks.bench_engine --save before.json
+    python -m benchmarks.bench_engine --compare before.json --threshold 0.1
+
+--compare exits with status 1 when any benchmark is slower than the saved run by more than the threshold.
+"""
+import argparse
+import sys
+from benchmarks.fixtures import generate_promotions, generate_requests
+from benchmarks import harness
+from utils.promotion_compiler import CompiledPromotion, PromotionCandidates, select_best_promotion
+from utils.promotion_misc import eval_points_conditions, calculate_points, validate_promotions
+
+SIZES = [1, 10, 100, 1000, 10000]
+REQUESTS = 100
+POINTS_CONDITIONS = ["x < 900", "900 <= x < 5000", "x >= 5000", "x != 1000"]
+FORMULAS = ["x + 500", "(x - 900) * 1.5 + 500"]
+
+
+def collect(sizes: list[int]) -> dict:
+    requests = generate_requests(REQUESTS)
+    amounts = [amount for amount, _ in requests]
+    benchmarks = {
+        "eval_points_conditions": lambda: [eval_points_conditions(condition, amount)
+                                           for condition in POINTS_CONDITIONS for amount in amounts],
+        "calculate_points": lambda: [calculate_points(amount, formula) for formula in FORMULAS for amount in amounts[:10]],
+    }
+    for size in sizes:
+        models = generate_promotions(size)
+        promotions = [CompiledPromotion(promotion) for promotion in models]
+        candidates = PromotionCandidates(promotions)
+        conditions = [promotion.conditions for promotion in models]
+        benchmarks[f"validate_promotions[{size}]"] = \
+            lambda conditions=conditions: [validate_promotions(rule, info)
+                                           for rule in conditions for _, info in requests[:10]]
+        benchmarks[f"select_best_sequential[{size}]"] = \
+            lambda promotions=promotions: [select_best_promotion(promotions, amount, info) for amount, info in requests]
+        benchmarks[f"select_best[{size}]"] = \
+            lambda candidates=candidates: [candidates.select_best(amount, info) for amount, info in requests]
+    return benchmarks
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)),
+                        help="comma separated promotion set sizes")
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per timing run")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare against results saved by an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative slowdown counted as a regression (default 0.1 = 10%%)")
+    args = parser.parse_args(argv)
+
+    benchmarks = {name: function for name, function in collect([int(size) for size in args.sizes.split(",")]).items()
+                  if args.filter in name}
+    result = harness.run(benchmarks, args.min_time, args.repeat,
+                         report=lambda name, seconds: print(f"{name:<36}{seconds * 1e6:>14.1f} us"))
+    if args.save:
+        harness.save(result, args.save)
+
+    if args.compare:
+        rows = harness.compare(harness.load(args.compare), result, args.threshold)
+        print(f"\n{'benchmark':<36}{'baseline (us)':>16}{'current (us)':>16}{'ratio':>8}")
+        for name, baseline, current, ratio, status in rows:
+            print(f"{name:<36}{baseline * 1e6:>16.1f}{current * 1e6:>16.1f}{ratio:>8.2f}  {status}")
+        if any(status == "regression" for *_, status in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
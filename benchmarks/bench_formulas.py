@@ -0,0 +1,43 @@
+"""
+Compare the sympy formula path (utils.promotion_misc.calculate_points) with the precompiled formulas
+from utils.promotion_compiler.
+
+    python -m benchmarks.bench_formulas
+"""
+import timeit
+from utils.promotion_misc import calculate_points
+from utils.promotion_compiler import compile_formula
+
+FORMULAS = [
+    "x + 500",
+    "x * 1.5",
+    "(1.5 * x) + 200",
+    "(x-900) * 1.5 + 500",
+]
+AMOUNTS = [100, 900, 1500, 25000]
+NUMBER = 200
+
+
+def bench_sympy(formula: str) -> float:
+    timer = timeit.Timer(lambda: [calculate_points(amount, formula) for amount in AMOUNTS])
+    return min(timer.repeat(repeat=3, number=NUMBER)) / (NUMBER * len(AMOUNTS))
+
+
+def bench_compiled(formula: str) -> float:
+    function = compile_formula(formula)
+    timer = timeit.Timer(lambda: [int(function(amount)) for amount in AMOUNTS])
+    return min(timer.repeat(repeat=3, number=NUMBER)) / (NUMBER * len(AMOUNTS))
+
+
+def main():
+    print(f"{'formula':<24}{'sympy (us)':>14}{'compiled (us)':>16}{'speedup':>10}")
+    for formula in FORMULAS:
+        for amount in AMOUNTS:
+            assert calculate_points(amount, formula) == int(compile_formula(formula)(amount)), (formula, amount)
+        sympy_time = bench_sympy(formula)
+        compiled_time = bench_compiled(formula)
+        print(f"{formula:<24}{sympy_time * 1e6:>14.2f}{compiled_time * 1e6:>16.3f}{sympy_time / compiled_time:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Insert and lookup latency on a monthly-partitioned credit table against an unpartitioned one, using
+the configured database. Both scratch tables get the same generated rows (spread over --months months)
+and the same indexes as credit, and are dropped afterwards unless --keep is given.
+
+    python -m benchmarks.bench_partitions [--rows 50000000] [--months 24] [--samples 500]
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import date, datetime, timedelta
+from sqlalchemy import text
+from config import database
+from jobs.partitions import create_default_partition, create_partition, month_start
+
+COLUMNS = ("id bigint, member_id varchar, email varchar, reference uuid, airline_code varchar, "
+           "partner_code varchar, transaction_date timestamp, amount integer")
+MEMBERS = 1_000_000
+CHUNK = 1_000_000
+
+
+def create_tables(connection, months: int, first_month: date):
+    connection.execute(text("DROP TABLE IF EXISTS bench_credit_flat, bench_credit_part CASCADE"))
+    connection.execute(text(f"CREATE TABLE bench_credit_flat ({COLUMNS})"))
+    connection.execute(text(f"CREATE TABLE bench_credit_part ({COLUMNS}) PARTITION BY RANGE (transaction_date)"))
+    create_default_partition(connection, "bench_credit_part")
+    for offset in range(months + 1):
+        create_partition(connection, month_start(first_month, offset), "bench_credit_part")
+
+
+def load(table: str, rows: int, months: int, first_month: date):
+    seconds = (month_start(first_month, months) - first_month).days * 86400
+    for start in range(0, rows, CHUNK):
+        end = min(start + CHUNK, rows)
+        with database.engine.begin() as connection:
+            connection.execute(text(
+                f"INSERT INTO {table} SELECT i, lpad((i % {MEMBERS})::text, 10, '0'), "
+                f"'member' || (i % {MEMBERS}) || '@example.com', gen_random_uuid(), 'GJP', "
+                f"CASE WHEN i % 2 = 0 THEN 'DBS' ELSE 'OCBC' END, "
+                f"timestamp '{first_month}' + (i::float8 / {rows} * {seconds}) * interval '1 second', 100 + i % 5000 "
+                f"FROM generate_series({start}, {end - 1}) AS i"))
+        print(f"  {table}: {end:,} rows", flush=True)
+    with database.engine.begin() as connection:
+        for name, columns in [("member", "partner_code, member_id, airline_code"), ("email", "partner_code, email")]:
+            connection.execute(text(f"CREATE INDEX {table}_{name} ON {table} ({columns})"))
+        connection.execute(text(f"CREATE UNIQUE INDEX {table}_reference ON {table} (reference, transaction_date)"))
+        connection.execute(text(f"ANALYZE {table}"))
+
+
+def timed(connection, statement: str, parameters: list[dict]) -> list[float]:
+    timings = []
+    for values in parameters:
+        start = time.perf_counter()
+        connection.execute(text(statement), values).all()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def timed_inserts(table: str, samples: int) -> list[float]:
+    timings = []
+    with database.engine.connect() as connection:
+        for index in range(samples):
+            start = time.perf_counter()
+            connection.execute(text(f"INSERT INTO {table} VALUES (:id, '0000000001', 'new@example.com', "
+                                    "gen_random_uuid(), 'GJP', 'DBS', now(), 100)"), {"id": -index - 1})
+            connection.commit()
+            timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def summary(timings: list[float]) -> str:
+    timings = sorted(timings)
+    return f"p50 {statistics.median(timings):8.3f} ms   p99 {timings[int(len(timings) * 0.99) - 1]:8.3f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50_000_000)
+    parser.add_argument("--months", type=int, default=24)
+    parser.add_argument("--samples", type=int, default=500)
+    parser.add_argument("--keep", action="store_true", help="keep the tables (and reuse them with --reuse)")
+    parser.add_argument("--reuse", action="store_true", help="skip loading and use tables kept by --keep")
+    args = parser.parse_args()
+    database.init_engines()
+
+    first_month = month_start(datetime.now().date(), -(args.months - 1))
+    if not args.reuse:
+        with database.engine.begin() as connection:
+            create_tables(connection, args.months, first_month)
+        for table in ("bench_credit_flat", "bench_credit_part"):
+            start = time.perf_counter()
+            load(table, args.rows, args.months, first_month)
+            print(f"loaded and indexed {table} in {time.perf_counter() - start:.0f}s", flush=True)
+
+    rng = random.Random(0)
+    members = [{"member_id": f"{rng.randrange(MEMBERS):010d}"} for _ in range(args.samples)]
+    last_month = month_start(datetime.now().date(), -1)
+    hinted = [{**member, "from_date": last_month, "to_date": last_month + timedelta(days=62)} for member in members]
+    try:
+        for table in ("bench_credit_flat", "bench_credit_part"):
+            print(f"\n{table}")
+            with database.engine.connect() as connection:
+                references = [{"reference": reference, "transaction_date": transaction_date} for reference, transaction_date in
+                              connection.execute(text(f"SELECT reference, transaction_date FROM {table} "
+                                                      f"TABLESAMPLE SYSTEM (0.01) LIMIT {args.samples}")).all()]
+                by_member = (f"SELECT * FROM {table} WHERE partner_code = 'DBS' AND member_id = :member_id "
+                             "AND airline_code = 'GJP'")
+                for name, statement, parameters in [
+                    ("member lookup", by_member, members),
+                    ("member lookup, 2-month hint", by_member + " AND transaction_date >= :from_date "
+                                                                "AND transaction_date < :to_date", hinted),
+                    ("reference lookup", f"SELECT * FROM {table} WHERE reference = :reference", references),
+                    ("reference lookup, date hint", f"SELECT * FROM {table} WHERE reference = :reference "
+                                                    "AND transaction_date = :transaction_date", references),
+                ]:
+                    timed(connection, statement, parameters[:20])
+                    print(f"  {name:<30}{summary(timed(connection, statement, parameters))}")
+            print(f"  {'single-row insert + commit':<30}{summary(timed_inserts(table, args.samples))}")
+    finally:
+        if not args.keep:
+            with database.engine.begin() as connection:
+                connection.execute(text("DROP TABLE IF EXISTS bench_credit_flat, bench_credit_part CASCADE"))
+
+
+if __name__ == "__main__":
+    main()
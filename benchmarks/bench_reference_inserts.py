@@ -0,0 +1,68 @@
+"""
+Insert throughput into a table with a unique uuid index, for random (uuid4) against time-ordered (uuid7)
+references, using the configured database. Each scheme gets its own scratch table, filled in batches
+with COPY; the table is dropped afterwards.
+
+    python -m benchmarks.bench_reference_inserts [--rows 10000000] [--batch 100000]
+"""
+import argparse
+import io
+import time
+import uuid
+from config import database
+from utils.misc import uuid7
+
+SCHEMES = {"uuid4": uuid.uuid4, "uuid7": uuid7}
+
+
+def bench(scheme: str, rows: int, batch: int, report_every: int):
+    generate = SCHEMES[scheme]
+    table = f"bench_reference_{scheme}"
+    connection = database.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        cursor.execute(f"CREATE TABLE {table} (id bigserial PRIMARY KEY, reference uuid NOT NULL, amount integer)")
+        cursor.execute(f"CREATE UNIQUE INDEX {table}_reference ON {table} (reference)")
+        connection.commit()
+
+        start = last_report = time.perf_counter()
+        inserted = 0
+        while inserted < rows:
+            size = min(batch, rows - inserted)
+            buffer = io.StringIO("".join(f"{generate()}\t{index}\n" for index in range(size)))
+            cursor.copy_expert(f"COPY {table} (reference, amount) FROM STDIN", buffer)
+            connection.commit()
+            inserted += size
+            if inserted % report_every < size or inserted == rows:
+                now = time.perf_counter()
+                print(f"{scheme}  {inserted:>11,} rows  {report_every / (now - last_report):>10,.0f} rows/s (last)"
+                      f"  {inserted / (now - start):>10,.0f} rows/s (overall)")
+                last_report = now
+        elapsed = time.perf_counter() - start
+
+        cursor.execute(f"SELECT pg_relation_size('{table}_reference')")
+        index_size = cursor.fetchone()[0]
+        cursor.execute(f"DROP TABLE {table}")
+        connection.commit()
+        return elapsed, index_size
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--batch", type=int, default=100_000)
+    parser.add_argument("--report-every", type=int, default=1_000_000)
+    args = parser.parse_args()
+    database.init_engines()
+
+    results = {scheme: bench(scheme, args.rows, args.batch, args.report_every) for scheme in SCHEMES}
+    print(f"\n{'scheme':<8}{'seconds':>10}{'rows/s':>12}{'index MB':>10}")
+    for scheme, (elapsed, index_size) in results.items():
+        print(f"{scheme:<8}{elapsed:>10.1f}{args.rows / elapsed:>12,.0f}{index_size / 2 ** 20:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Startup time of one worker, each run in a fresh interpreter: importing main, creating the engines,
+the app's lifespan startup (with and without the WARMUP cache loading) and the first request that
+reaches the database, GET /loyalty/. Also shown is what importing sympy would add, which main no
+longer imports.
+
+    python -m benchmarks.bench_startup [--runs 5] [--save startup.json] [--compare startup.json]
+
+Every figure is the best of --runs processes. --compare exits with status 1 when any figure is
+slower than the saved run by more than the threshold.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from benchmarks import harness
+
+RUNS = 5
+
+# run in the child process; prints its timings, in seconds, as JSON
+CHILD = """
+import json, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+from config import database
+database.init_engines()
+engines = time.perf_counter()
+from fastapi.testclient import TestClient
+client = TestClient(main.app)
+with client:
+    ready = time.perf_counter()
+    client.get("/loyalty/").raise_for_status()
+    first_request = time.perf_counter()
+import sympy
+print(json.dumps({"import": imported - started, "engines": engines - imported,
+                  "startup": ready - engines, "first request": first_request - ready,
+                  "sympy import": time.perf_counter() - first_request}))
+"""
+
+
+def child_timings(warmup: bool) -> dict[str, float]:
+    # the queue pool, as a worker has; the test suite's conftest is not involved here
+    env = dict(os.environ, WARMUP="true" if warmup else "false", ASYNC_POOL=os.getenv("ASYNC_POOL", "queue"))
+    output = subprocess.run([sys.executable, "-c", CHILD], env=env, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def bench(runs: int) -> dict[str, float]:
+    results = {}
+    for warmup in (False, True):
+        for _ in range(runs):
+            for name, seconds in child_timings(warmup).items():
+                if name in ("startup", "first request"):
+                    name = f"{name} (WARMUP={'true' if warmup else 'false'})"
+                results[name] = min(results.get(name, seconds), seconds)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=RUNS, help="processes per configuration")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare with results saved by --save")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    current = harness.run({}, 0, 1)  # the metadata; the timings come from the child processes
+    current["results"] = bench(args.runs)
+    print(f"{'phase':<32}{'ms':>10}")
+    for name, seconds in current["results"].items():
+        print(f"{name:<32}{seconds * 1000:>10.1f}")
+    if args.save:
+        harness.save(current, args.save)
+    if args.compare:
+        rows = harness.compare(harness.load(args.compare), current, args.threshold)
+        for name, before, after, ratio, status in rows:
+            print(f"{name:<32}{before * 1000:>10.1f}{after * 1000:>10.1f}{ratio:>8.2f}  {status}")
+        if any(status == "regression" for *_, status in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Python time per query of the hot CRUD lookups, with each statement rebuilt on every call (as they were)
+against the prebuilt, parameterized statements the CRUD classes now execute.
+
+The session runs on a stub DBAPI that answers every SELECT with no rows, so no database is involved
+and what is timed is SQLAlchemy's work: building the statement, its compiled-cache lookup, executing
+through the dialect and setting up the result.
+
+    python -m benchmarks.bench_statements [--min-time 0.2]
+"""
+import argparse
+from datetime import datetime
+import psycopg2
+from sqlalchemy import create_engine, and_
+from sqlalchemy.dialects import registry
+from sqlalchemy.dialects.postgresql.psycopg2 import PGDialect_psycopg2
+from sqlalchemy.orm import Session
+from benchmarks import harness
+from models.credit import CreditModel, CreditIdempotencyModel
+from models.loyalty import LoyaltyModel
+from models.promotions import PromotionModel
+from models.user import UserModel
+from schemas.credit import CreditMember, CreditReference
+from services.credit import CreditCRUD
+from services.promotions import PromotionCRUD
+from services.user import UserCRUD
+from utils.misc import generate_reference, reference_date_window
+from utils.validators import validate_airline_code
+
+# what the dialect asks a new connection
+ANSWERS = {
+    "select pg_catalog.version()": ("PostgreSQL 16.0 on x86_64-pc-linux-gnu",),
+    "select current_schema()": ("public",),
+    "show standard_conforming_strings": ("on",),
+    "show transaction isolation level": ("read committed",),
+}
+
+
+class StubCursor(object):
+    """
+    Answers the dialect's connection queries, and any other SELECT with its columns and no rows
+    """
+
+    def __init__(self, connection: "StubConnection"):
+        self.connection = connection
+        self.description = None
+        self.rowcount = -1
+        self._rows = []
+
+    def execute(self, statement: str, parameters=None):
+        answer = ANSWERS.get(statement.strip().lower())
+        if answer is not None:
+            self._rows = [answer]
+            self.description = [("answer", None, None, None, None, None, None)]
+        elif statement.lstrip()[:6].upper() == "SELECT":
+            self._rows = []
+            columns = statement.lstrip()[6:].split(" FROM ", 1)[0].split(", ")
+            self.description = [(column.rsplit(" AS ", 1)[-1].rsplit(".", 1)[-1], None, None, None, None, None, None)
+                                for column in columns]
+        else:
+            self._rows = []
+            self.description = None
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchmany(self, size=None):
+        return self.fetchall()
+
+    def close(self):
+        pass
+
+
+class StubConnection(object):
+    autocommit = False
+    notices = []
+
+    def cursor(self, *args, **kwargs):
+        return StubCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class StubDBAPI(object):
+    """
+    psycopg2's module attributes (exceptions, paramstyle, version) with connections that go nowhere
+    """
+
+    def __getattr__(self, name):
+        return getattr(psycopg2, name)
+
+    def connect(self, *args, **kwargs):
+        return StubConnection()
+
+
+class StubDialect(PGDialect_psycopg2):
+    supports_statement_cache = True
+
+    @classmethod
+    def import_dbapi(cls):
+        return StubDBAPI()
+
+    def on_connect(self):
+        # psycopg2's type registration needs a real connection
+        return None
+
+
+registry.register("postgresql.stub", __name__, "StubDialect")
+
+
+def rebuilt(db: Session, reference: CreditReference, member: CreditMember) -> dict:
+    """
+    The lookups as they were written before the statements were prebuilt
+    """
+    window = reference_date_window(reference.reference)
+    return {
+        "credit_by_reference": lambda: db.query(CreditModel).filter(
+            CreditModel.reference == reference.reference, CreditModel.partner_code == reference.partner_code,
+            CreditModel.transaction_date >= window[0], CreditModel.transaction_date < window[1]).first(),
+        "credits_by_member": lambda: db.scalars(CreditCRUD.by_member_id_statement(member)).all(),
+        "credit_by_idempotency_key": lambda: db.query(CreditModel).join(
+            CreditIdempotencyModel, and_(CreditIdempotencyModel.reference == CreditModel.reference,
+                                         CreditIdempotencyModel.transaction_date == CreditModel.transaction_date)
+        ).filter(CreditIdempotencyModel.idempotency_key == "key", CreditIdempotencyModel.partner_code == "DBS").first(),
+        "has_credit": lambda: db.query(db.query(CreditModel).filter(
+            CreditModel.member_id == member.member_id, CreditModel.airline_code == member.airline_code)
+            .exists()).scalar(),
+        "promotions_by_partner": lambda: db.query(PromotionModel).filter(
+            PromotionModel.partner_code == "DBS", PromotionModel.expiry > datetime.now()).all(),
+        "user_by_email": lambda: db.query(UserModel).filter(UserModel.email == "partner@dbs.com").first(),
+        "program_by_id": lambda: db.query(LoyaltyModel).filter(LoyaltyModel.program_id == "GJP").first(),
+    }
+
+
+def prebuilt(db: Session, reference: CreditReference, member: CreditMember) -> dict:
+    credits, promotions, users = CreditCRUD(db), PromotionCRUD(db), UserCRUD(db)
+    return {
+        "credit_by_reference": lambda: credits.get_item_by_reference(reference),
+        "credits_by_member": lambda: credits.get_by_member_id(member),
+        "credit_by_idempotency_key": lambda: credits.get_item_by_idempotency_key("key", "DBS"),
+        "has_credit": lambda: credits.has_credit(member.member_id, member.airline_code),
+        "promotions_by_partner": lambda: promotions.get_all_promotions_partner("DBS"),
+        "user_by_email": lambda: users.get_by_email("partner@dbs.com"),
+        "program_by_id": lambda: validate_airline_code("GJP", db),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per timing run")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    db = Session(create_engine("postgresql+stub://", use_native_hstore=False))
+    reference = CreditReference(reference=generate_reference())
+    reference.set_partner_code("DBS")
+    member = CreditMember(member_id="1234567890", airline_code="GJP")
+    member.set_partner_code("DBS")
+
+    before = harness.run(rebuilt(db, reference, member), args.min_time, args.repeat)["results"]
+    after = harness.run(prebuilt(db, reference, member), args.min_time, args.repeat)["results"]
+    print(f"{'query':<28}{'rebuilt (us)':>14}{'prebuilt (us)':>15}{'speedup':>10}")
+    for name, seconds in before.items():
+        print(f"{name:<28}{seconds * 1e6:>14.1f}{after[name] * 1e6:>15.1f}{seconds / after[name]:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
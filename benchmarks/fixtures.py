@@ -0,0 +1,37 @@
+import random
+from datetime import datetime, timedelta
+from models.promotions import PromotionModel
+
+CARDS = ["black", "gold", "platinum", "signature", "infinite", "world", "titanium", "classic"]
+
+
+def generate_promotions(count: int, seed: int = 0, airline_code: str = "GJP",
+                        partner_code: str = "DBS") -> list[PromotionModel]:
+    """
+    Transient promotion rows shaped like the ones admins create: one or two card/spending conditions
+    and a tiered points rule with disjoint ranges
+    """
+    rng = random.Random(seed)
+    promotions = []
+    for promotion_id in range(1, count + 1):
+        threshold = rng.choice([500, 900, 1000, 2000, 5000])
+        bonus = rng.randrange(0, 2000, 50)
+        multiplier = rng.choice([1.1, 1.2, 1.5, 2, 3])
+        points_rule = {"point_condition": [
+            [f"x < {threshold}", f"x + {bonus}"],
+            [f"x >= {threshold}", f"(x - {threshold}) * {multiplier} + {threshold + bonus}"]
+        ]}
+        conditions = {"card": {"op": "eq", "value": rng.choice(CARDS)}}
+        if rng.random() < 0.5:
+            conditions["monthly_spending"] = {"op": "gt", "value": rng.randrange(0, 5000, 100)}
+        promotions.append(PromotionModel(id=promotion_id, airline_code=airline_code, partner_code=partner_code,
+                                         expiry=datetime.now() + timedelta(days=30), points_rule=points_rule,
+                                         conditions=conditions))
+    return promotions
+
+
+def generate_requests(count: int, seed: int = 0) -> list[tuple[int, dict]]:
+    rng = random.Random(seed)
+    return [(rng.choice([100, 500, 899, 900, 1500, 4000, 12000]),
+             {"card": rng.choice(CARDS), "monthly_spending": rng.randrange(0, 6000)})
+            for _ in range(count)]
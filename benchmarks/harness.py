@@ -0,0 +1,83 @@
+"""
+Timing, saving and comparing of benchmark results.
+
+Results are stored as JSON ({"meta": {...}, "results": {name: seconds per call}}) so runs from two
+commits can be compared with compare().
+"""
+import json
+import platform
+import subprocess
+import timeit
+from datetime import datetime
+from typing import Callable
+
+
+def measure(function: Callable[[], object], min_time: float = 0.2, repeat: int = 5) -> float:
+    """
+    Best seconds per call of function over repeat runs, each long enough to take about min_time.
+    """
+    timer = timeit.Timer(function)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2 if elapsed == 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    best = elapsed
+    for _ in range(repeat - 1):
+        best = min(best, timer.timeit(number))
+    return best / number
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(benchmarks: dict[str, Callable[[], object]], min_time: float = 0.2, repeat: int = 5,
+        report: Callable[[str, float], None] | None = None) -> dict:
+    results = {}
+    for name, function in benchmarks.items():
+        results[name] = measure(function, min_time, repeat)
+        if report is not None:
+            report(name, results[name])
+    return {"meta": {"revision": git_revision(),
+                     "python": platform.python_version(),
+                     "machine": platform.machine(),
+                     "date": datetime.now().isoformat(timespec="seconds")},
+            "results": results}
+
+
+def save(run_result: dict, path: str):
+    with open(path, "w") as file:
+        json.dump(run_result, file, indent=2, sort_keys=True)
+
+
+def load(path: str) -> dict:
+    with open(path) as file:
+        return json.load(file)
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.1) -> list[tuple[str, float, float, float, str]]:
+    """
+    (name, baseline, current, current / baseline, status) for every benchmark in both runs. status is
+    "regression" when current is slower than baseline by more than threshold (0.1 = 10%), "improvement"
+    when faster by more than threshold, and "ok" otherwise.
+    """
+    rows = []
+    for name, current_time in current["results"].items():
+        baseline_time = baseline["results"].get(name)
+        if baseline_time is None:
+            continue
+        ratio = current_time / baseline_time if baseline_time else float("inf")
+        if ratio > 1 + threshold:
+            status = "regression"
+        elif ratio < 1 / (1 + threshold):
+            status = "improvement"
+        else:
+            status = "ok"
+        rows.append((name, baseline_time, current_time, ratio, status))
+    return rows
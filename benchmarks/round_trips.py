@@ -0,0 +1,77 @@
+"""
+Count the database round trips of each accrual through CreditService.add_item against the configured
+database. Every statement and every COMMIT/ROLLBACK counts as one round trip.
+
+    python -m benchmarks.round_trips [--accruals 100]
+"""
+import argparse
+from sqlalchemy import event
+from config import database
+from models.credit import CreditModel, CreditMonthlyRollupModel
+from schemas.credit import CreditCreate
+from services.credit import CreditService
+
+MEMBER_ID = "9999999999"
+
+
+class RoundTripCounter(object):
+    def __init__(self):
+        self.statements = []
+        self.transactions = 0
+
+    def __enter__(self):
+        event.listen(database.engine, "before_cursor_execute", self._statement)
+        event.listen(database.engine, "commit", self._transaction)
+        event.listen(database.engine, "rollback", self._transaction)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(database.engine, "before_cursor_execute", self._statement)
+        event.remove(database.engine, "commit", self._transaction)
+        event.remove(database.engine, "rollback", self._transaction)
+
+    def _statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement.split(None, 1)[0].upper())
+
+    def _transaction(self, conn):
+        self.transactions += 1
+
+    @property
+    def total(self) -> int:
+        return len(self.statements) + self.transactions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accruals", type=int, default=100)
+    args = parser.parse_args()
+    database.init_engines()
+
+    db = database.SessionLocal()
+    try:
+        # warm the promotion index and seen-member filter so they don't count
+        CreditService(db).add_item(make_item(0))
+        with RoundTripCounter() as counter:
+            for index in range(args.accruals):
+                CreditService(db).add_item(make_item(index))
+        print(f"{counter.total / args.accruals:.2f} round trips per accrual "
+              f"({len(counter.statements) / args.accruals:.2f} statements, "
+              f"{counter.transactions / args.accruals:.2f} commits/rollbacks)")
+        for kind in sorted(set(counter.statements)):
+            print(f"  {kind:<10}{counter.statements.count(kind) / args.accruals:.2f}")
+    finally:
+        db.query(CreditModel).filter(CreditModel.member_id == MEMBER_ID).delete()
+        db.query(CreditMonthlyRollupModel).filter(CreditMonthlyRollupModel.member_id == MEMBER_ID).delete()
+        db.commit()
+        db.close()
+
+
+def make_item(index: int) -> CreditCreate:
+    item = CreditCreate(member_id=MEMBER_ID, amount=100 + index, first_name="Round", last_name="Trip",
+                        airline_code="GJP", email="round.trip@example.com", additional_info={})
+    item.set_partner_code("DBS")
+    return item
+
+
+if __name__ == "__main__":
+    main()
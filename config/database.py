@@ -1,7 +1,11 @@
-from sqlalchemy import create_engine
+from sqlalchemy import Engine, create_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker, declarative_base
 from dotenv import load_dotenv
+from utils.pool_stats import PoolStats, InstrumentedQueuePool, InstrumentedAsyncQueuePool, InstrumentedNullPool
+from utils.replicas import ReplicaSet, RoutingSession
 import os
+import threading
 
 load_dotenv()
 
@@ -9,18 +13,77 @@ USERNAME = os.getenv("USERNAME").lower()
 PASSWORD = os.getenv("PASSWORD")
 URL = os.getenv("URL")
 PORT = os.getenv("PORT")
+# "null" opens a connection per session, for callers that run each request on a new event loop (tests),
+# since asyncpg connections belong to the loop that opened them
+ASYNC_POOL = os.getenv("ASYNC_POOL", "queue")
+# connection pool of each engine; the defaults are SQLAlchemy's
+POOL_SIZE = int(os.getenv("POOL_SIZE", "5"))
+POOL_MAX_OVERFLOW = int(os.getenv("POOL_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("POOL_TIMEOUT", "30"))
+# seconds after which a connection is replaced at checkout, -1 for never
+POOL_RECYCLE = int(os.getenv("POOL_RECYCLE", "-1"))
+# test each connection with a round trip at checkout, replacing it if the server dropped it
+POOL_PRE_PING = os.getenv("POOL_PRE_PING", "false").lower() in ("1", "true", "yes")
+# milliseconds an API statement may run before the server cancels it, 0 for no limit
+STATEMENT_TIMEOUT = int(os.getenv("STATEMENT_TIMEOUT", "0"))
+# comma separated host:port of read replicas (same credentials), e.g. "replica1:5432,replica2:5432"
+REPLICAS = [address.strip() for address in os.getenv("REPLICAS", "").split(",") if address.strip()]
+# seconds to wait for a replica connection before passing the replica over
+REPLICA_CONNECT_TIMEOUT = float(os.getenv("REPLICA_CONNECT_TIMEOUT", "2"))
+
+POOL_OPTIONS = {"pool_size": POOL_SIZE, "max_overflow": POOL_MAX_OVERFLOW, "pool_timeout": POOL_TIMEOUT,
+                "pool_recycle": POOL_RECYCLE, "pool_pre_ping": POOL_PRE_PING}
 
 SQLALCHEMY_DATABASE_URL = f"postgresql://{USERNAME}:{PASSWORD}@{URL}:{PORT}"
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# The engines and session factories below are None until init_engines() creates them, so importing the
+# app neither loads the DBAPIs nor builds pools; the app's lifespan, the jobs and the scripts call it.
+engine: Engine | None = None
+SessionLocal: sessionmaker | None = None
+# the API's engine; the sync one above serves the jobs, migrations and NDJSON streams
+async_engine: AsyncEngine | None = None
+replicas: ReplicaSet | None = None
+AsyncSessionLocal: async_sessionmaker | None = None
+pool_stats: list[PoolStats] | None = None
+
+_engines_lock = threading.Lock()
+
+
+def create_api_engine(address: str, **connect_args):
+    # the statement timeout is only set here, as jobs and migrations legitimately run long statements
+    return create_async_engine(
+        f"postgresql+asyncpg://{USERNAME}:{PASSWORD}@{address}",
+        connect_args={"server_settings": {"statement_timeout": str(STATEMENT_TIMEOUT)}, **connect_args},
+        **({"poolclass": InstrumentedNullPool, "pool_recycle": POOL_RECYCLE, "pool_pre_ping": POOL_PRE_PING}
+           if ASYNC_POOL == "null" else {"poolclass": InstrumentedAsyncQueuePool, **POOL_OPTIONS})
+    )
+
+
+def init_engines():
+    """
+    Create the engines, session factories and pool stats, once. No connection is opened.
+    """
+    global engine, SessionLocal, async_engine, replicas, AsyncSessionLocal, pool_stats
+    with _engines_lock:
+        if pool_stats is not None:
+            return
+        engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=InstrumentedQueuePool, **POOL_OPTIONS)
+        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        async_engine = create_api_engine(f"{URL}:{PORT}")
+        replicas = ReplicaSet([create_api_engine(address, timeout=REPLICA_CONNECT_TIMEOUT) for address in REPLICAS])
+        # objects stay loaded after commit, since there is no lazy loading once the response is being built
+        AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False,
+                                               sync_session_class=RoutingSession, replicas=replicas)
+        pool_stats = [PoolStats("api", async_engine.sync_engine), PoolStats("sync", engine)] + \
+            [PoolStats(f"replica {address}", replica.sync_engine)
+             for address, replica in zip(REPLICAS, replicas.engines)]
+
 
 Base = declarative_base()
 
 
 def get_db():
+    init_engines()
     db = SessionLocal()
     try:
         yield db
@@ -28,5 +91,7 @@ def get_db():
         db.close()
 
 
-def create_tables():
-    Base.metadata.create_all(bind=engine)
+async def get_async_db():
+    init_engines()
+    async with AsyncSessionLocal() as db:
+        yield db
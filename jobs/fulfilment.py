@@ -0,0 +1,205 @@
+"""
+Accrual file fulfilment: delivers the "In Progress" credits of each loyalty program as an accrual file.
+
+Each program's pending credits are streamed through a server-side cursor into one file in that
+program's format, so memory stays flat however many credits are pending, and the written credits are
+marked "Submitted" in batched UPDATEs, which also queue the status notifications (see jobs.notifications).
+Files go to outbox/<airline_code>/, a local stand-in for the program's SFTP folder. A file only appears
+under its final name once complete, and the status updates commit after that, so a failure can lead
+to a file being sent twice (the program de-duplicates on the reference) but never to credits marked as
+sent without a file. Meant to run from cron:
+
+    python -m jobs.fulfilment [--outbox outbox] [--airline-code GJP ...]
+"""
+import argparse
+import os
+import string
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from sqlalchemy import Connection, Engine, Select, func, select, text, tuple_, update
+from models.credit import CreditModel, IN_PROGRESS, SUBMITTED
+from services.notification import NotificationCRUD, NOTIFICATION_COLUMNS
+
+# with hashtext(airline_code), the pg_try_advisory_xact_lock key held while a program's file is written
+LOCK_KEY = 7140002
+DEFAULT_OUTBOX = "outbox"
+BATCH_SIZE = 5000
+
+# the credit columns an accrual template can use, in the order they are selected
+COLUMNS = (CreditModel.id, CreditModel.transaction_date, CreditModel.reference, CreditModel.member_id,
+           CreditModel.first_name, CreditModel.last_name, CreditModel.email, CreditModel.amount,
+           CreditModel.airline_code, CreditModel.partner_code,
+           func.coalesce(CreditModel.promotion_id, 0).label("promotion_id"))
+FIELDS = {column.key: position for position, column in enumerate(COLUMNS)}
+
+
+class AccrualTemplate(object):
+    """
+    A program's accrual file format. row is a str.format template over the FIELDS of a credit, e.g.
+    "{member_id:<10}{amount:>12}" for fixed width; header and footer may use {airline_code} and {created},
+    and the footer also {count} and {total} (the summed amount). filename may use the same fields as the header.
+
+    The row template is compiled once into a positional format string, so rendering a credit is a single
+    str.format call over the selected row.
+    """
+
+    def __init__(self, row: str, header: str | None = None, footer: str | None = None,
+                 filename: str = "{airline_code}_{created:%Y%m%d%H%M%S}.txt", newline: str = "\n"):
+        self.row = row
+        self.header = header
+        self.footer = footer
+        self.filename = filename
+        self.newline = newline
+        self.render = self._compile(row).format
+
+    def _compile(self, row: str) -> str:
+        pieces = []
+        for literal, name, spec, conversion in string.Formatter().parse(row):
+            pieces.append(literal.replace("{", "{{").replace("}", "}}"))
+            if name is None:
+                continue
+            if name not in FIELDS:
+                raise ValueError(f"Unknown accrual template field: {name}")
+            if "{" in spec:
+                raise ValueError(f"Nested accrual template field in: {spec}")
+            pieces.append("{" + str(FIELDS[name]) + (f"!{conversion}" if conversion else "")
+                          + (f":{spec}" if spec else "") + "}")
+        return "".join(pieces) + self.newline.replace("{", "{{").replace("}", "}}")
+
+
+DEFAULT_TEMPLATE = AccrualTemplate(
+    header="member_id,first_name,last_name,transfer_date,amount,reference,partner_code",
+    row="{member_id},{first_name},{last_name},{transaction_date:%Y-%m-%d},{amount},{reference},{partner_code}",
+    filename="{airline_code}_{created:%Y%m%d%H%M%S}.csv")
+
+# formats agreed with each program; programs not listed get DEFAULT_TEMPLATE
+TEMPLATES = {
+    "GJP": AccrualTemplate(
+        header="H{airline_code:<10}{created:%Y%m%d%H%M%S}",
+        row="D{member_id:<10.10}{first_name:<30.30}{last_name:<30.30}{transaction_date:%Y%m%d}"
+            "{amount:>12}{reference}{partner_code:<10.10}",
+        footer="T{count:>10}{total:>15}"),
+}
+
+
+class AccrualFile(object):
+    def __init__(self, airline_code: str, path: Path, count: int, total: int, seconds: float):
+        self.airline_code = airline_code
+        self.path = path
+        self.count = count
+        self.total = total
+        self.seconds = seconds
+
+    def __repr__(self):
+        return f"<AccrualFile {self.path} count={self.count} total={self.total}>"
+
+
+def pending_statement(airline_code: str) -> Select:
+    return select(*COLUMNS).where(CreditModel.airline_code == airline_code, CreditModel.status == IN_PROGRESS) \
+        .order_by(CreditModel.id)
+
+
+def pending_programs(connection: Connection) -> list[str]:
+    return list(connection.execute(select(CreditModel.airline_code).distinct()
+                                   .where(CreditModel.status == IN_PROGRESS)
+                                   .order_by(CreditModel.airline_code)).scalars())
+
+
+def mark_submitted(connection: Connection, keys: list[tuple[int, datetime]]):
+    # (id, transaction_date) is the primary key, and naming the partition key lets each batch prune
+    updated = update(CreditModel).where(tuple_(CreditModel.id, CreditModel.transaction_date).in_(keys),
+                                        CreditModel.status == IN_PROGRESS) \
+        .values(status=SUBMITTED).returning(*NOTIFICATION_COLUMNS).cte("updated")
+    queued = NotificationCRUD.queue_status_notifications(updated).cte("queued")
+    connection.execute(select(func.count()).select_from(updated).add_cte(queued))
+
+
+def fulfil_program(connection: Connection, airline_code: str, template: AccrualTemplate, outbox: Path,
+                   batch_size: int = BATCH_SIZE, created: datetime | None = None) -> AccrualFile | None:
+    """
+    Write the program's accrual file and mark its credits submitted, in the caller's transaction, which
+    must commit for the statuses to stick. Returns None if there was nothing to send or another run holds
+    the program's lock.
+    """
+    started = time.perf_counter()
+    locked = connection.execute(text("SELECT pg_try_advisory_xact_lock(:key, hashtext(:airline_code))"),
+                                {"key": LOCK_KEY, "airline_code": airline_code}).scalar()
+    if not locked:
+        return None
+    result = connection.execute(pending_statement(airline_code).execution_options(yield_per=batch_size))
+    batches = result.partitions()
+    first = next(batches, None)
+    if first is None:
+        return None
+
+    fields = {"airline_code": airline_code, "created": created or datetime.now()}
+    directory = outbox / airline_code
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / template.filename.format_map(fields)
+    if path.exists():
+        raise FileExistsError(path)
+    partial = path.with_name(f".{path.name}.part")
+    count = total = 0
+    try:
+        with open(partial, "w", encoding="utf-8", newline="") as file:
+            if template.header is not None:
+                file.write(template.header.format_map(fields) + template.newline)
+            batch = first
+            while batch is not None:
+                file.writelines(template.render(*row) for row in batch)
+                count += len(batch)
+                total += sum(row.amount for row in batch)
+                mark_submitted(connection, [(row.id, row.transaction_date) for row in batch])
+                batch = next(batches, None)
+            if template.footer is not None:
+                file.write(template.footer.format_map({**fields, "count": count, "total": total}) + template.newline)
+            file.flush()
+            os.fsync(file.fileno())
+        # a hard link fails rather than replacing a file that appeared meanwhile
+        os.link(partial, path)
+    finally:
+        partial.unlink(missing_ok=True)
+    return AccrualFile(airline_code, path, count, total, time.perf_counter() - started)
+
+
+def fulfil(engine: Engine, outbox: str | Path = DEFAULT_OUTBOX, airline_codes: list[str] | None = None,
+           templates: dict[str, AccrualTemplate] | None = None, batch_size: int = BATCH_SIZE) -> list[AccrualFile]:
+    """
+    Write one accrual file per program with pending credits, each program in its own transaction
+    """
+    templates = TEMPLATES if templates is None else templates
+    if airline_codes is None:
+        with engine.connect() as connection:
+            airline_codes = pending_programs(connection)
+    files = []
+    for airline_code in airline_codes:
+        with engine.begin() as connection:
+            accrual_file = fulfil_program(connection, airline_code, templates.get(airline_code, DEFAULT_TEMPLATE),
+                                          Path(outbox), batch_size)
+        if accrual_file is not None:
+            files.append(accrual_file)
+    return files
+
+
+def main(argv: list[str] | None = None) -> int:
+    from config import database
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--outbox", default=DEFAULT_OUTBOX)
+    parser.add_argument("--airline-code", action="append", dest="airline_codes",
+                        help="only these programs (default: every program with pending credits)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+    database.init_engines()
+
+    for accrual_file in fulfil(database.engine, args.outbox, args.airline_codes, batch_size=args.batch_size):
+        rate = accrual_file.count / accrual_file.seconds if accrual_file.seconds else 0
+        print(f"{accrual_file.path}: {accrual_file.count} credits, {accrual_file.total} points "
+              f"in {accrual_file.seconds:.2f}s ({rate:,.0f} rows/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""
+Handback file ingestion: settles the credits in a loyalty program's handback file.
+
+A handback file has one CSV line per credit, transfer_date,amount,reference,outcome_code (an optional
+first line of column names is skipped). It is memory-mapped and cut into chunks at line boundaries.
+Each chunk is COPYed into a temporary staging table, then applied with one UPDATE ... FROM, which sets
+status (Approved for outcome 0000, Rejected otherwise) and outcome_code and queues the status
+notifications in the same statement (see jobs.notifications). Each chunk commits on its own.
+Credits already Approved or Rejected are left alone, so a file can safely be ingested again after a failure.
+
+    python -m jobs.handback AIRLINE_CODE FILE [FILE ...]
+"""
+import argparse
+import io
+import mmap
+import sys
+import time
+from pathlib import Path
+from typing import Iterator
+from sqlalchemy import BigInteger, Connection, Date, Engine, Select, String, Uuid, case, column, func, select, \
+    table, text, update
+from models.credit import CreditModel, APPROVED, REJECTED, TERMINAL_STATUSES
+from services.notification import NotificationCRUD, NOTIFICATION_COLUMNS
+
+HEADER = b"transfer_date,amount,reference,outcome_code"
+CHUNK_BYTES = 8 * 1024 * 1024
+SUCCESS = "0000"
+OUTCOMES = {
+    "0000": "Success",
+    "0001": "Member not found",
+    "0002": "Member name mismatch",
+    "0003": "Member account closed",
+    "0004": "Member account suspended",
+    "0005": "Member ineligible for accrual",
+    "0099": "Unable to process, please contact support for more information",
+}
+
+CREATE_STAGING = text("CREATE TEMPORARY TABLE IF NOT EXISTS handback_staging "
+                      "(transfer_date date NOT NULL, amount bigint, reference uuid NOT NULL, "
+                      "outcome_code varchar NOT NULL) ON COMMIT DELETE ROWS")
+staging = table("handback_staging", column("transfer_date", Date), column("amount", BigInteger),
+                column("reference", Uuid), column("outcome_code", String))
+
+
+def apply_statement(airline_code: str) -> Select:
+    """
+    Settle the staged credits and queue their notifications in one statement; selects the number updated
+    """
+    # the transfer date narrows each credit to the partitions around it (a day either side, for time zones)
+    updated = update(CreditModel) \
+        .values(status=case((staging.c.outcome_code == SUCCESS, APPROVED), else_=REJECTED),
+                outcome_code=staging.c.outcome_code) \
+        .where(CreditModel.reference == staging.c.reference, CreditModel.airline_code == airline_code,
+               CreditModel.transaction_date >= staging.c.transfer_date - 1,
+               CreditModel.transaction_date < staging.c.transfer_date + 2,
+               CreditModel.status.not_in(TERMINAL_STATUSES)) \
+        .returning(*NOTIFICATION_COLUMNS).cte("updated")
+    queued = NotificationCRUD.queue_status_notifications(updated).cte("queued")
+    return select(func.count()).select_from(updated).add_cte(queued)
+
+
+class HandbackResult(object):
+    def __init__(self, airline_code: str, path: Path):
+        self.airline_code = airline_code
+        self.path = path
+        self.rows = 0
+        self.updated = 0
+        self.seconds = 0.0
+
+    @property
+    def skipped(self) -> int:
+        """
+        Rows naming an unknown credit, another program's credit or one already settled
+        """
+        return self.rows - self.updated
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def __repr__(self):
+        return f"<HandbackResult {self.path} rows={self.rows} updated={self.updated}>"
+
+
+def chunks(path: str | Path, chunk_bytes: int = CHUNK_BYTES) -> Iterator[bytes]:
+    """
+    The file's contents in pieces of about chunk_bytes, each ending at a line boundary, header removed
+    """
+    with open(path, "rb") as file:
+        if file.seek(0, io.SEEK_END) == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            start = 0
+            if mapped[:len(HEADER)] == HEADER:
+                start = mapped.find(b"\n") + 1 or len(mapped)
+            while start < len(mapped):
+                end = mapped.find(b"\n", start + chunk_bytes - 1)
+                end = len(mapped) if end == -1 else end + 1
+                yield mapped[start:end]
+                start = end
+
+
+def apply_chunk(connection: Connection, airline_code: str, chunk: bytes) -> tuple[int, int]:
+    """
+    COPY one chunk into the staging table and apply it, in the caller's transaction. Returns the rows
+    read and the credits updated.
+    """
+    connection.execute(CREATE_STAGING)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert("COPY handback_staging FROM STDIN WITH (FORMAT csv)", io.BytesIO(chunk))
+        rows = cursor.rowcount
+    finally:
+        cursor.close()
+    updated = connection.execute(apply_statement(airline_code)).scalar()
+    return rows, updated
+
+
+def ingest(engine: Engine, airline_code: str, path: str | Path, chunk_bytes: int = CHUNK_BYTES) -> HandbackResult:
+    result = HandbackResult(airline_code, Path(path))
+    started = time.perf_counter()
+    with engine.connect() as connection:
+        for chunk in chunks(path, chunk_bytes):
+            with connection.begin():
+                rows, updated = apply_chunk(connection, airline_code, chunk)
+            result.rows += rows
+            result.updated += updated
+    result.seconds = time.perf_counter() - started
+    return result
+
+
+def main(argv: list[str] | None = None) -> int:
+    from config import database
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("airline_code")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--chunk-mb", type=float, default=CHUNK_BYTES / 1024 / 1024)
+    args = parser.parse_args(argv)
+    database.init_engines()
+
+    for path in args.files:
+        result = ingest(database.engine, args.airline_code, path, int(args.chunk_mb * 1024 * 1024))
+        print(f"{path}: {result.rows} rows, {result.updated} credits updated, {result.skipped} skipped "
+              f"in {result.seconds:.2f}s ({result.rows_per_second:,.0f} rows/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
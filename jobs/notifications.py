@@ -0,0 +1,200 @@
+"""
+Notification dispatcher: delivers the rows of notification_outbox to the registered targets.
+
+Status changes write their notifications to the outbox in the same transaction (see
+NotificationCRUD.queue_status_notifications), so nothing waits on a target and no notification is lost
+or sent for a change that rolled back. The dispatcher claims due rows in batches (FOR UPDATE SKIP LOCKED,
+with a lease, so several dispatchers can run side by side), POSTs each payload as JSON with bounded
+concurrency over one connection pool per target host, and records the outcomes. A failed delivery is
+retried with exponential backoff and jitter until max_attempts, after which failed_at is set; a
+4xx other than 408 or 429 is not retried. Delivery is at least once: receivers should de-duplicate on
+the X-Notification-Id header.
+
+    python -m jobs.notifications [--once] [--concurrency 20]
+"""
+import argparse
+import asyncio
+import random
+import sys
+from datetime import timedelta
+from urllib.parse import urlsplit
+import httpx
+from sqlalchemy import Boolean, Engine, Interval, bindparam, case, func, select, update
+from models.notification import NotificationOutboxModel, NotificationTargetModel
+
+BATCH_SIZE = 100
+CONCURRENCY = 20
+CONNECTIONS_PER_TARGET = 4
+TIMEOUT = 10.0
+MAX_ATTEMPTS = 8
+BACKOFF = 2.0
+MAX_BACKOFF = 3600.0
+LEASE = 60.0
+POLL_INTERVAL = 1.0
+# answers that will not change on a retry
+PERMANENT_STATUS_CODES = frozenset(range(400, 500)) - {408, 429}
+
+
+class Delivery(object):
+    __slots__ = ("id", "url", "payload", "attempts", "error", "permanent")
+
+    def __init__(self, id: int, url: str, payload: dict, attempts: int):
+        self.id = id
+        self.url = url
+        self.payload = payload
+        self.attempts = attempts
+        self.error = None
+        self.permanent = False
+
+
+class Dispatcher(object):
+    def __init__(self, engine: Engine, batch_size: int = BATCH_SIZE, concurrency: int = CONCURRENCY,
+                 connections_per_target: int = CONNECTIONS_PER_TARGET, timeout: float = TIMEOUT,
+                 max_attempts: int = MAX_ATTEMPTS, backoff: float = BACKOFF, max_backoff: float = MAX_BACKOFF,
+                 lease: float = LEASE):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.connections_per_target = connections_per_target
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lease = lease
+        self._clients: dict[str, httpx.AsyncClient] = {}
+        self._semaphore = None
+
+    async def run(self, poll_interval: float = POLL_INTERVAL, stop: asyncio.Event | None = None):
+        """
+        Dispatch until stop is set, sleeping for poll_interval whenever nothing is due
+        """
+        stop = stop or asyncio.Event()
+        while not stop.is_set():
+            if not await self.run_once():
+                try:
+                    await asyncio.wait_for(stop.wait(), poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def run_once(self) -> int:
+        """
+        Claim and deliver one batch of due notifications; returns the number claimed
+        """
+        deliveries = await asyncio.to_thread(self.claim)
+        if deliveries:
+            await asyncio.gather(*(self.deliver(delivery) for delivery in deliveries))
+            await asyncio.to_thread(self.record, deliveries)
+        return len(deliveries)
+
+    async def drain(self) -> int:
+        """
+        Run batches until nothing is due (retries scheduled for later are left); returns the number claimed
+        """
+        claimed = total = await self.run_once()
+        while claimed:
+            claimed = await self.run_once()
+            total += claimed
+        return total
+
+    async def aclose(self):
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+
+    def claim(self) -> list[Delivery]:
+        due = select(NotificationOutboxModel.id) \
+            .where(NotificationOutboxModel.sent_at.is_(None), NotificationOutboxModel.failed_at.is_(None),
+                   NotificationOutboxModel.next_attempt_at <= func.now()) \
+            .order_by(NotificationOutboxModel.next_attempt_at).limit(self.batch_size) \
+            .with_for_update(skip_locked=True)
+        # the lease keeps other dispatchers off these rows until the outcome is recorded (or it lapses);
+        # Core tables, since an ORM update only returns columns of the updated entity
+        outbox, target = NotificationOutboxModel.__table__, NotificationTargetModel.__table__
+        statement = update(outbox).where(outbox.c.id.in_(due.scalar_subquery()), target.c.id == outbox.c.target_id) \
+            .values(attempts=outbox.c.attempts + 1, next_attempt_at=func.now() + timedelta(seconds=self.lease)) \
+            .returning(outbox.c.id, target.c.url, outbox.c.payload, outbox.c.attempts)
+        with self.engine.begin() as connection:
+            return [Delivery(*row) for row in connection.execute(statement)]
+
+    async def deliver(self, delivery: Delivery):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            try:
+                response = await self.client(delivery.url).post(
+                    delivery.url, json=delivery.payload, headers={"X-Notification-Id": str(delivery.id)})
+            except httpx.HTTPError as error:
+                delivery.error = f"{type(error).__name__}: {error}"
+                return
+        if not response.is_success:
+            delivery.error = f"HTTP {response.status_code}"
+            delivery.permanent = response.status_code in PERMANENT_STATUS_CODES
+
+    def client(self, url: str) -> httpx.AsyncClient:
+        """
+        One client, and so one connection pool, per target host, so a slow target cannot hold every connection
+        """
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        client = self._clients.get(origin)
+        if client is None:
+            limits = httpx.Limits(max_connections=self.connections_per_target,
+                                  max_keepalive_connections=self.connections_per_target)
+            client = self._clients[origin] = httpx.AsyncClient(limits=limits, timeout=self.timeout)
+        return client
+
+    def retry_delay(self, attempts: int) -> float:
+        return min(self.max_backoff, self.backoff * 2 ** (attempts - 1)) * random.uniform(0.5, 1)
+
+    def record(self, deliveries: list[Delivery]):
+        sent = [delivery.id for delivery in deliveries if delivery.error is None]
+        failed = [{"outbox_id": delivery.id, "error": delivery.error[:1000],
+                   "delay": timedelta(seconds=self.retry_delay(delivery.attempts)),
+                   "give_up": delivery.permanent or delivery.attempts >= self.max_attempts}
+                  for delivery in deliveries if delivery.error is not None]
+        with self.engine.begin() as connection:
+            if sent:
+                connection.execute(update(NotificationOutboxModel).where(NotificationOutboxModel.id.in_(sent))
+                                   .values(sent_at=func.now(), last_error=None))
+            if failed:
+                connection.execute(update(NotificationOutboxModel)
+                                   .where(NotificationOutboxModel.id == bindparam("outbox_id"))
+                                   .values(next_attempt_at=func.now() + bindparam("delay", type_=Interval),
+                                           last_error=bindparam("error"),
+                                           failed_at=case((bindparam("give_up", type_=Boolean), func.now()))),
+                                   failed)
+
+
+async def dispatch(engine: Engine, once: bool = False, **options) -> int:
+    dispatcher = Dispatcher(engine, **options)
+    try:
+        if once:
+            return await dispatcher.drain()
+        await dispatcher.run()
+        return 0
+    finally:
+        await dispatcher.aclose()
+
+
+def main(argv: list[str] | None = None) -> int:
+    from config import database
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true", help="deliver what is due and exit")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--connections-per-target", type=int, default=CONNECTIONS_PER_TARGET)
+    parser.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS)
+    args = parser.parse_args(argv)
+    database.init_engines()
+
+    claimed = asyncio.run(dispatch(database.engine, args.once, batch_size=args.batch_size,
+                                   concurrency=args.concurrency, connections_per_target=args.connections_per_target,
+                                   max_attempts=args.max_attempts))
+    if args.once:
+        print(f"{claimed} notification(s) attempted")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
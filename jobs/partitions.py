@@ -0,0 +1,111 @@
+"""
+Monthly range partitions of the credit table (by transaction_date).
+
+Creates the partitions for the current month and the next months_ahead months, and detaches the
+partitions that ended more than retain_months ago (the detached tables are kept, renamed with an
+_archived suffix, for archiving or dropping). Meant to run daily, e.g. from cron:
+
+    python -m jobs.partitions [--months-ahead 3] [--retain-months 24]
+"""
+import argparse
+import sys
+from datetime import date, datetime
+from sqlalchemy import Connection, text
+
+TABLE = "credit"
+DEFAULT_PARTITION = f"{TABLE}_default"
+
+
+def month_start(day: date, offset: int = 0) -> date:
+    months = day.year * 12 + day.month - 1 + offset
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def partition_name(month: date, table: str = TABLE) -> str:
+    return f"{table}_p{month:%Y_%m}"
+
+
+def existing_partitions(connection: Connection, table: str = TABLE) -> list[str]:
+    return list(connection.execute(text("SELECT child.relname FROM pg_inherits "
+                                        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                                        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+                                        "WHERE parent.relname = :table ORDER BY child.relname"),
+                                   {"table": table}).scalars())
+
+
+def create_partition(connection: Connection, month: date, table: str = TABLE) -> bool:
+    """
+    Create the partition for month unless it exists. Rows for that month already in the default
+    partition are moved into it first, since attaching would otherwise fail.
+    """
+    name, start, end = partition_name(month, table), month, month_start(month, 1)
+    if name in existing_partitions(connection, table):
+        return False
+    bounds = {"start": start, "end": end}
+    in_default = connection.execute(text(f"SELECT EXISTS (SELECT 1 FROM {table}_default "
+                                         "WHERE transaction_date >= :start AND transaction_date < :end)"),
+                                    bounds).scalar()
+    if not in_default:
+        connection.execute(text(f"CREATE TABLE {name} PARTITION OF {table} "
+                                f"FOR VALUES FROM ('{start}') TO ('{end}')"))
+        return True
+    connection.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    connection.execute(text(f"WITH moved AS (DELETE FROM {table}_default "
+                            "WHERE transaction_date >= :start AND transaction_date < :end RETURNING *) "
+                            f"INSERT INTO {name} SELECT * FROM moved"), bounds)
+    connection.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {name} "
+                            f"FOR VALUES FROM ('{start}') TO ('{end}')"))
+    return True
+
+
+def create_default_partition(connection: Connection, table: str = TABLE):
+    """
+    Catches rows outside every monthly partition (including a NULL transaction_date)
+    """
+    connection.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"))
+
+
+def detach_partition(connection: Connection, name: str, table: str = TABLE):
+    connection.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+    connection.execute(text(f"ALTER TABLE {name} RENAME TO {name}_archived"))
+
+
+def maintain(connection: Connection, months_ahead: int = 3, retain_months: int | None = 24,
+             today: date | None = None, table: str = TABLE) -> tuple[list[str], list[str]]:
+    """
+    Return the partitions created and detached
+    """
+    today = today or datetime.now().date()
+    created = [partition_name(month_start(today, offset), table) for offset in range(months_ahead + 1)
+               if create_partition(connection, month_start(today, offset), table)]
+    detached = []
+    if retain_months is not None:
+        oldest = partition_name(month_start(today, -retain_months), table)
+        for name in existing_partitions(connection, table):
+            if name != f"{table}_default" and name < oldest:
+                detach_partition(connection, name, table)
+                detached.append(name)
+    return created, detached
+
+
+def main(argv: list[str] | None = None) -> int:
+    from config import database
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--months-ahead", type=int, default=3)
+    parser.add_argument("--retain-months", type=int, default=24,
+                        help="detach partitions that ended more than this many months ago (0 keeps all)")
+    args = parser.parse_args(argv)
+    database.init_engines()
+
+    with database.engine.begin() as connection:
+        created, detached = maintain(connection, args.months_ahead, args.retain_months or None)
+    for name in created:
+        print(f"created {name}")
+    for name in detached:
+        print(f"detached {name} (now {name}_archived)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,56 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from config.database import create_tables
+from config import database
+from routers.admin import router as admin_router
 from routers.credit import router as credit_router
 from routers.loyalty import router as loyalty_router
+from routers.notification import router as notification_router
 from routers.promotions import router as promotion_router
 from routers.user import router as user_router
 from fastapi.middleware.cors import CORSMiddleware
+from services.credit import seen_members
+from services.promotions import active_promotions
+from utils.status_events import status_events, PostgresChannel
+from utils.validators import loyalty_patterns
+import logging
+import os
 
+# WARMUP=false leaves the process-local caches to be loaded by the first requests that use them
+WARMUP = os.getenv("WARMUP", "true").lower() in ("1", "true", "yes")
 
-create_tables()
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+
+def warm_caches():
+    """
+    Load the seen-member filter, the active promotions and the loyalty patterns before the first request
+    """
+    with database.SessionLocal() as db:
+        for name, load in (("seen-member filter", seen_members.rebuild), ("active promotions", active_promotions.warm),
+                           ("loyalty patterns", loyalty_patterns.get)):
+            try:
+                load(db)
+            except Exception:
+                # loaded on first use instead, or for the seen-member filter by GET /admin/seen_members/
+                logger.exception("Could not load the %s at startup", name)
+                db.rollback()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    database.init_engines()
+    if WARMUP:
+        warm_caches()
+    # STATUS_CHANNEL=none leaves /credit/subscribe/ waiting out its timeout, e.g. where LISTEN is unavailable
+    if os.getenv("STATUS_CHANNEL", "postgres") == "postgres":
+        status_events.start(PostgresChannel(database.engine))
+    database.replicas.start()
+    yield
+    await database.replicas.stop()
+    status_events.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,7 +65,9 @@ app.add_middleware(
 async def root():
     return {"message": "Hello World"}
 
+app.include_router(admin_router)
 app.include_router(credit_router)
 app.include_router(loyalty_router)
+app.include_router(notification_router)
 app.include_router(promotion_router)
 app.include_router(user_router)
@@ -0,0 +1,13 @@
+"""
+Versioned schema migrations, run once per deployment rather than by every worker:
+
+    python -m migrations            apply pending migrations
+    python -m migrations status     list applied and pending migrations
+    python -m migrations check      fail if a hot query plans a sequential scan
+
+Migrations are the modules in migrations/versions, applied in name order and recorded in the
+schema_migrations table.
+"""
+from migrations.runner import Migration, discover, applied_versions, upgrade, create_index_concurrently, \
+    create_partitioned_index_concurrently
+from migrations.plan_check import hot_queries, sequential_scans
@@ -0,0 +1,34 @@
+import argparse
+import sys
+from config import database
+from migrations.runner import discover, applied_versions, upgrade
+from migrations.plan_check import sequential_scans
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m migrations")
+    parser.add_argument("command", nargs="?", default="upgrade", choices=["upgrade", "status", "check"])
+    args = parser.parse_args(argv)
+    database.init_engines()
+
+    if args.command == "upgrade":
+        applied = upgrade(database.engine)
+        print(f"applied {len(applied)} migration(s)" if applied else "up to date")
+        return 0
+
+    with database.engine.connect() as connection:
+        if args.command == "status":
+            applied = applied_versions(connection)
+            for migration in discover():
+                print(f"{'applied' if migration.version in applied else 'pending':<9}{migration.version}  "
+                      f"{migration.description}")
+            return 0
+
+        failures = sequential_scans(connection)
+    for name in failures:
+        print(f"sequential scan: {name}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,54 @@
+from datetime import datetime
+from sqlalchemy import Connection, Select, select, text
+from models.credit import CreditModel, CreditMonthlyRollupModel, CreditIdempotencyModel
+from models.promotions import PromotionModel
+from schemas.credit import CreditMember, CreditEmail
+from services.credit import CreditCRUD
+from jobs.fulfilment import pending_statement
+
+
+def hot_queries() -> dict[str, Select]:
+    """
+    The queries run on every accrual or enquiry, with placeholder values
+    """
+    member = CreditMember(member_id="1234567890", airline_code="GJP")
+    member.set_partner_code("DBS")
+    email = CreditEmail(email="member@example.com")
+    email.set_partner_code("DBS")
+    return {
+        "credit by member id": CreditCRUD.by_member_id_statement(member),
+        "credit by email": CreditCRUD.by_email_statement(email),
+        "credit by reference": select(CreditModel).where(CreditModel.reference == "01900000-0000-7000-8000-000000000000",
+                                                         CreditModel.partner_code == "DBS"),
+        "credit by idempotency key": select(CreditIdempotencyModel).where(
+            CreditIdempotencyModel.idempotency_key == "key", CreditIdempotencyModel.partner_code == "DBS"),
+        "member has credit": select(CreditModel.id).where(CreditModel.member_id == "1234567890",
+                                                          CreditModel.airline_code == "GJP").limit(1),
+        "monthly rollup": select(CreditMonthlyRollupModel).where(
+            CreditMonthlyRollupModel.member_id == "1234567890", CreditMonthlyRollupModel.airline_code == "GJP",
+            CreditMonthlyRollupModel.partner_code == "DBS", CreditMonthlyRollupModel.month == datetime(2024, 1, 1)),
+        "promotions by airline and partner": select(PromotionModel).where(PromotionModel.airline_code == "GJP",
+                                                                          PromotionModel.partner_code == "DBS",
+                                                                          PromotionModel.expiry > datetime.now()),
+        "pending credits by program": pending_statement("GJP"),
+    }
+
+
+def _has_seq_scan(plan: dict) -> bool:
+    return plan.get("Node Type") == "Seq Scan" or any(_has_seq_scan(child) for child in plan.get("Plans", []))
+
+
+def sequential_scans(connection: Connection) -> list[str]:
+    """
+    Names of the hot queries that still plan a sequential scan with enable_seqscan off, i.e. that have no
+    usable index. (With it on, small tables are scanned sequentially whatever the indexes.)
+    """
+    failures = []
+    with connection.begin():
+        connection.execute(text("SET LOCAL enable_seqscan = off"))
+        for name, statement in hot_queries().items():
+            compiled = statement.compile(dialect=connection.dialect)
+            plan = connection.exec_driver_sql("EXPLAIN (FORMAT JSON) " + compiled.string, compiled.params).scalar()
+            if _has_seq_scan(plan[0]["Plan"]):
+                failures.append(name)
+    return failures
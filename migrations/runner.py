@@ -0,0 +1,112 @@
+import importlib
+import pkgutil
+from datetime import datetime
+from types import ModuleType
+from sqlalchemy import Connection, Engine, text
+import migrations.versions
+
+# pg_advisory_lock key held while migrating, so concurrent runs apply each migration once
+LOCK_KEY = 7140001
+
+
+class Migration(object):
+    """
+    A module in migrations/versions with an upgrade(connection) function. Migrations run in one transaction
+    unless the module sets TRANSACTIONAL = False (needed for CREATE INDEX CONCURRENTLY), in which case
+    each statement autocommits and upgrade() must be safe to run again after a failure.
+    """
+
+    def __init__(self, module: ModuleType):
+        self.version = module.__name__.rsplit(".", 1)[-1]
+        self.description = (module.__doc__ or "").strip().split("\n")[0]
+        self.transactional = getattr(module, "TRANSACTIONAL", True)
+        self.upgrade = module.upgrade
+
+
+def discover() -> list[Migration]:
+    names = sorted(name for _, name, _ in pkgutil.iter_modules(migrations.versions.__path__))
+    return [Migration(importlib.import_module(f"migrations.versions.{name}")) for name in names]
+
+
+def ensure_migrations_table(connection: Connection):
+    connection.execute(text("CREATE TABLE IF NOT EXISTS schema_migrations "
+                            "(version VARCHAR PRIMARY KEY, applied_at TIMESTAMP NOT NULL)"))
+
+
+def applied_versions(connection: Connection) -> set[str]:
+    exists = connection.execute(text("SELECT to_regclass('schema_migrations')")).scalar()
+    if exists is None:
+        return set()
+    return set(connection.execute(text("SELECT version FROM schema_migrations")).scalars())
+
+
+def upgrade(engine: Engine, report=print) -> list[str]:
+    """
+    Apply the pending migrations in order and return their versions
+    """
+    applied = []
+    # autocommit, so the lock connection holds no snapshot that CREATE INDEX CONCURRENTLY would wait on
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": LOCK_KEY})
+        try:
+            ensure_migrations_table(connection)
+            done = applied_versions(connection)
+            for migration in discover():
+                if migration.version in done:
+                    continue
+                report(f"applying {migration.version}: {migration.description}")
+                if migration.transactional:
+                    with engine.begin() as transaction:
+                        migration.upgrade(transaction)
+                        record(transaction, migration.version)
+                else:
+                    migration.upgrade(connection)
+                    record(connection, migration.version)
+                applied.append(migration.version)
+        finally:
+            connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": LOCK_KEY})
+    return applied
+
+
+def record(connection: Connection, version: str):
+    connection.execute(text("INSERT INTO schema_migrations (version, applied_at) VALUES (:version, :applied_at)"),
+                       {"version": version, "applied_at": datetime.now()})
+
+
+def create_index_concurrently(connection: Connection, name: str, table: str, columns: list[str],
+                              unique: bool = False):
+    """
+    CREATE INDEX CONCURRENTLY on an autocommit connection. An INVALID index left by an earlier failed
+    attempt is dropped first, since IF NOT EXISTS would otherwise keep it.
+    """
+    invalid = connection.execute(text("SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"),
+                                 {"name": name}).scalar()
+    if invalid:
+        connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    connection.execute(text(f'CREATE {"UNIQUE " if unique else ""}INDEX CONCURRENTLY IF NOT EXISTS "{name}" '
+                            f'ON "{table}" ({column_list})'))
+
+
+def create_partitioned_index_concurrently(connection: Connection, name: str, table: str, columns: list[str],
+                                          where: str | None = None):
+    """
+    CREATE INDEX CONCURRENTLY for a partitioned table, which does not support it directly: the parent index
+    is created ON ONLY the table (invalid, and not used, until complete), each partition's index is built
+    concurrently and attached, and the parent becomes valid once the last one is. Partitions created later
+    get the index automatically.
+    """
+    from jobs.partitions import existing_partitions
+
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    predicate = f" WHERE {where}" if where else ""
+    connection.execute(text(f'CREATE INDEX IF NOT EXISTS "{name}" ON ONLY "{table}" ({column_list}){predicate}'))
+    for partition in existing_partitions(connection, table):
+        child = f"{name}_{partition.removeprefix(table + '_')}"
+        invalid = connection.execute(text("SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"),
+                                     {"name": child}).scalar()
+        if invalid:
+            connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{child}"'))
+        connection.execute(text(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{child}" '
+                                f'ON "{partition}" ({column_list}){predicate}'))
+        connection.execute(text(f'ALTER INDEX "{name}" ATTACH PARTITION "{child}"'))
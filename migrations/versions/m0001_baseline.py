@@ -0,0 +1,87 @@
+"""
+Tables as the first deployments created them, plus columns added after those deployments
+"""
+from sqlalchemy import Connection, text
+
+# The schema create_all() made from the models before migrations existed, frozen here so that a new
+# database goes through the same history as the existing ones. IF NOT EXISTS, as those already have it.
+BASELINE = [
+    """CREATE TABLE IF NOT EXISTS credit (
+        id SERIAL NOT NULL,
+        member_id VARCHAR,
+        first_name VARCHAR,
+        last_name VARCHAR,
+        email VARCHAR,
+        reference UUID,
+        airline_code VARCHAR,
+        partner_code VARCHAR,
+        transaction_date TIMESTAMP WITHOUT TIME ZONE,
+        amount INTEGER,
+        additional_info JSONB,
+        promotion_id INTEGER,
+        status VARCHAR,
+        PRIMARY KEY (id),
+        CONSTRAINT uix_1 UNIQUE (reference),
+        UNIQUE (reference)
+    )""",
+    "CREATE INDEX IF NOT EXISTS ix_credit_id ON credit (id)",
+    """CREATE TABLE IF NOT EXISTS credit_monthly_rollup (
+        member_id VARCHAR NOT NULL,
+        airline_code VARCHAR NOT NULL,
+        partner_code VARCHAR NOT NULL,
+        month DATE NOT NULL,
+        amount BIGINT NOT NULL,
+        points BIGINT NOT NULL,
+        transactions INTEGER NOT NULL,
+        PRIMARY KEY (member_id, airline_code, partner_code, month)
+    )""",
+    """CREATE TABLE IF NOT EXISTS loyalty (
+        id SERIAL NOT NULL,
+        program_id VARCHAR,
+        program_name VARCHAR,
+        currency_name VARCHAR,
+        processing_time VARCHAR,
+        description VARCHAR,
+        enrollment_link VARCHAR,
+        terms_link VARCHAR,
+        regex_pattern VARCHAR NOT NULL,
+        PRIMARY KEY (id),
+        UNIQUE (program_id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS ix_loyalty_id ON loyalty (id)",
+    """CREATE TABLE IF NOT EXISTS promotions (
+        id SERIAL NOT NULL,
+        airline_code VARCHAR NOT NULL,
+        partner_code VARCHAR,
+        expiry TIMESTAMP WITHOUT TIME ZONE,
+        points_rule JSONB NOT NULL,
+        conditions JSONB NOT NULL,
+        name VARCHAR NOT NULL,
+        description VARCHAR NOT NULL,
+        start_date_for_card TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        end_date_for_card TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        PRIMARY KEY (id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS ix_promotions_id ON promotions (id)",
+    """CREATE TABLE IF NOT EXISTS "user" (
+        id SERIAL NOT NULL,
+        email VARCHAR,
+        password VARCHAR,
+        disabled BOOLEAN,
+        roles VARCHAR,
+        partner_code VARCHAR,
+        PRIMARY KEY (id),
+        CONSTRAINT uix_2 UNIQUE (email),
+        UNIQUE (email)
+    )""",
+    'CREATE INDEX IF NOT EXISTS ix_user_id ON "user" (id)',
+]
+
+
+def upgrade(connection: Connection):
+    for statement in BASELINE:
+        connection.execute(text(statement))
+    # patched in by create_tables() on deployments made before it was a column of the model
+    connection.execute(text("ALTER TABLE credit ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR"))
+    connection.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uix_credit_idempotency "
+                            "ON credit (partner_code, idempotency_key)"))
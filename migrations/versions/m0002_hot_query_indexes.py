@@ -0,0 +1,16 @@
+"""
+Composite indexes for the credit lookups and the airline/partner promotion query
+"""
+from sqlalchemy import Connection
+from migrations.runner import create_index_concurrently
+
+TRANSACTIONAL = False
+
+
+def upgrade(connection: Connection):
+    create_index_concurrently(connection, "ix_credit_partner_member_airline", "credit",
+                              ["partner_code", "member_id", "airline_code"])
+    create_index_concurrently(connection, "ix_credit_partner_email", "credit", ["partner_code", "email"])
+    create_index_concurrently(connection, "ix_credit_airline_member", "credit", ["airline_code", "member_id"])
+    create_index_concurrently(connection, "ix_promotions_airline_partner_expiry", "promotions",
+                              ["airline_code", "partner_code", "expiry"])
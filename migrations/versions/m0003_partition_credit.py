@@ -0,0 +1,54 @@
+"""
+Range-partition credit by transaction_date month and move idempotency keys to credit_idempotency
+"""
+from sqlalchemy import Connection, text
+from datetime import date, datetime
+
+
+def month_start(day: date, offset: int = 0) -> date:
+    months = day.year * 12 + day.month - 1 + offset
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def upgrade(connection: Connection):
+    # runs in one transaction and holds an exclusive lock on credit while the rows are copied
+    connection.execute(text("ALTER TABLE credit RENAME TO credit_unpartitioned"))
+    connection.execute(text("ALTER SEQUENCE credit_id_seq OWNED BY NONE"))
+    connection.execute(text("CREATE TABLE credit (LIKE credit_unpartitioned INCLUDING DEFAULTS) "
+                            "PARTITION BY RANGE (transaction_date)"))
+    connection.execute(text("CREATE TABLE credit_default PARTITION OF credit DEFAULT"))
+
+    oldest = connection.execute(text("SELECT min(transaction_date) FROM credit_unpartitioned")).scalar()
+    month, last = month_start(oldest or datetime.now()), month_start(datetime.now(), 3)
+    while month <= last:
+        # the rows are copied in below, so every partition starts empty
+        connection.execute(text(f"CREATE TABLE credit_p{month:%Y_%m} PARTITION OF credit "
+                                f"FOR VALUES FROM ('{month}') TO ('{month_start(month, 1)}')"))
+        month = month_start(month, 1)
+
+    connection.execute(text("INSERT INTO credit SELECT * FROM credit_unpartitioned"))
+    connection.execute(text("SELECT setval('credit_id_seq', (SELECT coalesce(max(id), 0) + 1 FROM credit), false)"))
+    connection.execute(text("ALTER SEQUENCE credit_id_seq OWNED BY credit.id"))
+
+    connection.execute(text("""CREATE TABLE IF NOT EXISTS credit_idempotency (
+        partner_code VARCHAR NOT NULL,
+        idempotency_key VARCHAR NOT NULL,
+        reference UUID NOT NULL,
+        transaction_date TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        PRIMARY KEY (partner_code, idempotency_key)
+    )"""))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_credit_idempotency_reference "
+                            "ON credit_idempotency (reference)"))
+    connection.execute(text("INSERT INTO credit_idempotency (partner_code, idempotency_key, reference, transaction_date) "
+                            "SELECT partner_code, idempotency_key, reference, transaction_date "
+                            "FROM credit_unpartitioned WHERE idempotency_key IS NOT NULL "
+                            "ON CONFLICT DO NOTHING"))
+    connection.execute(text("DROP TABLE credit_unpartitioned"))
+
+    # indexes on the partitioned table are created on every partition, present and future
+    connection.execute(text("ALTER TABLE credit ADD PRIMARY KEY (id, transaction_date)"))
+    connection.execute(text("ALTER TABLE credit ADD CONSTRAINT uix_1 UNIQUE (reference, transaction_date)"))
+    connection.execute(text("CREATE INDEX ix_credit_partner_member_airline ON credit "
+                            "(partner_code, member_id, airline_code)"))
+    connection.execute(text("CREATE INDEX ix_credit_partner_email ON credit (partner_code, email)"))
+    connection.execute(text("CREATE INDEX ix_credit_airline_member ON credit (airline_code, member_id)"))
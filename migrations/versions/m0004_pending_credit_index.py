@@ -0,0 +1,13 @@
+"""
+Partial index on the credits waiting for an accrual file, read by jobs.fulfilment
+"""
+from sqlalchemy import Connection
+from migrations.runner import create_partitioned_index_concurrently
+from models.credit import IN_PROGRESS
+
+TRANSACTIONAL = False
+
+
+def upgrade(connection: Connection):
+    create_partitioned_index_concurrently(connection, "ix_credit_pending", "credit", ["airline_code", "id"],
+                                          where=f"status = '{IN_PROGRESS}'")
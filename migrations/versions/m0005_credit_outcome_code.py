@@ -0,0 +1,9 @@
+"""
+Outcome code from the loyalty program's handback file, read by jobs.handback
+"""
+from sqlalchemy import Connection, text
+
+
+def upgrade(connection: Connection):
+    # nullable with no default, so this only changes the catalog and is instant on every partition
+    connection.execute(text("ALTER TABLE credit ADD COLUMN IF NOT EXISTS outcome_code VARCHAR"))
@@ -0,0 +1,38 @@
+"""
+Notification targets and the transactional outbox drained by jobs.notifications
+"""
+from sqlalchemy import Connection, text
+
+TABLES = [
+    """CREATE TABLE IF NOT EXISTS notification_target (
+        id SERIAL NOT NULL,
+        partner_code VARCHAR NOT NULL,
+        url VARCHAR NOT NULL,
+        description VARCHAR,
+        active BOOLEAN DEFAULT true NOT NULL,
+        PRIMARY KEY (id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS ix_notification_target_id ON notification_target (id)",
+    "CREATE INDEX IF NOT EXISTS ix_notification_target_partner_code ON notification_target (partner_code)",
+    """CREATE TABLE IF NOT EXISTS notification_outbox (
+        id BIGSERIAL NOT NULL,
+        target_id INTEGER NOT NULL,
+        reference UUID NOT NULL,
+        payload JSONB NOT NULL,
+        created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now() NOT NULL,
+        next_attempt_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now() NOT NULL,
+        attempts INTEGER DEFAULT 0 NOT NULL,
+        sent_at TIMESTAMP WITHOUT TIME ZONE,
+        failed_at TIMESTAMP WITHOUT TIME ZONE,
+        last_error VARCHAR,
+        PRIMARY KEY (id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS ix_notification_outbox_due ON notification_outbox (next_attempt_at) "
+    "WHERE sent_at IS NULL AND failed_at IS NULL",
+    "CREATE INDEX IF NOT EXISTS ix_notification_outbox_reference ON notification_outbox (reference)",
+]
+
+
+def upgrade(connection: Connection):
+    for statement in TABLES:
+        connection.execute(text(statement))
@@ -0,0 +1,20 @@
+"""
+NOTIFY credit_status on every credit status change, feeding utils.status_events
+"""
+from sqlalchemy import Connection, text
+from utils.status_events import CHANNEL
+
+
+def upgrade(connection: Connection):
+    connection.execute(text(f"""
+        CREATE OR REPLACE FUNCTION credit_status_notify() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('{CHANNEL}', json_build_object('reference', NEW.reference, 'status', NEW.status,
+                                                             'outcome_code', NEW.outcome_code)::text);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql"""))
+    # a row trigger on the partitioned table is cloned onto every partition, present and future
+    connection.execute(text("DROP TRIGGER IF EXISTS credit_status_notify ON credit"))
+    connection.execute(text("CREATE TRIGGER credit_status_notify AFTER UPDATE OF status ON credit FOR EACH ROW "
+                            "WHEN (OLD.status IS DISTINCT FROM NEW.status) EXECUTE FUNCTION credit_status_notify()"))
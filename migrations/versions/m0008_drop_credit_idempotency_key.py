@@ -0,0 +1,10 @@
+"""
+Drop credit.idempotency_key, unused since m0003 moved the keys to credit_idempotency
+"""
+from sqlalchemy import Connection, text
+
+
+def upgrade(connection: Connection):
+    # m0003 did not carry uix_credit_idempotency over to the partitioned table; the drop only changes the catalog
+    connection.execute(text("DROP INDEX IF EXISTS uix_credit_idempotency"))
+    connection.execute(text("ALTER TABLE credit DROP COLUMN IF EXISTS idempotency_key"))
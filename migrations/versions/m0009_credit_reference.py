@@ -0,0 +1,17 @@
+"""
+credit_reference: a claim on every credit's reference, as the partitioned credit table cannot keep it unique
+"""
+from sqlalchemy import Connection, text
+
+
+def upgrade(connection: Connection):
+    connection.execute(text("""CREATE TABLE IF NOT EXISTS credit_reference (
+        reference UUID NOT NULL,
+        transaction_date TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        PRIMARY KEY (reference)
+    )"""))
+    # the credits that workers of the previous release insert after this has run are not claimed
+    connection.execute(text("INSERT INTO credit_reference (reference, transaction_date) "
+                            "SELECT reference, transaction_date FROM credit "
+                            "WHERE reference IS NOT NULL AND transaction_date IS NOT NULL "
+                            "ON CONFLICT DO NOTHING"))
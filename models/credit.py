@@ -1,26 +1,85 @@
 from config.database import Base
-from sqlalchemy import Column, Integer, String, DateTime, UniqueConstraint, Uuid
+from sqlalchemy import Column, Integer, BigInteger, String, Date, DateTime, UniqueConstraint, Uuid, Index, text
 from sqlalchemy.dialects.postgresql import JSONB
 
+# credit.status values: accepted, written to the program's accrual file, then settled by its handback file
+IN_PROGRESS = "In Progress"
+SUBMITTED = "Submitted"
+APPROVED = "Approved"
+REJECTED = "Rejected"
+# a handback file never changes these again
+TERMINAL_STATUSES = (APPROVED, REJECTED)
+
 
 class CreditModel(Base):
+    """
+    Range-partitioned by transaction_date month (migration m0003, partitions kept by jobs.partitions), so
+    every unique key includes transaction_date; idempotency keys live in CreditIdempotencyModel and
+    references are kept unique by CreditReferenceModel instead.
+    """
     __tablename__ = "credit"
 
-    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
     member_id = Column(String)
     first_name = Column(String)
     last_name = Column(String)
     email = Column(String)
-    reference = Column(Uuid, unique=True)
+    reference = Column(Uuid)
     airline_code = Column(String)
     partner_code = Column(String)
-    transaction_date = Column(DateTime)
+    transaction_date = Column(DateTime, primary_key=True)
     amount = Column(Integer)
     additional_info = Column(JSONB, nullable=True, default={})
     promotion_id = Column(Integer)
-    
+
     status = Column(String)
+    # the program's outcome code from the handback file (see jobs.handback.OUTCOMES)
+    outcome_code = Column(String, nullable=True)
 
     __table_args__ = (
-        UniqueConstraint('reference', name='uix_1'),
+        UniqueConstraint('reference', 'transaction_date', name='uix_1'),
+        Index('ix_credit_partner_member_airline', 'partner_code', 'member_id', 'airline_code'),
+        Index('ix_credit_partner_email', 'partner_code', 'email'),
+        Index('ix_credit_airline_member', 'airline_code', 'member_id'),
+        Index('ix_credit_pending', 'airline_code', 'id', postgresql_where=text(f"status = '{IN_PROGRESS}'")),
     )
+
+
+class CreditIdempotencyModel(Base):
+    """
+    Idempotency keys used by each partner and the credit each one created. Kept outside the partitioned
+    credit table because a unique key there must include transaction_date.
+    """
+    __tablename__ = "credit_idempotency"
+
+    partner_code = Column(String, primary_key=True)
+    idempotency_key = Column(String, primary_key=True)
+    reference = Column(Uuid, nullable=False, index=True)
+    transaction_date = Column(DateTime, nullable=False)
+
+
+class CreditReferenceModel(Base):
+    """
+    Every credit's reference, claimed in the same statement as the credit is inserted. uix_1 on the
+    partitioned credit table only rejects a reference repeated with the same transaction_date.
+    """
+    __tablename__ = "credit_reference"
+
+    reference = Column(Uuid, primary_key=True)
+    transaction_date = Column(DateTime, nullable=False)
+
+
+class CreditMonthlyRollupModel(Base):
+    """
+    Running totals of a member's accruals per program, partner and calendar month, upserted in the
+    same transaction as each credit. Deleting credits does not roll these back.
+    """
+    __tablename__ = "credit_monthly_rollup"
+
+    member_id = Column(String, primary_key=True)
+    airline_code = Column(String, primary_key=True)
+    partner_code = Column(String, primary_key=True)
+    month = Column(Date, primary_key=True)
+    amount = Column(BigInteger, nullable=False, default=0)
+    points = Column(BigInteger, nullable=False, default=0)
+    transactions = Column(Integer, nullable=False, default=0)
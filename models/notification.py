@@ -0,0 +1,42 @@
+from config.database import Base
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, DateTime, Uuid, Index, func, text
+from sqlalchemy.dialects.postgresql import JSONB
+
+
+class NotificationTargetModel(Base):
+    """
+    A URL a partner registered to be told about its credits' status changes: the bank's app, or a
+    gateway that emails or texts the customer.
+    """
+    __tablename__ = "notification_target"
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    partner_code = Column(String, nullable=False, index=True)
+    url = Column(String, nullable=False)
+    description = Column(String, nullable=True)
+    active = Column(Boolean, nullable=False, default=True, server_default=text("true"))
+
+
+class NotificationOutboxModel(Base):
+    """
+    One notification for one target, written in the same transaction as the status change it reports
+    and delivered later by jobs.notifications. Rows are kept after delivery as the notification history.
+    """
+    __tablename__ = "notification_outbox"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    target_id = Column(Integer, nullable=False)
+    reference = Column(Uuid, nullable=False, index=True)
+    payload = Column(JSONB, nullable=False)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+    next_attempt_at = Column(DateTime, nullable=False, server_default=func.now())
+    attempts = Column(Integer, nullable=False, server_default=text("0"))
+    sent_at = Column(DateTime, nullable=True)
+    # set when the dispatcher gives up on the notification
+    failed_at = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+
+    __table_args__ = (
+        Index('ix_notification_outbox_due', 'next_attempt_at',
+              postgresql_where=text("sent_at IS NULL AND failed_at IS NULL")),
+    )
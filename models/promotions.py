@@ -1,5 +1,5 @@
 from config.database import Base
-from sqlalchemy import Column, String, Integer, DateTime
+from sqlalchemy import Column, String, Integer, DateTime, Index
 from sqlalchemy.dialects.postgresql import JSONB
 
 
@@ -16,4 +16,8 @@ class PromotionModel(Base):
     description = Column(String, nullable=False)
     start_date_for_card = Column(DateTime, nullable=False)
     end_date_for_card = Column(DateTime, nullable=False)
-    
\ No newline at end of file
+    
+
+    __table_args__ = (
+        Index('ix_promotions_airline_partner_expiry', 'airline_code', 'partner_code', 'expiry'),
+    )
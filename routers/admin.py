@@ -0,0 +1,25 @@
+from fastapi import APIRouter, Depends
+from schemas.admin import SeenMemberFilterStats, PoolStatsItem
+from services.admin import AsyncAdminService
+from utils.service_result import handle_result
+from config.database import get_async_db
+from utils.credentials_misc import require_role
+from models.user import UserModel
+
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["admin"]
+)
+
+
+@router.get("/seen_members/", response_model=list[SeenMemberFilterStats])
+async def get_seen_members(current_user: UserModel = Depends(require_role("admin")), db: get_async_db = Depends()):
+    result = await AsyncAdminService(db).get_seen_member_filters()
+    return handle_result(result)
+
+
+@router.get("/pool/", response_model=list[PoolStatsItem])
+async def get_pool_stats(current_user: UserModel = Depends(require_role("admin")), db: get_async_db = Depends()):
+    result = await AsyncAdminService(db).get_pool_stats()
+    return handle_result(result)
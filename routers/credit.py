@@ -1,10 +1,17 @@
-from fastapi import APIRouter, Depends
-from services.credit import CreditService
-from schemas.credit import CreditItem, CreditCreate, CreditItems, CreditEmailBoolean, CreditReferenceBoolean, CreditMember, CreditEmail, CreditReference
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from services.credit import AsyncCreditService
+from schemas.credit import CreditItem, CreditCreate, CreditBatch, CreditBatchResult, CreditItems, CreditEmailBoolean, CreditReferenceBoolean, CreditMember, CreditEmail, CreditReference, \
+    CreditEmailPage, CreditSubscribe
 from utils.service_result import handle_result
-from config.database import get_db
+from config.database import get_async_db
 from utils.credentials_misc import require_role
 from models.user import UserModel
+from utils.pagination import wants_ndjson, set_next_cursor, NDJSON_MEDIA_TYPES
+from utils.status_events import status_events, wants_event_stream, wait_for_change, stream_changes, \
+    EVENT_STREAM_MEDIA_TYPE
+from models.credit import TERMINAL_STATUSES
+from utils.credit_cache import etag, etag_matches, canonical_reference
 
 router = APIRouter(
     prefix="/credit",
@@ -13,45 +20,117 @@ router = APIRouter(
 
 
 @router.post("/get_by_member_id/", response_model=list[CreditItems])
-async def get_by_member_id(member_id: CreditMember, current_user: UserModel = Depends(require_role("partner")), db: get_db = Depends()):
+async def get_by_member_id(member_id: CreditMember, response: Response, accept: str | None = Header(None),
+                           current_user: UserModel = Depends(require_role("partner")), db: get_async_db = Depends()):
     member_id.set_partner_code(current_user.partner_code)
-    result = CreditService(db).get_by_member_id(member_id)
-    return handle_result(result)
+    if wants_ndjson(accept):
+        result = await AsyncCreditService(db).stream_by_member_id(member_id)
+        return StreamingResponse(handle_result(result), media_type=NDJSON_MEDIA_TYPES[0])
+    result = await AsyncCreditService(db).get_by_member_id(member_id)
+    items = handle_result(result)
+    if member_id.paginated:
+        set_next_cursor(response, items, member_id.limit)
+    return items
 
 
 @router.post("/get_by_reference/", response_model=CreditItem)
-async def get_by_reference(item: CreditReference, current_user: UserModel = Depends(require_role("partner")), db: get_db = Depends()):
+async def get_by_reference(item: CreditReference, response: Response,
+                           current_user: UserModel = Depends(require_role("partner")), db: get_async_db = Depends()):
     item.set_partner_code(current_user.partner_code)
-    result = CreditService(db).get_item_by_reference(item)
-    return handle_result(result)
+    result = await AsyncCreditService(db).get_item_by_reference(item)
+    credit = handle_result(result)
+    response.headers["ETag"] = etag(credit)
+    return credit
+
+
+@router.get("/get_by_reference/{reference}", response_model=CreditItem)
+async def get_by_reference_conditional(reference: str, response: Response, if_none_match: str | None = Header(None),
+                                       current_user: UserModel = Depends(require_role("partner")),
+                                       db: get_async_db = Depends()):
+    """
+    Same as POST /credit/get_by_reference/, but answers 304 with no body while the ETag in
+    If-None-Match still matches
+    """
+    item = CreditReference(reference=reference)
+    item.set_partner_code(current_user.partner_code)
+    result = await AsyncCreditService(db).get_item_by_reference(item)
+    credit = handle_result(result)
+    tag = etag(credit)
+    if etag_matches(if_none_match, tag):
+        return Response(status_code=304, headers={"ETag": tag, "Cache-Control": "private, no-cache"})
+    response.headers["ETag"] = tag
+    response.headers["Cache-Control"] = "private, no-cache"
+    return credit
+
+
+@router.post("/subscribe/", response_model=CreditItem)
+async def subscribe(item: CreditSubscribe, accept: str | None = Header(None),
+                    current_user: UserModel = Depends(require_role("partner")), db: get_async_db = Depends()):
+    item.set_partner_code(current_user.partner_code)
+    # events carry the database's text form of the reference, whatever form the client sent
+    reference = canonical_reference(item.reference)
+    if reference is None:
+        raise HTTPException(status_code=404, detail={"reference": item.reference})
+    # subscribed before reading, so a change committed in between is not missed; read from the primary,
+    # as a lagging replica could still show the status from before a change whose event has already gone
+    subscription = status_events.subscribe(reference)
+    try:
+        result = await AsyncCreditService(db).get_item_by_reference(item, primary=True)
+        credit = CreditItem.model_validate(handle_result(result), from_attributes=True)
+    except BaseException:
+        subscription.close()
+        raise
+    finally:
+        # nothing below needs the database, so no pooled connection is held while waiting
+        await db.close()
+    if wants_event_stream(accept):
+        return StreamingResponse(stream_changes(subscription, credit, TERMINAL_STATUSES, item.timeout),
+                                 media_type=EVENT_STREAM_MEDIA_TYPE,
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    with subscription:
+        return await wait_for_change(subscription, credit, item.status, TERMINAL_STATUSES, item.timeout)
 
 
 @router.post("/add/", response_model=CreditItem)
-async def add_item(item: CreditCreate, current_user: UserModel = Depends(require_role("partner")), db: get_db = Depends()):
+async def add_item(item: CreditCreate, current_user: UserModel = Depends(require_role("partner")), db: get_async_db = Depends()):
     item.set_partner_code(current_user.partner_code)
-    result = CreditService(db).add_item(item)
+    result = await AsyncCreditService(db).add_item(item)
+    return handle_result(result)
+
+
+@router.post("/add_batch/", response_model=list[CreditBatchResult])
+async def add_batch(batch: CreditBatch, current_user: UserModel = Depends(require_role("partner")),
+                    db: get_async_db = Depends()):
+    batch.set_partner_code(current_user.partner_code)
+    result = await AsyncCreditService(db).add_batch(batch)
     return handle_result(result)
 
 
 @router.post("/delete_by_email/", response_model=CreditEmailBoolean)
 async def delete_by_email(item: CreditEmail, current_user: UserModel = Depends(require_role("partner")),
-                          db: get_db = Depends()):
+                          db: get_async_db = Depends()):
     item.set_partner_code(current_user.partner_code)
-    result = CreditService(db).delete_by_email(item)
+    result = await AsyncCreditService(db).delete_by_email(item)
     return handle_result(result)
 
 
 @router.post("/get_by_email/", response_model=list[CreditItems])
-async def get_by_email(item: CreditEmail, current_user: UserModel = Depends(require_role("partner")),
-                       db: get_db = Depends()):
+async def get_by_email(item: CreditEmailPage, response: Response, accept: str | None = Header(None),
+                       current_user: UserModel = Depends(require_role("partner")), db: get_async_db = Depends()):
     item.set_partner_code(current_user.partner_code)
-    result = CreditService(db).get_items_by_email(item)
-    return handle_result(result)
+    if wants_ndjson(accept):
+        result = await AsyncCreditService(db).stream_items_by_email(item)
+        return StreamingResponse(handle_result(result), media_type=NDJSON_MEDIA_TYPES[0])
+    result = await AsyncCreditService(db).get_items_by_email(item)
+    items = handle_result(result)
+    if item.paginated:
+        set_next_cursor(response, items, item.limit)
+    return items
 
 
 @router.post("/delete_by_reference/", response_model=CreditReferenceBoolean)
 async def delete_by_reference(item: CreditReference, current_user: UserModel = Depends(require_role("partner")),
-                              db: get_db = Depends()):
+                              db: get_async_db = Depends()):
     item.set_partner_code(current_user.partner_code)
-    result = CreditService(db).delete_by_reference(item)
+    result = await AsyncCreditService(db).delete_by_reference(item)
     return handle_result(result)
@@ -0,0 +1,44 @@
+from fastapi import APIRouter, Depends
+from schemas.credit import CreditReference
+from schemas.notification import NotificationTargetCreate, NotificationTargetItem, NotificationItem, NotificationQueued
+from services.notification import AsyncNotificationService
+from utils.service_result import handle_result
+from config.database import get_async_db
+from utils.credentials_misc import require_role
+from models.user import UserModel
+
+
+router = APIRouter(
+    prefix="/notification",
+    tags=["notification"]
+)
+
+
+@router.post("/register/", response_model=NotificationTargetItem)
+async def register(item: NotificationTargetCreate, current_user: UserModel = Depends(require_role("partner")),
+                   db: get_async_db = Depends()):
+    item.set_partner_code(current_user.partner_code)
+    result = await AsyncNotificationService(db).add_target(item)
+    return handle_result(result)
+
+
+@router.get("/targets/", response_model=list[NotificationTargetItem])
+async def get_targets(current_user: UserModel = Depends(require_role("partner")), db: get_async_db = Depends()):
+    result = await AsyncNotificationService(db).get_targets(current_user.partner_code)
+    return handle_result(result)
+
+
+@router.post("/get_by_reference/", response_model=list[NotificationItem])
+async def get_by_reference(item: CreditReference, current_user: UserModel = Depends(require_role("partner")),
+                           db: get_async_db = Depends()):
+    item.set_partner_code(current_user.partner_code)
+    result = await AsyncNotificationService(db).get_by_reference(item)
+    return handle_result(result)
+
+
+@router.post("/resend/", response_model=NotificationQueued)
+async def resend(item: CreditReference, current_user: UserModel = Depends(require_role("partner")),
+                 db: get_async_db = Depends()):
+    item.set_partner_code(current_user.partner_code)
+    result = await AsyncNotificationService(db).resend(item)
+    return handle_result(result)
@@ -2,8 +2,8 @@ from fastapi import APIRouter, Depends
 from utils.service_result import handle_result
 from fastapi.security import OAuth2PasswordRequestForm
 from schemas.user import UserToken, UserRegisterResponse, UserRegisterRequest, UserResponse, UserLoginRequest
-from config.database import get_db
-from services.user import UserService
+from config.database import get_async_db
+from services.user import AsyncUserService
 from models.user import UserModel
 from utils.credentials_misc import get_current_active_user
 from utils.credentials_misc import require_role
@@ -16,15 +16,15 @@ router = APIRouter(
 
 
 @router.post("/token", response_model=UserToken)
-async def login_for_access_token(item: OAuth2PasswordRequestForm = Depends(), db: get_db = Depends()):
-    item = UserService(db).authenticate_user(item.username, item.password)
+async def login_for_access_token(item: OAuth2PasswordRequestForm = Depends(), db: get_async_db = Depends()):
+    item = await AsyncUserService(db).authenticate_user(item.username, item.password)
     return handle_result(item)
 
 
 @router.post("/signup", response_model=UserRegisterResponse)
 async def signup(item: UserRegisterRequest, current_user: UserModel = Depends(require_role("admin")),
-                 db: get_db = Depends()):
-    item = UserService(db).signup(item)
+                 db: get_async_db = Depends()):
+    item = await AsyncUserService(db).signup(item)
     return handle_result(item)
 
 
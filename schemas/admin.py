@@ -0,0 +1,33 @@
+from pydantic import BaseModel
+
+
+class SeenMemberFilterStats(BaseModel):
+    airline_code: str
+    members: int
+    capacity: int
+    hashes: int
+    memory_bytes: int
+    target_false_positive_rate: float
+    false_positive_rate: float
+
+
+class PoolWaitBucket(BaseModel):
+    le_ms: float | None
+    count: int
+
+
+class PoolStatsItem(BaseModel):
+    name: str
+    pool: str
+    size: int | None
+    max_overflow: int | None
+    in_use: int
+    idle: int
+    connects: int
+    closes: int
+    invalidations: int
+    checkouts: int
+    timeouts: int
+    mean_wait_ms: float
+    max_wait_ms: float
+    wait_histogram: list[PoolWaitBucket]
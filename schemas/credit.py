@@ -1,5 +1,5 @@
 from datetime import datetime
-from pydantic import BaseModel, PrivateAttr
+from pydantic import BaseModel, PrivateAttr, Field
 from typing import Any
 from uuid import UUID
 
@@ -17,6 +17,7 @@ class CreditCreate(CreditBase):
     email: str
     additional_info: dict[str, Any]
     promotion_id: int | None = None
+    idempotency_key: str | None = Field(default=None, max_length=255)
 
     @property
     def partner_code(self):
@@ -26,6 +27,22 @@ class CreditCreate(CreditBase):
         self._partner_code = partner_code
 
 
+class CreditBatch(BaseModel):
+    items: list[CreditCreate] = Field(min_length=1, max_length=10000)
+
+    def set_partner_code(self, partner_code: str):
+        for item in self.items:
+            item.set_partner_code(partner_code)
+
+
+class CreditBatchResult(BaseModel):
+    index: int
+    reference: UUID | None = None
+    amount: int | None = None
+    promotion_id: int | None = None
+    error: str | None = None
+
+
 class CreditItems(CreditBase):
     status: str
     airline_code: str
@@ -60,6 +77,16 @@ class CreditReference(BaseModel):
         self._partner_code = partner_code
 
 
+class CreditSubscribe(CreditReference):
+    """
+    Wait up to timeout seconds for the credit's status to change from status, the one the client already
+    has (without it, the current credit is returned at once). With Accept: text/event-stream, every
+    change is streamed instead until the credit is approved or rejected.
+    """
+    status: str | None = None
+    timeout: float = Field(default=30, gt=0, le=300)
+
+
 class CreditEmail(BaseModel):
     email: str
     _partner_code: str = PrivateAttr()
@@ -72,7 +99,27 @@ class CreditEmail(BaseModel):
         self._partner_code = partner_code
 
 
-class CreditMember(BaseModel):
+class CreditPage(BaseModel):
+    """
+    Keyset pagination: up to limit credits with an id after cursor, ordered by id. The X-Next-Cursor
+    response header holds the cursor for the next page. Without either field, everything is returned.
+    from_date and to_date restrict the transaction_date, which lets the query skip whole partitions.
+    """
+    cursor: int | None = None
+    limit: int | None = Field(default=None, ge=1, le=1000)
+    from_date: datetime | None = None
+    to_date: datetime | None = None
+
+    @property
+    def paginated(self) -> bool:
+        return self.cursor is not None or self.limit is not None
+
+
+class CreditEmailPage(CreditEmail, CreditPage):
+    pass
+
+
+class CreditMember(CreditPage):
     member_id: str
     airline_code: str
     _partner_code: str = PrivateAttr()
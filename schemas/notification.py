@@ -0,0 +1,41 @@
+from datetime import datetime
+from pydantic import BaseModel, PrivateAttr, AnyHttpUrl
+from typing import Any
+from uuid import UUID
+
+
+class NotificationTargetCreate(BaseModel):
+    url: AnyHttpUrl
+    description: str | None = None
+    _partner_code: str = PrivateAttr()
+
+    @property
+    def partner_code(self):
+        return self._partner_code
+
+    def set_partner_code(self, partner_code: str):
+        self._partner_code = partner_code
+
+
+class NotificationTargetItem(BaseModel):
+    id: int
+    url: str
+    description: str | None = None
+    active: bool
+
+
+class NotificationItem(BaseModel):
+    id: int
+    target_id: int
+    reference: UUID
+    payload: dict[str, Any]
+    created_at: datetime
+    attempts: int
+    sent_at: datetime | None = None
+    failed_at: datetime | None = None
+    last_error: str | None = None
+
+
+class NotificationQueued(BaseModel):
+    reference: str
+    queued: int
@@ -1,6 +1,6 @@
 from datetime import datetime
 from typing import Any
-from pydantic import BaseModel, PrivateAttr
+from pydantic import BaseModel, PrivateAttr, Field
 
 
 class PromotionBase(BaseModel):
@@ -30,3 +30,18 @@ class GetPromotionBasedOnPartner(BaseModel):
 class PromotionNameDescription(GetPromotionRequest):
     name: str
     description: str
+
+
+class PromotionQuoteItem(BaseModel):
+    amount: int
+    airline_code: str
+    additional_info: dict[str, Any] = {}
+
+
+class PromotionQuoteRequest(BaseModel):
+    items: list[PromotionQuoteItem] = Field(min_length=1, max_length=10000)
+
+
+class PromotionQuoteResponse(PromotionQuoteItem):
+    points: int
+    promotion_id: int | None
@@ -0,0 +1,17 @@
+from utils.service_result import ServiceResult
+from services.main import AppService, AsyncAppService
+from services.credit import seen_members
+from config import database
+
+
+class AdminService(AppService):
+    def get_seen_member_filters(self) -> ServiceResult:
+        seen_members.refresh(self.db)
+        return ServiceResult(seen_members.stats())
+
+    def get_pool_stats(self) -> ServiceResult:
+        return ServiceResult([stats.snapshot() for stats in database.pool_stats])
+
+
+class AsyncAdminService(AsyncAppService):
+    sync_class = AdminService
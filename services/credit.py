@@ -1,32 +1,86 @@
-from models.credit import CreditModel
-from schemas.credit import CreditItem, CreditCreate, CreditEmailBoolean, CreditEmail, CreditReferenceBoolean, CreditReference, CreditMember
+from models.credit import CreditModel, CreditMonthlyRollupModel, CreditIdempotencyModel, CreditReferenceModel, \
+    IN_PROGRESS
+from schemas.credit import CreditItem, CreditItems, CreditCreate, CreditBatch, CreditBatchResult, CreditEmailPage, CreditPage, CreditEmailBoolean, CreditEmail, CreditReferenceBoolean, CreditReference, CreditMember
 from utils.service_result import ServiceResult
-from services.main import AppService, AppCRUD
+from services.main import AppService, AppCRUD, read_only, AsyncAppService, AsyncAppCRUD
 from utils.app_exceptions import AppException
-from utils.misc import generate_reference
+from utils.misc import generate_reference, reference_range, reference_date_window
 from sqlalchemy.exc import IntegrityError, DataError
-from datetime import datetime
-from utils.validators import validate_member_id, validate_airline_code
-from services.promotions import PromotionCRUD
-from utils.promotion_misc import validate_promotions, eval_points_conditions, calculate_points
+from sqlalchemy import Select, select, delete, and_, func, tuple_, cast, literal, exists, bindparam, Date, BigInteger
+from sqlalchemy.orm import aliased
+from sqlalchemy.dialects.postgresql import insert
+from datetime import datetime, date
+from typing import Any, Iterator
+from utils.validators import validate_member_id, validate_airline_code, loyalty_patterns
+from services.promotions import PromotionCRUD, active_promotions
+from utils.promotion_compiler import PromotionCandidates
+from utils.promotion_index import compile_promotion
+from utils.promotion_misc import ROLLUP_CONDITION_KEYS, MONTHLY_AMOUNT_KEY, PREVIOUS_MONTHLY_AMOUNT_KEY, \
+    MONTHLY_TRANSACTIONS_KEY, FIRST_TRANSACTION_KEY
+from utils.bloom_filter import SeenMemberFilter
+from utils.pagination import paginate, stream_ndjson, DEFAULT_PAGE_SIZE
+from utils.credit_cache import CreditCache, canonical_reference
+from utils.status_events import status_events
+from utils.replicas import read_from_replica
+from config import database
+
+# The hot lookups are built once with bind parameters, so a call skips building the statement and
+# generating its compiled-cache key (see benchmarks/bench_statements.py)
+CREDIT_BY_REFERENCE = select(CreditModel).where(CreditModel.reference == bindparam("reference"),
+                                                CreditModel.partner_code == bindparam("partner_code")).limit(1)
+# a time-ordered reference also bounds transaction_date, so the lookup only touches the partitions around it
+CREDIT_BY_REFERENCE_WITHIN = CREDIT_BY_REFERENCE.where(CreditModel.transaction_date >= bindparam("start"),
+                                                       CreditModel.transaction_date < bindparam("end"))
+CREDIT_BY_IDEMPOTENCY_KEY = select(CreditModel).join(
+    CreditIdempotencyModel, and_(CreditIdempotencyModel.reference == CreditModel.reference,
+                                 CreditIdempotencyModel.transaction_date == CreditModel.transaction_date)
+).where(CreditIdempotencyModel.idempotency_key == bindparam("idempotency_key"),
+        CreditIdempotencyModel.partner_code == bindparam("partner_code")).limit(1)
+HAS_CREDIT = select(exists().where(CreditModel.member_id == bindparam("member_id"),
+                                   CreditModel.airline_code == bindparam("airline_code")))
+# by (from_date, to_date, cursor, paginated): one statement per combination of CreditMember's options
+CREDITS_BY_MEMBER: dict[tuple[bool, bool, bool, bool], Select] = {}
 
 
 class CreditService(AppService):
     def get_by_member_id(self, member_id: CreditMember) -> ServiceResult:
         item = CreditCRUD(self.db).get_by_member_id(member_id)
-        if not item:
+        if not item and member_id.cursor is None:
             return ServiceResult(AppException.GetItem({"member_id": member_id.member_id,
                                                        "airline_code": member_id.airline_code}))
-        return ServiceResult(item)
+        return ServiceResult(item or [])
+
+    def stream_by_member_id(self, member_id: CreditMember) -> ServiceResult:
+        statement = CreditCRUD.by_member_id_statement(member_id)
+        if member_id.cursor is not None:
+            statement = statement.where(CreditModel.id > member_id.cursor)
+        return ServiceResult(stream_ndjson(database.SessionLocal, statement.order_by(CreditModel.id), CreditItems))
 
-    def get_item_by_reference(self, reference: CreditReference) -> ServiceResult:
+    def get_item_by_reference(self, reference: CreditReference, primary: bool = False) -> ServiceResult:
+        """
+        With primary, the credit is read from the primary, never from the cache or a replica, which may
+        be behind a change whose status event has already been sent
+        """
+        key = (canonical_reference(reference.reference), reference.partner_code)
+        if key[0] is None:
+            return ServiceResult(AppException.GetItem({"reference": reference.reference}))
+        item = None if primary else credit_cache.get(key)
+        if item is not None:
+            return ServiceResult(item)
+        version = credit_cache.version
         try:
-            item = CreditCRUD(self.db).get_item_by_reference(reference)
+            crud = CreditCRUD(self.db)
+            lookup = crud.get_item_by_reference_on_primary if primary else crud.get_item_by_reference
+            item = lookup(reference)
             if not item:
                 return ServiceResult(AppException.GetItem({"reference": reference.reference}))
-            return ServiceResult(item)
         except DataError:
             return ServiceResult(AppException.GetItem({"reference": reference.reference}))
+        item = CreditItem.model_validate(item, from_attributes=True)
+        # a replica may be behind the invalidations, which are sent when the primary commits
+        if not read_from_replica(self.db):
+            credit_cache.put(key, item, version)
+        return ServiceResult(item)
 
     def add_item(self, item: CreditCreate) -> ServiceResult:
         if not validate_airline_code(item.airline_code, self.db):
@@ -39,11 +93,23 @@ class CreditService(AppService):
             return ServiceResult(AppException.AddItem())
         return ServiceResult(item)
 
-    def get_items_by_email(self, email: CreditEmail) -> ServiceResult:
+    def add_batch(self, batch: CreditBatch) -> ServiceResult:
+        items = CreditCRUD(self.db).add_batch(batch.items)
+        if items is None:
+            return ServiceResult(AppException.AddItem())
+        return ServiceResult(items)
+
+    def get_items_by_email(self, email: CreditEmail | CreditEmailPage) -> ServiceResult:
         item = CreditCRUD(self.db).get_items_by_email(email)
-        if not item:
+        if not item and not (isinstance(email, CreditPage) and email.cursor is not None):
             return ServiceResult(AppException.GetItem({"email": email.email}))
-        return ServiceResult(item)
+        return ServiceResult(item or [])
+
+    def stream_items_by_email(self, email: CreditEmailPage) -> ServiceResult:
+        statement = CreditCRUD.by_email_statement(email)
+        if email.cursor is not None:
+            statement = statement.where(CreditModel.id > email.cursor)
+        return ServiceResult(stream_ndjson(database.SessionLocal, statement.order_by(CreditModel.id), CreditItems))
 
     def delete_by_email(self, item: CreditEmail) -> ServiceResult:
         outcome = CreditCRUD(self.db).delete_by_email(item.email, item.partner_code)
@@ -63,85 +129,481 @@ class CreditService(AppService):
 
 
 class CreditCRUD(AppCRUD):
+    @read_only(recheck_empty=True)
     def get_by_member_id(self, member_id: CreditMember) -> list[CreditModel]:
-        item = self.db.query(CreditModel).filter(CreditModel.member_id == member_id.member_id,
-                                                 CreditModel.airline_code == member_id.airline_code,
-                                                 CreditModel.partner_code == member_id.partner_code).all()
+        item = self.db.scalars(self.by_member_id_prebuilt(member_id), {
+            "member_id": member_id.member_id, "airline_code": member_id.airline_code,
+            "partner_code": member_id.partner_code, "from_date": member_id.from_date, "to_date": member_id.to_date,
+            "cursor": member_id.cursor, "limit": member_id.limit or DEFAULT_PAGE_SIZE}).all()
         if item:
             return item
         return None
 
-    def get_items_by_email(self, email: CreditEmail) -> CreditModel:
-        item = self.db.query(CreditModel).filter(CreditModel.email == email.email,
-                                                 CreditModel.partner_code == email.partner_code).all()
+    def get_items_by_email(self, email: CreditEmail | CreditEmailPage) -> CreditModel:
+        statement = self.by_email_statement(email)
+        if isinstance(email, CreditPage) and email.paginated:
+            statement = paginate(statement, CreditModel.id, email.cursor, email.limit)
+        item = self.db.scalars(statement).all()
         if item:
             return item
         return None
 
+    @staticmethod
+    def by_member_id_statement(member_id: CreditMember) -> Select:
+        statement = select(CreditModel).where(CreditModel.member_id == member_id.member_id,
+                                              CreditModel.airline_code == member_id.airline_code,
+                                              CreditModel.partner_code == member_id.partner_code)
+        return CreditCRUD.within_dates(statement, member_id)
+
+    @staticmethod
+    def by_member_id_prebuilt(member_id: CreditMember) -> Select:
+        shape = (member_id.from_date is not None, member_id.to_date is not None, member_id.cursor is not None,
+                 member_id.paginated)
+        statement = CREDITS_BY_MEMBER.get(shape)
+        if statement is None:
+            from_date, to_date, cursor, paginated = shape
+            statement = select(CreditModel).where(CreditModel.member_id == bindparam("member_id"),
+                                                  CreditModel.airline_code == bindparam("airline_code"),
+                                                  CreditModel.partner_code == bindparam("partner_code"))
+            if from_date:
+                statement = statement.where(CreditModel.transaction_date >= bindparam("from_date"))
+            if to_date:
+                statement = statement.where(CreditModel.transaction_date < bindparam("to_date"))
+            if paginated:
+                statement = paginate(statement, CreditModel.id, bindparam("cursor") if cursor else None,
+                                     bindparam("limit"))
+            CREDITS_BY_MEMBER[shape] = statement
+        return statement
+
+    @staticmethod
+    def by_email_statement(email: CreditEmail) -> Select:
+        statement = select(CreditModel).where(CreditModel.email == email.email,
+                                              CreditModel.partner_code == email.partner_code)
+        return CreditCRUD.within_dates(statement, email)
+
+    @staticmethod
+    def within_dates(statement: Select, page) -> Select:
+        if isinstance(page, CreditPage) and page.from_date is not None:
+            statement = statement.where(CreditModel.transaction_date >= page.from_date)
+        if isinstance(page, CreditPage) and page.to_date is not None:
+            statement = statement.where(CreditModel.transaction_date < page.to_date)
+        return statement
+
+    @staticmethod
+    def reference_filter(reference: str, partner_code: str) -> list:
+        """
+        Conditions matching a reference; a time-ordered one also bounds transaction_date so the lookup
+        only touches the partitions around its creation time
+        """
+        conditions = [CreditModel.reference == reference, CreditModel.partner_code == partner_code]
+        window = reference_date_window(reference)
+        if window is not None:
+            conditions += [CreditModel.transaction_date >= window[0], CreditModel.transaction_date < window[1]]
+        return conditions
+
+    @read_only(recheck_empty=True)
     def get_item_by_reference(self, reference: CreditReference) -> CreditModel:
-        item = self.db.query(CreditModel).filter(CreditModel.reference == reference.reference,
-                                                 CreditModel.partner_code == reference.partner_code).first()
+        return self.get_item_by_reference_on_primary(reference)
+
+    def get_item_by_reference_on_primary(self, reference: CreditReference) -> CreditModel:
+        """
+        get_item_by_reference, not routed to a replica (unless called from it), for reads that must see
+        the latest commit
+        """
+        # asyncpg only takes the plain text form, while Postgres also reads e.g. a brace-wrapped UUID
+        parameters = {"reference": canonical_reference(reference.reference) or reference.reference,
+                      "partner_code": reference.partner_code}
+        window = reference_date_window(reference.reference)
+        if window is None:
+            item = self.db.scalars(CREDIT_BY_REFERENCE, parameters).first()
+        else:
+            item = self.db.scalars(CREDIT_BY_REFERENCE_WITHIN, {**parameters, "start": window[0],
+                                                                "end": window[1]}).first()
         if item:
             return item
         return None
 
-    def add_item(self, item: CreditCreate) -> CreditItem:
-        if item.promotion_id is None:
-            promotions_items = PromotionCRUD(self.db).get_airline_partner_promotions(airline_code=item.airline_code,
-                                                                                     partner_code=item.partner_code)
-        else:
-            promotions_items = PromotionCRUD(self.db).get_promotion_by_id(promotion_id=item.promotion_id)
-            promotions_items = [promotions_items]
-
-        item = CreditModel(member_id=item.member_id,
-                           first_name=item.first_name,
-                           last_name=item.last_name,
-                           transaction_date=datetime.now(),
-                           amount=item.amount,
-                           email=item.email,
-                           airline_code=item.airline_code,
-                           partner_code=item.partner_code,
-                           status="In Progress",
-                           additional_info=item.additional_info)
-
-        if promotions_items:
-            max_point = [item.amount, 0]
-            for promo_item in promotions_items:
-                if validate_promotions(promo_item.conditions, item.additional_info):
-                    for condition, formula in promo_item.points_rule["point_condition"]:
-                        if eval_points_conditions(condition, item.amount):
-                            points = int(calculate_points(item.amount, formula))
-                            if points > max_point[0]:
-                                max_point[0] = points
-                                max_point[1] = promo_item.id
-                                break
-            item.amount = max_point[0]
-            item.promotion_id = max_point[1]
-
-        for _ in range(5):
-            item.reference = generate_reference()
-            self.db.add(item)
-            try:
-                self.db.commit()
-                self.db.refresh(item)
-                return item
-            except IntegrityError:
-                self.db.rollback()
-                continue
-        return None
+    def get_items_created_between(self, start: datetime, end: datetime, partner_code: str) -> list[CreditModel]:
+        """
+        Credits created in [start, end), found with a range scan of the time-ordered reference index.
+        The transaction_date check drops older random (uuid4) references that happen to fall in the range.
+        """
+        low, high = reference_range(start, end)
+        return self.db.query(CreditModel).filter(CreditModel.reference >= low, CreditModel.reference < high,
+                                                 CreditModel.transaction_date >= start,
+                                                 CreditModel.transaction_date < end,
+                                                 CreditModel.partner_code == partner_code) \
+            .order_by(CreditModel.reference).all()
+
+    def get_item_by_idempotency_key(self, idempotency_key: str, partner_code: str) -> CreditModel | None:
+        return self.db.scalars(CREDIT_BY_IDEMPOTENCY_KEY, {"idempotency_key": idempotency_key,
+                                                           "partner_code": partner_code}).first()
+
+    def add_item(self, item: CreditCreate) -> CreditModel | AppException.AddItem:
+        promotions_items = self.get_promotion_candidates(item.airline_code, item.partner_code, item.promotion_id)
+
+        transaction_date = datetime.now()
+        values = {"member_id": item.member_id,
+                  "first_name": item.first_name,
+                  "last_name": item.last_name,
+                  "transaction_date": transaction_date,
+                  "amount": item.amount,
+                  "email": item.email,
+                  "airline_code": item.airline_code,
+                  "partner_code": item.partner_code,
+                  "status": IN_PROGRESS,
+                  "additional_info": item.additional_info,
+                  "promotion_id": None}
+
+        if promotions_items.promotions:
+            additional_info = item.additional_info
+            if promotions_items.condition_keys & ROLLUP_CONDITION_KEYS:
+                rollup = self.get_monthly_rollup(item.member_id, item.airline_code, item.partner_code,
+                                                 transaction_date.date().replace(day=1))
+                additional_info = self.with_monthly_totals(additional_info, rollup.amount if rollup else 0,
+                                                           rollup.transactions if rollup else 0, item.amount)
+            if FIRST_TRANSACTION_KEY in promotions_items.condition_keys:
+                additional_info = {**additional_info,
+                                   FIRST_TRANSACTION_KEY: self.is_first_transaction(item.member_id,
+                                                                                    item.airline_code)}
+            values["amount"], values["promotion_id"] = promotions_items.select_best(item.amount, additional_info)
+
+        values["reference"] = generate_reference()
+        try:
+            credit = self.db.scalars(self.insert_credit(values, item.amount, item.idempotency_key)).first()
+        except IntegrityError:
+            self.db.rollback()
+            return AppException.AddItem({"message": "Credit conflicts with an existing one"})
+        if credit is None:
+            # nothing was inserted, so drop the claims that were made; a retried request returns the credit it
+            # created the first time
+            self.db.rollback()
+            if item.idempotency_key is None:
+                return AppException.AddItem({"message": "Reference in use"})
+            credit = self.get_item_by_idempotency_key(item.idempotency_key, item.partner_code)
+            if credit is None:
+                # the key's credit is not visible, e.g. it was deleted
+                return AppException.AddItem({"message": "Idempotency key in use"})
+        # keep the RETURNING values instead of having commit() expire them
+        self.db.expunge(credit)
+        self.db.commit()
+        seen_members.add(credit.airline_code, credit.member_id)
+        return credit
+
+    @staticmethod
+    def insert_credit(values: dict[str, Any], amount: int, idempotency_key: str | None = None):
+        """
+        One statement that inserts the credit unless its reference or idempotency key is taken, adds it to
+        the member's monthly rollup only if it was inserted, and returns the inserted credit. A claim made
+        for a credit that was not inserted is left to the caller to roll back.
+        """
+        claims = [insert(CreditReferenceModel).values(reference=values["reference"],
+                                                      transaction_date=values["transaction_date"])
+                  .on_conflict_do_nothing().returning(CreditReferenceModel.reference).cte("reference_claimed")]
+        if idempotency_key is not None:
+            claims.append(insert(CreditIdempotencyModel).values(partner_code=values["partner_code"],
+                                                                idempotency_key=idempotency_key,
+                                                                reference=values["reference"],
+                                                                transaction_date=values["transaction_date"])
+                          .on_conflict_do_nothing().returning(CreditIdempotencyModel.reference).cte("key_claimed"))
+        # the credit row is only selected (and so inserted) if every claim was made
+        inserted = insert(CreditModel).from_select(
+            list(values), select(*[literal(value, CreditModel.__table__.c[key].type)
+                                   for key, value in values.items()]).select_from(*claims))
+        inserted = inserted.returning(*CreditModel.__table__.c).cte("inserted")
+        rollup = CreditCRUD.add_to_monthly_rollups(insert(CreditMonthlyRollupModel).from_select(
+            ["member_id", "airline_code", "partner_code", "month", "amount", "points", "transactions"],
+            select(inserted.c.member_id, inserted.c.airline_code, inserted.c.partner_code,
+                   cast(func.date_trunc("month", inserted.c.transaction_date), Date),
+                   literal(amount, BigInteger), inserted.c.amount, literal(1))
+        )).cte("rollup")
+        return select(aliased(CreditModel, inserted)).add_cte(rollup)
+
+    def add_batch(self, items: list[CreditCreate]) -> list[CreditBatchResult] | None:
+        """
+        Validate a batch of credits against the cached loyalty patterns, apply promotions in memory and
+        insert the valid ones with one multi-row INSERT in a single transaction. Items that fail validation
+        get an error in their result and are not inserted; items whose idempotency key is already used,
+        even by a concurrent request, get the credit it was used for.
+        """
+        patterns = loyalty_patterns.get(self.db)
+        results = [CreditBatchResult(index=index) for index in range(len(items))]
+        valid = []
+        for index, item in enumerate(items):
+            pattern = patterns.get(item.airline_code)
+            if pattern is None:
+                results[index].error = "invalid airline code"
+            elif not pattern.match(item.member_id):
+                results[index].error = "invalid member ID"
+            else:
+                valid.append(index)
+        valid, repeats = self.skip_repeated_items(items, valid, results)
+        if not valid:
+            return results
+
+        transaction_date = datetime.now()
+        month = transaction_date.date().replace(day=1)
+        candidates = {}
+        for index in valid:
+            key = (items[index].airline_code, items[index].partner_code, items[index].promotion_id)
+            if key not in candidates:
+                candidates[key] = self.get_promotion_candidates(*key)
+
+        stored_rollups = {}
+        if any(promotions_items.condition_keys & ROLLUP_CONDITION_KEYS for promotions_items in candidates.values()):
+            stored_rollups = self.get_monthly_rollups(
+                {(items[index].member_id, items[index].airline_code, items[index].partner_code, month)
+                 for index in valid})
+
+        references = {index: generate_reference() for index in valid}
+        claims = [{"partner_code": items[index].partner_code, "idempotency_key": items[index].idempotency_key,
+                   "reference": references[index], "transaction_date": transaction_date}
+                  for index in valid if items[index].idempotency_key is not None]
+        taken = {(claim["partner_code"], claim["idempotency_key"]) for claim in claims} - \
+            self.claim_idempotency_keys(claims)
+        if taken:
+            # keys another request used since skip_repeated_items looked get that request's credit
+            existing = self.get_credits_by_idempotency_keys(taken)
+            for index in valid:
+                key = (items[index].partner_code, items[index].idempotency_key)
+                if key in taken:
+                    results[index] = self.batch_result(index, existing.get(key))
+            valid = [index for index in valid
+                     if (items[index].partner_code, items[index].idempotency_key) not in taken]
+
+        rows, rollups = [], {}
+        for index in valid:
+            item = items[index]
+            promotions_items = candidates[(item.airline_code, item.partner_code, item.promotion_id)]
+            rollup_key = (item.member_id, item.airline_code, item.partner_code, month)
+            # amount, points and transactions of this member earlier in the batch
+            rollup = rollups.setdefault(rollup_key, [0, 0, 0])
+
+            points, promotion_id = item.amount, None
+            if promotions_items.promotions:
+                additional_info = item.additional_info
+                if promotions_items.condition_keys & ROLLUP_CONDITION_KEYS:
+                    stored = stored_rollups.get(rollup_key)
+                    additional_info = self.with_monthly_totals(additional_info,
+                                                               (stored.amount if stored else 0) + rollup[0],
+                                                               (stored.transactions if stored else 0) + rollup[2],
+                                                               item.amount)
+                if FIRST_TRANSACTION_KEY in promotions_items.condition_keys:
+                    additional_info = {**additional_info,
+                                       FIRST_TRANSACTION_KEY: rollup[2] == 0 and
+                                       self.is_first_transaction(item.member_id, item.airline_code)}
+                points, promotion_id = promotions_items.select_best(item.amount, additional_info)
+
+            rollup[0] += item.amount
+            rollup[1] += points
+            rollup[2] += 1
+            rows.append({"reference": references[index],
+                         "member_id": item.member_id,
+                         "first_name": item.first_name,
+                         "last_name": item.last_name,
+                         "transaction_date": transaction_date,
+                         "amount": points,
+                         "email": item.email,
+                         "airline_code": item.airline_code,
+                         "partner_code": item.partner_code,
+                         "status": IN_PROGRESS,
+                         "additional_info": item.additional_info,
+                         "promotion_id": promotion_id})
+
+        try:
+            if rows:
+                self.db.execute(insert(CreditReferenceModel), [{"reference": row["reference"],
+                                                                "transaction_date": transaction_date}
+                                                               for row in rows])
+                self.db.execute(insert(CreditModel), rows)
+                # in key order, like the locks taken above
+                self.db.execute(self.upsert_monthly_rollups([self.monthly_rollup_row(key, totals)
+                                                             for key, totals in sorted(rollups.items())]))
+            self.db.commit()
+        except IntegrityError:
+            self.db.rollback()
+            return None
+
+        for index, row in zip(valid, rows):
+            results[index].reference = row["reference"]
+            results[index].amount = row["amount"]
+            results[index].promotion_id = row["promotion_id"]
+            seen_members.add(row["airline_code"], row["member_id"])
+        for index, original in repeats.items():
+            results[index] = results[original].model_copy(update={"index": index})
+        return results
+
+    def claim_idempotency_keys(self, claims: list[dict[str, Any]]) -> set[tuple[str, str]]:
+        """
+        Insert the idempotency keys that are free, in key order so that concurrent batches wait on each
+        other's keys in the same order, and return the (partner_code, idempotency_key) of those inserted.
+        A key that another transaction is inserting is waited for, and is taken if that transaction commits.
+        """
+        if not claims:
+            return set()
+        claims = sorted(claims, key=lambda claim: (claim["partner_code"], claim["idempotency_key"]))
+        statement = insert(CreditIdempotencyModel).values(claims).on_conflict_do_nothing() \
+            .returning(CreditIdempotencyModel.partner_code, CreditIdempotencyModel.idempotency_key)
+        return {tuple(row) for row in self.db.execute(statement)}
+
+    def get_credits_by_idempotency_keys(self, keys: set[tuple[str, str]]) -> dict[tuple[str, str], CreditModel]:
+        return {(key.partner_code, key.idempotency_key): credit for credit, key in
+                self.db.query(CreditModel, CreditIdempotencyModel).join(
+                    CreditIdempotencyModel,
+                    and_(CreditIdempotencyModel.reference == CreditModel.reference,
+                         CreditIdempotencyModel.transaction_date == CreditModel.transaction_date)
+                ).filter(tuple_(CreditIdempotencyModel.partner_code,
+                                CreditIdempotencyModel.idempotency_key).in_(keys))}
+
+    @staticmethod
+    def batch_result(index: int, credit: CreditModel | None) -> CreditBatchResult:
+        if credit is None:
+            # the key's credit is not visible, e.g. it was deleted
+            return CreditBatchResult(index=index, error="idempotency key in use")
+        return CreditBatchResult(index=index, reference=credit.reference, amount=credit.amount,
+                                 promotion_id=credit.promotion_id)
+
+    def skip_repeated_items(self, items: list[CreditCreate], indexes: list[int],
+                            results: list[CreditBatchResult]) -> tuple[list[int], dict[int, int]]:
+        """
+        Fill in the results of items whose idempotency key already has a credit, and return the indexes
+        still to insert along with {index: index of the earlier item} for keys repeated within the batch.
+        """
+        keys = {(items[index].partner_code, items[index].idempotency_key) for index in indexes
+                if items[index].idempotency_key is not None}
+        if not keys:
+            return indexes, {}
+        existing = self.get_credits_by_idempotency_keys(keys)
+        pending, repeats, first = [], {}, {}
+        for index in indexes:
+            key = (items[index].partner_code, items[index].idempotency_key)
+            if items[index].idempotency_key is None:
+                pending.append(index)
+            elif key in existing:
+                results[index] = self.batch_result(index, existing[key])
+            elif key in first:
+                repeats[index] = first[key]
+            else:
+                first[key] = index
+                pending.append(index)
+        return pending, repeats
+
+    def get_promotion_candidates(self, airline_code: str, partner_code: str,
+                                 promotion_id: int | None) -> PromotionCandidates:
+        if promotion_id is None:
+            return active_promotions.get_candidates(self.db, airline_code=airline_code, partner_code=partner_code)
+        promotion = active_promotions.get_by_id(self.db, promotion_id=promotion_id)
+        if promotion is None:
+            promotion = PromotionCRUD(self.db).get_promotion_by_id(promotion_id=promotion_id)
+            promotion = compile_promotion(promotion) if promotion else None
+        return PromotionCandidates([promotion] if promotion else [])
+
+    def has_credit(self, member_id: str, airline_code: str) -> bool:
+        return self.db.scalar(HAS_CREDIT, {"member_id": member_id, "airline_code": airline_code})
+
+    def is_first_transaction(self, member_id: str, airline_code: str) -> bool:
+        """
+        Only asks the database when the seen-member filter reports a (possible) earlier credit
+        """
+        if not seen_members.might_have_seen(self.db, airline_code, member_id):
+            return True
+        return not self.has_credit(member_id, airline_code)
+
+    def count_credited_members(self) -> dict[str, int]:
+        rows = self.db.query(CreditModel.airline_code, func.count(CreditModel.member_id.distinct())) \
+            .group_by(CreditModel.airline_code).all()
+        return {airline_code: count for airline_code, count in rows}
+
+    def get_credited_members(self, after_id: int = 0) -> Iterator[tuple[int, str, str, datetime]]:
+        statement = select(CreditModel.id, CreditModel.airline_code, CreditModel.member_id,
+                           CreditModel.transaction_date) \
+            .where(CreditModel.id > after_id).order_by(CreditModel.id)
+        return self.db.execute(statement.execution_options(yield_per=10000))
+
+    def get_monthly_rollup(self, member_id: str, airline_code: str, partner_code: str,
+                           month: date) -> CreditMonthlyRollupModel | None:
+        return self.db.get(CreditMonthlyRollupModel, (member_id, airline_code, partner_code, month),
+                           with_for_update=True)
+
+    def get_monthly_rollups(self, keys: set[tuple[str, str, str, date]]) -> dict[tuple, CreditMonthlyRollupModel]:
+        columns = (CreditMonthlyRollupModel.member_id, CreditMonthlyRollupModel.airline_code,
+                   CreditMonthlyRollupModel.partner_code, CreditMonthlyRollupModel.month)
+        # locked in key order, so that concurrent batches over the same members cannot deadlock
+        rollups = self.db.query(CreditMonthlyRollupModel).filter(tuple_(*columns).in_(keys)) \
+            .order_by(*columns).with_for_update().all()
+        return {(rollup.member_id, rollup.airline_code, rollup.partner_code, rollup.month): rollup
+                for rollup in rollups}
+
+    @staticmethod
+    def with_monthly_totals(additional_info: dict[str, Any], previous_amount: int, previous_transactions: int,
+                            amount: int) -> dict[str, Any]:
+        return {
+            **additional_info,
+            PREVIOUS_MONTHLY_AMOUNT_KEY: previous_amount,
+            MONTHLY_AMOUNT_KEY: previous_amount + amount,
+            MONTHLY_TRANSACTIONS_KEY: previous_transactions + 1
+        }
+
+    @staticmethod
+    def monthly_rollup_row(key: tuple[str, str, str, date], totals) -> dict[str, Any]:
+        (member_id, airline_code, partner_code, month), (amount, points, transactions) = key, totals
+        return {"member_id": member_id, "airline_code": airline_code, "partner_code": partner_code, "month": month,
+                "amount": amount, "points": points, "transactions": transactions}
+
+    @staticmethod
+    def upsert_monthly_rollups(rows: list[dict[str, Any]]):
+        """
+        Add each row's totals to its rollup. Rows must have distinct keys.
+        """
+        return CreditCRUD.add_to_monthly_rollups(insert(CreditMonthlyRollupModel).values(rows))
+
+    @staticmethod
+    def add_to_monthly_rollups(statement):
+        return statement.on_conflict_do_update(
+            index_elements=[CreditMonthlyRollupModel.member_id, CreditMonthlyRollupModel.airline_code,
+                            CreditMonthlyRollupModel.partner_code, CreditMonthlyRollupModel.month],
+            set_={"amount": CreditMonthlyRollupModel.amount + statement.excluded.amount,
+                  "points": CreditMonthlyRollupModel.points + statement.excluded.points,
+                  "transactions": CreditMonthlyRollupModel.transactions + statement.excluded.transactions}
+        )
 
     def delete_by_email(self, email: str, partner_code: str) -> CreditEmailBoolean:
-        rows_del = self.db.query(CreditModel).filter(CreditModel.email == email,
-                                                     CreditModel.partner_code == partner_code).delete()
+        rows_del = self.delete_credits(CreditModel.email == email, CreditModel.partner_code == partner_code)
         self.db.commit()
         if rows_del > 0:
             return CreditEmailBoolean(email=email, boolean=True)
         return CreditEmailBoolean(email=email, boolean=False)
 
     def delete_by_reference(self, reference: str, partner_code: str) -> CreditReferenceBoolean:
-        rows_del = self.db.query(CreditModel).filter(CreditModel.reference == reference,
-                                                     CreditModel.partner_code == partner_code).delete()
+        rows_del = self.delete_credits(*self.reference_filter(reference, partner_code))
         self.db.commit()
         if rows_del == 1:
             return CreditReferenceBoolean(reference=reference, boolean=True)
         return CreditReferenceBoolean(reference=reference, boolean=False)
+
+    def delete_credits(self, *conditions) -> int:
+        """
+        Delete the matching credits and release their references and idempotency keys
+        """
+        references = self.db.scalars(delete(CreditModel).where(*conditions).returning(CreditModel.reference)).all()
+        for reference in references:
+            credit_cache.invalidate(str(reference))
+        if references:
+            self.db.execute(delete(CreditIdempotencyModel).where(CreditIdempotencyModel.reference.in_(references)))
+            self.db.execute(delete(CreditReferenceModel).where(CreditReferenceModel.reference.in_(references)))
+        return len(references)
+
+
+# only used while status changes arrive over status_events, which drops the entries they affect
+credit_cache = CreditCache(enabled=lambda: status_events.live)
+status_events.add_listener(credit_cache.invalidate)
+seen_members = SeenMemberFilter(lambda db: CreditCRUD(db).count_credited_members(),
+                                lambda db, after_id: CreditCRUD(db).get_credited_members(after_id))
+
+
+class AsyncCreditService(AsyncAppService):
+    sync_class = CreditService
+
+
+class AsyncCreditCRUD(AsyncAppCRUD):
+    sync_class = CreditCRUD
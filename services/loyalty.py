@@ -1,8 +1,9 @@
 from models.loyalty import LoyaltyModel
 from schemas.loyalty import LoyaltyValidate, LoyaltyItem
 from utils.service_result import ServiceResult
-from services.main import AppService, AppCRUD
+from services.main import AppService, AppCRUD, read_only, AsyncAppService, AsyncAppCRUD
 from utils.app_exceptions import AppException
+from utils.validators import loyalty_patterns
 import re
 
 
@@ -23,6 +24,7 @@ class LoyaltyService(AppService):
 
 
 class LoyaltyCRUD(AppCRUD):
+    @read_only
     def get_all(self) -> list[LoyaltyModel] | None:
         item = self.db.query(LoyaltyModel).all()
         if item:
@@ -46,7 +48,16 @@ class LoyaltyCRUD(AppCRUD):
             self.db.add(item)
             self.db.commit()
             self.db.refresh(item)
+            loyalty_patterns.invalidate()
             return item
 
         except re.error:
             return "invalid regex"
+
+
+class AsyncLoyaltyService(AsyncAppService):
+    sync_class = LoyaltyService
+
+
+class AsyncLoyaltyCRUD(AsyncAppCRUD):
+    sync_class = LoyaltyCRUD
@@ -1,4 +1,8 @@
+import functools
+import inspect
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from utils.replicas import RoutingSession
 
 
 class DBSessionContext(object):
@@ -12,3 +16,50 @@ class AppService(DBSessionContext):
 
 class AppCRUD(DBSessionContext):
     pass
+
+
+def read_only(method=None, *, recheck_empty: bool = False):
+    """
+    Marks a CRUD method that only reads, whose queries a RoutingSession may send to a replica. With
+    recheck_empty, an empty result from a replica is read again on the primary (see RoutingSession.read).
+    """
+    if method is None:
+        return functools.partial(read_only, recheck_empty=recheck_empty)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not isinstance(self.db, RoutingSession):
+            return method(self, *args, **kwargs)
+        return self.db.read(lambda: method(self, *args, **kwargs), recheck_empty)
+    return wrapper
+
+
+class AsyncDBSessionContext(object):
+    """
+    Async counterpart of the sync class in sync_class: each of its methods becomes a coroutine that runs
+    it through AsyncSession.run_sync. The sync code's queries then go over the asyncpg connection and
+    are awaited without blocking the event loop, while the query logic stays in one place. Each query
+    yields to the loop, so the sync code must not hold a threading.Lock across one: another request
+    waiting on it would block the loop's thread and deadlock the worker.
+    """
+    sync_class: type[DBSessionContext]
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    def __getattr__(self, name: str):
+        attribute = inspect.getattr_static(self.sync_class, name)
+        if not inspect.isfunction(attribute):
+            return getattr(self.sync_class, name)
+
+        async def method(*args, **kwargs):
+            return await self.db.run_sync(lambda session: attribute(self.sync_class(session), *args, **kwargs))
+        return method
+
+
+class AsyncAppService(AsyncDBSessionContext):
+    pass
+
+
+class AsyncAppCRUD(AsyncDBSessionContext):
+    pass
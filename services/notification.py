@@ -0,0 +1,102 @@
+from models.credit import CreditModel
+from models.notification import NotificationTargetModel, NotificationOutboxModel
+from schemas.credit import CreditReference
+from schemas.notification import NotificationTargetCreate
+from services.main import AppService, AppCRUD, AsyncAppService, AsyncAppCRUD
+from services.credit import CreditCRUD
+from sqlalchemy import CTE, Insert, and_, func, insert, select
+from sqlalchemy.exc import DataError
+from utils.service_result import ServiceResult
+from utils.app_exceptions import AppException
+
+# the credit columns a status change must return (e.g. UPDATE ... RETURNING) for queue_status_notifications
+NOTIFICATION_COLUMNS = (CreditModel.reference, CreditModel.partner_code, CreditModel.member_id,
+                        CreditModel.airline_code, CreditModel.amount, CreditModel.transaction_date,
+                        CreditModel.status, CreditModel.outcome_code)
+
+
+class NotificationService(AppService):
+    def add_target(self, item: NotificationTargetCreate) -> ServiceResult:
+        return ServiceResult(NotificationCRUD(self.db).add_target(item))
+
+    def get_targets(self, partner_code: str) -> ServiceResult:
+        return ServiceResult(NotificationCRUD(self.db).get_targets(partner_code))
+
+    def get_by_reference(self, reference: CreditReference) -> ServiceResult:
+        try:
+            items = NotificationCRUD(self.db).get_by_reference(reference)
+        except DataError:
+            return ServiceResult(AppException.GetItem({"reference": reference.reference}))
+        if not items:
+            return ServiceResult(AppException.GetItem({"reference": reference.reference}))
+        return ServiceResult(items)
+
+    def resend(self, reference: CreditReference) -> ServiceResult:
+        try:
+            queued = NotificationCRUD(self.db).resend(reference)
+        except DataError:
+            return ServiceResult(AppException.GetItem({"reference": reference.reference}))
+        if queued is None:
+            return ServiceResult(AppException.GetItem({"reference": reference.reference}))
+        return ServiceResult({"reference": reference.reference, "queued": queued})
+
+
+class NotificationCRUD(AppCRUD):
+    def add_target(self, item: NotificationTargetCreate) -> NotificationTargetModel:
+        target = NotificationTargetModel(partner_code=item.partner_code, url=str(item.url),
+                                         description=item.description, active=True)
+        self.db.add(target)
+        self.db.commit()
+        self.db.refresh(target)
+        return target
+
+    def get_targets(self, partner_code: str) -> list[NotificationTargetModel]:
+        return self.db.query(NotificationTargetModel).filter(NotificationTargetModel.partner_code == partner_code) \
+            .order_by(NotificationTargetModel.id).all()
+
+    def get_by_reference(self, reference: CreditReference) -> list[NotificationOutboxModel]:
+        return self.db.query(NotificationOutboxModel) \
+            .join(NotificationTargetModel, NotificationTargetModel.id == NotificationOutboxModel.target_id) \
+            .filter(NotificationOutboxModel.reference == reference.reference,
+                    NotificationTargetModel.partner_code == reference.partner_code) \
+            .order_by(NotificationOutboxModel.id).all()
+
+    def resend(self, reference: CreditReference) -> int | None:
+        """
+        Queue the credit's current status again for each active target. None if there is no such credit.
+        """
+        credit = select(*NOTIFICATION_COLUMNS) \
+            .where(*CreditCRUD.reference_filter(reference.reference, reference.partner_code)).cte("credit_status")
+        queued = self.queue_status_notifications(credit).returning(NotificationOutboxModel.id).cte("queued")
+        found, queued = self.db.execute(select(select(func.count()).select_from(credit).scalar_subquery(),
+                                               select(func.count()).select_from(queued).scalar_subquery())).one()
+        self.db.commit()
+        return queued if found else None
+
+    @staticmethod
+    def queue_status_notifications(credits: CTE) -> Insert:
+        """
+        INSERT ... SELECT of one outbox row per credit in credits (selecting NOTIFICATION_COLUMNS) and
+        active target of its partner. Used as a CTE alongside the status change, so both commit together.
+        """
+        payload = func.jsonb_build_object("event", "credit.status",
+                                          "reference", credits.c.reference,
+                                          "member_id", credits.c.member_id,
+                                          "airline_code", credits.c.airline_code,
+                                          "amount", credits.c.amount,
+                                          "transaction_date", credits.c.transaction_date,
+                                          "status", credits.c.status,
+                                          "outcome_code", credits.c.outcome_code)
+        rows = select(NotificationTargetModel.id, credits.c.reference, payload) \
+            .join_from(credits, NotificationTargetModel,
+                       and_(NotificationTargetModel.partner_code == credits.c.partner_code,
+                            NotificationTargetModel.active))
+        return insert(NotificationOutboxModel).from_select(["target_id", "reference", "payload"], rows)
+
+
+class AsyncNotificationService(AsyncAppService):
+    sync_class = NotificationService
+
+
+class AsyncNotificationCRUD(AsyncAppCRUD):
+    sync_class = NotificationCRUD
@@ -1,11 +1,19 @@
 from typing import List, Type
-from sqlalchemy import or_
+from sqlalchemy import or_, select, bindparam
 from models.promotions import PromotionModel
-from schemas.promotions import PromotionBase, GetPromotionBasedOnPartner
+from schemas.promotions import PromotionBase, GetPromotionBasedOnPartner, PromotionQuoteItem, PromotionQuoteResponse
 from utils.service_result import ServiceResult
-from services.main import AppService, AppCRUD
+from services.main import AppService, AppCRUD, read_only, AsyncAppService, AsyncAppCRUD
 from utils.app_exceptions import AppException
 from datetime import datetime
+from utils.promotion_compiler import compile_points_rule, cache_points_rule, compile_conditions
+from utils.promotion_index import ActivePromotionIndex
+from utils.promotion_quote import quote_best_promotions
+
+# built once with bind parameters, like the credit lookups
+PROMOTIONS_BY_PARTNER = select(PromotionModel).where(PromotionModel.partner_code == bindparam("partner_code"),
+                                                     PromotionModel.expiry > bindparam("now"))
+PROMOTION_BY_ID = select(PromotionModel).where(PromotionModel.id == bindparam("promotion_id")).limit(1)
 
 
 class PromotionService(AppService):
@@ -33,22 +41,35 @@ class PromotionService(AppService):
             return ServiceResult(AppException.GetItem())
         return ServiceResult(item)
 
+    def quote(self, items: list[PromotionQuoteItem], partner_code: str) -> ServiceResult:
+        item = PromotionCRUD(self.db).quote(items, partner_code)
+        return ServiceResult(item)
+
 
 class PromotionCRUD(AppCRUD):
+    @read_only
     def get_all_promotions_partner(self, partner_code: str) -> list[Type[PromotionModel]] | None:
-        item = self.db.query(PromotionModel).filter(PromotionModel.partner_code == partner_code,
-                                                    PromotionModel.expiry > datetime.now()).all()
+        item = self.db.scalars(PROMOTIONS_BY_PARTNER, {"partner_code": partner_code, "now": datetime.now()}).all()
         if item:
             return item
         return None
 
     def get_promotion_by_id(self, promotion_id: int) -> PromotionModel | None:
-        item = self.db.query(PromotionModel).filter(PromotionModel.id == promotion_id).first()
+        item = self.db.scalars(PROMOTION_BY_ID, {"promotion_id": promotion_id}).first()
         if item:
             return item
         return None
 
-    def add_items(self, item: PromotionBase) -> PromotionModel:
+    def add_items(self, item: PromotionBase) -> PromotionModel | AppException.AddItem:
+        try:
+            compiled_points_rule = compile_points_rule(item.points_rule)
+        except ValueError:
+            return AppException.AddItem({"message": "Points rule invalid"})
+        try:
+            compile_conditions(item.conditions)
+        except (KeyError, TypeError):
+            return AppException.AddItem({"message": "Conditions invalid"})
+
         item = PromotionModel(
             airline_code=item.airline_code,
             partner_code=item.partner_code,
@@ -63,6 +84,8 @@ class PromotionCRUD(AppCRUD):
         self.db.add(item)
         self.db.commit()
         self.db.refresh(item)
+        cache_points_rule(item.id, item.points_rule, compiled_points_rule)
+        active_promotions.invalidate()
         return item
 
     def get_airline_partner_promotions(self, airline_code: str, partner_code: str) -> list[PromotionModel] | None:
@@ -73,9 +96,42 @@ class PromotionCRUD(AppCRUD):
             return item
         return None
 
+    def get_active_promotions(self) -> list[PromotionModel]:
+        return self.db.query(PromotionModel).filter(PromotionModel.expiry > datetime.now()) \
+            .order_by(PromotionModel.id).all()
+
+    def quote(self, items: list[PromotionQuoteItem], partner_code: str) -> list[PromotionQuoteResponse]:
+        by_airline = {}
+        for index, item in enumerate(items):
+            by_airline.setdefault(item.airline_code, []).append(index)
+
+        points, promotion_ids = [0] * len(items), [None] * len(items)
+        for airline_code, indexes in by_airline.items():
+            best, best_id = quote_best_promotions(active_promotions.get_candidates(self.db, airline_code, partner_code),
+                                                  [items[index].amount for index in indexes],
+                                                  [items[index].additional_info for index in indexes])
+            for index, item_points, item_promotion_id in zip(indexes, best.tolist(), best_id.tolist()):
+                points[index] = item_points
+                promotion_ids[index] = item_promotion_id or None
+
+        return [PromotionQuoteResponse(amount=item.amount, airline_code=item.airline_code,
+                                       additional_info=item.additional_info,
+                                       points=points[index], promotion_id=promotion_ids[index])
+                for index, item in enumerate(items)]
+
     def get_all_promotion_names(self, partner_code: str) -> list[PromotionModel] | None:
-        item = self.db.query(PromotionModel).filter(PromotionModel.partner_code == partner_code,
-                                                    PromotionModel.expiry > datetime.now()).all()
+        item = self.db.scalars(PROMOTIONS_BY_PARTNER, {"partner_code": partner_code, "now": datetime.now()}).all()
         if item:
             return item
         return None
+
+
+active_promotions = ActivePromotionIndex(lambda db: PromotionCRUD(db).get_active_promotions())
+
+
+class AsyncPromotionService(AsyncAppService):
+    sync_class = PromotionService
+
+
+class AsyncPromotionCRUD(AsyncAppCRUD):
+    sync_class = PromotionCRUD
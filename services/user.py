@@ -1,12 +1,16 @@
-from services.main import AppService, AppCRUD
+from services.main import AppService, AppCRUD, read_only, AsyncAppService, AsyncAppCRUD
 from utils.service_result import ServiceResult
 from utils.app_exceptions import AppException
 from utils.credentials_misc import verify_password, create_access_token, get_password_hash
 from models.user import UserModel
+from sqlalchemy import select, bindparam
 from schemas.user import UserToken, UserRegisterRequest
 from config.credentials_config import ACCESS_TOKEN_EXPIRE_MINUTES
 from datetime import timedelta
 
+# built once with bind parameters, as every authenticated request looks its user up
+USER_BY_EMAIL = select(UserModel).where(UserModel.email == bindparam("email")).limit(1)
+
 
 class UserService(AppService):
     def authenticate_user(self, email: str, password: str) -> ServiceResult:
@@ -31,8 +35,12 @@ class UserService(AppService):
 
 
 class UserCRUD(AppCRUD):
+    @read_only(recheck_empty=True)
+    def get_by_email(self, email: str) -> UserModel | None:
+        return self.db.scalars(USER_BY_EMAIL, {"email": email}).first()
+
     def authenticate_user(self, email: str, password: str) -> UserModel | None:
-        user = self.db.query(UserModel).filter(UserModel.email == email).first()
+        user = self.db.scalars(USER_BY_EMAIL, {"email": email}).first()
         if user:
             if verify_password(password, user.password):
                 return user
@@ -53,3 +61,11 @@ class UserCRUD(AppCRUD):
         self.db.commit()
         self.db.refresh(item)
         return item
+
+
+class AsyncUserService(AsyncAppService):
+    sync_class = UserService
+
+
+class AsyncUserCRUD(AsyncAppCRUD):
+    sync_class = UserCRUD
@@ -0,0 +1,9 @@
+import os
+
+# TestClient and pytest-asyncio run each request or test on a new event loop
+os.environ.setdefault("ASYNC_POOL", "null")
+
+from config import database  # noqa: E402
+
+# before the test modules import the engines and session factories by name
+database.init_engines()
@@ -1,14 +1,35 @@
+import json
 import pytest
 from fastapi.testclient import TestClient
 from main import app
 from datetime import timedelta
 from config.database import get_db
-from services.credit import CreditService, CreditCRUD
-from schemas.credit import CreditCreate, CreditMember, CreditReference, CreditEmail, CreditEmailBoolean, CreditReferenceBoolean
-from models.credit import CreditModel
+from services.credit import CreditService, CreditCRUD, seen_members
+from schemas.credit import CreditCreate, CreditBatch, CreditMember, CreditReference, CreditEmail, CreditEmailBoolean, CreditReferenceBoolean
+from models.credit import CreditModel, CreditMonthlyRollupModel, CreditIdempotencyModel
+from models.promotions import PromotionModel
+from services.promotions import PromotionCRUD
+from schemas.promotions import PromotionBase
+from datetime import datetime, timezone
+from utils.misc import uuid7, reference_time, reference_range, reference_date_window, generate_reference
+from jobs.partitions import maintain, create_default_partition, month_start, partition_name
+from jobs.fulfilment import AccrualTemplate, fulfil_program
+from jobs.handback import chunks, apply_chunk, ingest, HEADER
+from config.database import engine
+from sqlalchemy import text, insert, select, delete
+from datetime import date
+import uuid
 from utils.promotion_misc import validate_promotions, eval_points_conditions, calculate_points
 from utils.validators import validate_airline_code, validate_member_id
 from utils.credentials_misc import create_access_token
+from utils.bloom_filter import BloomFilter, SeenMemberFilter
+from utils.status_events import StatusEvents, PostgresChannel, status_events
+from utils.credit_cache import CreditCache, canonical_reference, etag_matches
+from services.credit import credit_cache
+from utils.app_exceptions import AppException
+import asyncio
+import time
+import threading
 
 client = TestClient(app)
 
@@ -569,3 +590,814 @@ class TestDeleteByReference:
         assert isinstance(item, CreditReferenceBoolean)
         assert item.reference == add_response.json()["reference"]
         assert item.boolean
+
+
+class TestMonthlyRollup:
+    member_id = "5555555555"
+
+    def cleanup(self, db):
+        db.query(CreditModel).filter(CreditModel.member_id == self.member_id).delete()
+        db.query(CreditMonthlyRollupModel).filter(CreditMonthlyRollupModel.member_id == self.member_id).delete()
+        db.query(PromotionModel).filter(PromotionModel.partner_code == "TEST").delete()
+        db.commit()
+
+    def add_credit(self, db, promotion_id=None):
+        item = CreditCreate(
+            member_id=self.member_id,
+            amount=1500,
+            first_name="You Xiang",
+            last_name="Teo",
+            airline_code="GJP",
+            email="rollup@gmail.com",
+            additional_info={"card": "black"},
+            promotion_id=promotion_id
+        )
+        item.set_partner_code("DBS")
+        return CreditCRUD(db).add_item(item)
+
+    def test_rollup_is_maintained(self):
+        db = next(get_db())
+        self.cleanup(db)
+        self.add_credit(db)
+        self.add_credit(db)
+
+        month = datetime.now().date().replace(day=1)
+        rollup = CreditCRUD(db).get_monthly_rollup(self.member_id, "GJP", "DBS", month)
+        assert rollup.amount == 3000
+        assert rollup.points == 3000
+        assert rollup.transactions == 2
+        self.cleanup(db)
+
+    def test_promotion_on_monthly_amount(self):
+        db = next(get_db())
+        self.cleanup(db)
+        promotion = PromotionCRUD(db).add_items(PromotionBase(
+            name="1000 more points",
+            description="1000 more points once 2000 points are exchanged in a month",
+            airline_code="GJP",
+            partner_code="TEST",
+            expiry=datetime.now() + timedelta(days=30),
+            points_rule={"point_condition": [["x > 0", "x + 1000"]]},
+            conditions={"member.monthly_amount": {"op": "gte", "value": 2000},
+                        "member.previous_monthly_amount": {"op": "lt", "value": 2000}},
+            start_date_for_card=datetime(2024, 1, 1),
+            end_date_for_card=datetime(2024, 12, 31)
+        ))
+
+        assert self.add_credit(db, promotion.id).amount == 1500
+        assert self.add_credit(db, promotion.id).amount == 2500
+        assert self.add_credit(db, promotion.id).amount == 1500
+
+        month = datetime.now().date().replace(day=1)
+        rollup = CreditCRUD(db).get_monthly_rollup(self.member_id, "GJP", "DBS", month)
+        assert rollup.amount == 4500
+        assert rollup.points == 5500
+        assert rollup.transactions == 3
+        self.cleanup(db)
+
+
+class TestSeenMemberFilter:
+    def test_bloom_filter(self):
+        bloom = BloomFilter(1000, 0.01)
+        members = [str(1000000000 + i) for i in range(1000)]
+        for member_id in members:
+            bloom.add(member_id)
+        assert all(member_id in bloom for member_id in members)
+        false_positives = sum(str(2000000000 + i) in bloom for i in range(10000))
+        assert false_positives < 300
+        assert bloom.false_positive_rate == pytest.approx(0.01, rel=0.2)
+        assert bloom.memory_bytes == (bloom.size + 7) // 8
+
+    def test_rebuild_and_catch_up(self):
+        old = datetime.now() - timedelta(minutes=5)
+        rows = [(1, "GJP", "1111111111", old), (2, "GJP", "2222222222", old), (3, "QFF", "1111111111", old)]
+        loads = []
+
+        def loader(db, after_id):
+            loads.append(after_id)
+            return [row for row in rows if row[0] > after_id]
+
+        seen = SeenMemberFilter(lambda db: {"GJP": 2, "QFF": 1}, loader)
+        # nothing is ruled out before the filter is built
+        assert seen.might_have_seen(None, "EK", "1111111111")
+        assert loads == []
+        seen.rebuild(None)
+        assert seen.might_have_seen(None, "GJP", "2222222222")
+        assert not seen.might_have_seen(None, "QFF", "2222222222")
+        assert loads == [0, 3]
+
+        rows.append((4, "EK", "1111111111", old))
+        assert seen.might_have_seen(None, "EK", "1111111111")
+        assert loads == [0, 3, 3]
+
+        seen.add("EK", "3333333333")
+        assert seen.might_have_seen(None, "EK", "3333333333")
+        assert [stats["airline_code"] for stats in seen.stats()] == ["EK", "GJP", "QFF"]
+
+    def test_catch_up_rereads_recent_gap(self):
+        old, recent = datetime.now() - timedelta(minutes=5), datetime.now()
+        rows = [(1, "GJP", "1111111111", old), (3, "GJP", "3333333333", recent)]
+        loads = []
+
+        def loader(db, after_id):
+            loads.append(after_id)
+            return sorted(row for row in rows if row[0] > after_id)
+
+        seen = SeenMemberFilter(lambda db: {"GJP": 2}, loader)
+        seen.rebuild(None)
+        # id 2 was taken by a credit that commits after id 3
+        rows.append((2, "GJP", "2222222222", recent))
+        assert seen.might_have_seen(None, "GJP", "2222222222")
+        assert loads == [0, 1]
+
+    def test_overflow_is_rebuilt_by_refresh_only(self):
+        counts = [{"GJP": 30}, {"GJP": 5}]
+        rows = [(i, "GJP", str(1000000000 + i), datetime.now() - timedelta(minutes=5)) for i in range(1, 31)]
+        seen = SeenMemberFilter(lambda db: counts.pop(),
+                                lambda db, after_id: [row for row in rows if row[0] > after_id], min_capacity=10)
+        seen.rebuild(None)
+        assert seen.stats()[0]["members"] > seen.stats()[0]["capacity"]
+        seen.might_have_seen(None, "GJP", "2000000000")
+        assert len(counts) == 1
+        seen.refresh(None)
+        assert not counts
+        assert seen.stats()[0]["capacity"] == 60
+
+    def test_first_transaction_promotion(self):
+        db = next(get_db())
+        member_id = "6666666666"
+        db.query(CreditModel).filter(CreditModel.member_id == member_id).delete()
+        db.query(PromotionModel).filter(PromotionModel.partner_code == "TEST").delete()
+        db.commit()
+        promotion = PromotionCRUD(db).add_items(PromotionBase(
+            name="Welcome bonus",
+            description="500 more points on the first exchange",
+            airline_code="GJP",
+            partner_code="TEST",
+            expiry=datetime.now() + timedelta(days=30),
+            points_rule={"point_condition": [["x > 0", "x + 500"]]},
+            conditions={"member.first_transaction": {"op": "eq", "value": True}},
+            start_date_for_card=datetime(2024, 1, 1),
+            end_date_for_card=datetime(2024, 12, 31)
+        ))
+        crud = CreditCRUD(db)
+        assert crud.is_first_transaction(member_id, "GJP")
+
+        item = CreditCreate(
+            member_id=member_id,
+            amount=1000,
+            first_name="You Xiang",
+            last_name="Teo",
+            airline_code="GJP",
+            email="welcome@gmail.com",
+            additional_info={},
+            promotion_id=promotion.id
+        )
+        item.set_partner_code("DBS")
+        assert crud.add_item(item).amount == 1500
+        assert not crud.is_first_transaction(member_id, "GJP")
+        assert crud.add_item(item).amount == 1000
+
+        db.query(CreditModel).filter(CreditModel.member_id == member_id).delete()
+        db.query(CreditMonthlyRollupModel).filter(CreditMonthlyRollupModel.member_id == member_id).delete()
+        db.query(PromotionModel).filter(PromotionModel.partner_code == "TEST").delete()
+        db.commit()
+        # the filter still has the member, and the database says otherwise
+        assert seen_members.might_have_seen(db, "GJP", member_id)
+        assert crud.is_first_transaction(member_id, "GJP")
+
+    def test_first_transaction_credited_by_another_worker(self):
+        db = next(get_db())
+        member_id = "6666666667"
+        crud = CreditCRUD(db)
+        seen_members.rebuild(db)
+        # inserted without seen_members.add(), as another worker's credit is
+        db.add(CreditModel(member_id=member_id, first_name="You Xiang", last_name="Teo", email="welcome@gmail.com",
+                           reference=generate_reference(), airline_code="GJP", partner_code="DBS",
+                           transaction_date=datetime.now(), amount=100, additional_info={}, status="In Progress"))
+        db.commit()
+        try:
+            # caught up before answering "not seen"
+            assert seen_members.might_have_seen(db, "GJP", member_id)
+            assert not crud.is_first_transaction(member_id, "GJP")
+        finally:
+            db.query(CreditModel).filter(CreditModel.member_id == member_id).delete()
+            db.commit()
+
+    def test_admin_seen_members(self, client_with_cleanup):
+        client, headers = client_with_cleanup
+        assert client.get("/admin/seen_members/", headers=headers).status_code == 403
+        token = create_access_token({"email": "ryzeros@gmail.com"}, timedelta(minutes=5))
+        response = client.get("/admin/seen_members/", headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 200
+        assert all(stats["memory_bytes"] > 0 for stats in response.json())
+        assert client.get("/admin/seen_members/").status_code == 401
+
+
+class TestAddBatch:
+    member_id = "7777777777"
+
+    def make_item(self, member_id=None, airline_code="GJP", amount=1500, promotion_id=None):
+        return {
+            "member_id": member_id or self.member_id,
+            "amount": amount,
+            "first_name": "You Xiang",
+            "last_name": "Teo",
+            "airline_code": airline_code,
+            "email": "ryzeros@gmail.com",
+            "additional_info": {},
+            "promotion_id": promotion_id
+        }
+
+    def cleanup(self, db):
+        db.query(CreditModel).filter(CreditModel.member_id == self.member_id).delete()
+        db.query(CreditMonthlyRollupModel).filter(CreditMonthlyRollupModel.member_id == self.member_id).delete()
+        db.query(PromotionModel).filter(PromotionModel.partner_code == "TEST").delete()
+        db.commit()
+
+    def test_add_batch(self, client_with_cleanup):
+        client, headers = client_with_cleanup
+        db = next(get_db())
+        self.cleanup(db)
+        data = {"items": [self.make_item(), self.make_item(airline_code="XXX"), self.make_item(member_id="15"),
+                          self.make_item(amount=500)]}
+        response = client.post("/credit/add_batch/", json=data, headers=headers)
+        assert response.status_code == 200
+        results = response.json()
+        assert [result["error"] for result in results] == [None, "invalid airline code", "invalid member ID", None]
+        assert results[1]["reference"] is None and results[2]["reference"] is None
+
+        reference = CreditReference(reference=results[3]["reference"])
+        reference.set_partner_code("DBS")
+        credit = CreditCRUD(db).get_item_by_reference(reference)
+        assert credit.amount == 500
+        assert credit.status == "In Progress"
+
+        month = datetime.now().date().replace(day=1)
+        rollup = CreditCRUD(db).get_monthly_rollup(self.member_id, "GJP", "DBS", month)
+        assert (rollup.amount, rollup.transactions) == (2000, 2)
+        self.cleanup(db)
+
+    def test_add_batch_empty(self, client_with_cleanup):
+        client, headers = client_with_cleanup
+        assert client.post("/credit/add_batch/", json={"items": []}, headers=headers).status_code == 422
+
+    def test_add_batch_matches_add_item(self):
+        db = next(get_db())
+        self.cleanup(db)
+        promotion = PromotionCRUD(db).add_items(PromotionBase(
+            name="1000 more points",
+            description="1000 more points on the exchange that takes the month past 2000",
+            airline_code="GJP",
+            partner_code="TEST",
+            expiry=datetime.now() + timedelta(days=30),
+            points_rule={"point_condition": [["x > 0", "x + 1000"]]},
+            conditions={"member.monthly_amount": {"op": "gte", "value": 2000},
+                        "member.previous_monthly_amount": {"op": "lt", "value": 2000}},
+            start_date_for_card=datetime(2024, 1, 1),
+            end_date_for_card=datetime(2024, 12, 31)
+        ))
+        batch = CreditBatch(items=[self.make_item(promotion_id=promotion.id) for _ in range(3)])
+        batch.set_partner_code("DBS")
+        results = CreditCRUD(db).add_batch(batch.items)
+        assert [result.amount for result in results] == [1500, 2500, 1500]
+        assert [result.promotion_id for result in results] == [0, promotion.id, 0]
+        assert len({result.reference for result in results}) == 3
+
+        item = CreditCreate(**self.make_item(promotion_id=promotion.id))
+        item.set_partner_code("DBS")
+        assert CreditCRUD(db).add_item(item).amount == 1500
+        self.cleanup(db)
+
+
+class TestIdempotentCredit:
+    member_id = "8888888888"
+
+    def cleanup(self, db):
+        db.query(CreditIdempotencyModel).filter(CreditIdempotencyModel.idempotency_key.in_(["order-1", "order-2"])) \
+            .delete()
+        db.query(CreditModel).filter(CreditModel.member_id == self.member_id).delete()
+        db.query(CreditMonthlyRollupModel).filter(CreditMonthlyRollupModel.member_id == self.member_id).delete()
+        db.commit()
+
+    def make_item(self, idempotency_key=None):
+        item = CreditCreate(member_id=self.member_id, amount=700, first_name="You Xiang", last_name="Teo",
+                            airline_code="GJP", email="idempotent@gmail.com", additional_info={},
+                            idempotency_key=idempotency_key)
+        item.set_partner_code("DBS")
+        return item
+
+    def test_add_item_idempotency_key(self, client_with_cleanup):
+        client, headers = client_with_cleanup
+        db = next(get_db())
+        self.cleanup(db)
+        data = self.make_item("order-1").model_dump()
+        first = client.post("/credit/add/", json=data, headers=headers)
+        second = client.post("/credit/add/", json=data, headers=headers)
+        assert first.status_code == second.status_code == 200
+        assert first.json() == second.json()
+
+        third = CreditCRUD(db).add_item(self.make_item("order-2"))
+        assert str(third.reference) != first.json()["reference"]
+        assert CreditCRUD(db).add_item(self.make_item()).reference != third.reference
+
+        assert db.query(CreditModel).filter(CreditModel.member_id == self.member_id).count() == 3
+        month = datetime.now().date().replace(day=1)
+        rollup = CreditCRUD(db).get_monthly_rollup(self.member_id, "GJP", "DBS", month)
+        assert (rollup.amount, rollup.transactions) == (2100, 3)
+        self.cleanup(db)
+
+    def test_add_batch_idempotency_key(self):
+        db = next(get_db())
+        self.cleanup(db)
+        original = CreditCRUD(db).add_item(self.make_item("order-1"))
+        results = CreditCRUD(db).add_batch([self.make_item("order-1"), self.make_item("order-2"),
+                                            self.make_item("order-2"), self.make_item()])
+        assert results[0].reference == original.reference
+        assert results[1].reference == results[2].reference
+        assert [result.index for result in results] == [0, 1, 2, 3]
+        assert db.query(CreditModel).filter(CreditModel.member_id == self.member_id).count() == 3
+        self.cleanup(db)
+
+    def test_add_batch_key_taken_concurrently(self):
+        db, other = next(get_db()), next(get_db())
+        self.cleanup(db)
+        # another request's credit, not yet committed when the batch looks its key up
+        reference, transaction_date = generate_reference(), datetime.now()
+        other.add(CreditIdempotencyModel(partner_code="DBS", idempotency_key="order-1", reference=reference,
+                                         transaction_date=transaction_date))
+        other.add(CreditModel(member_id=self.member_id, first_name="You Xiang", last_name="Teo",
+                              email="idempotent@gmail.com", reference=reference, airline_code="GJP",
+                              partner_code="DBS", transaction_date=transaction_date, amount=700,
+                              additional_info={}, status="In Progress"))
+        other.flush()
+        results = []
+        thread = threading.Thread(target=lambda: results.extend(
+            CreditCRUD(db).add_batch([self.make_item("order-2"), self.make_item("order-1")])))
+        thread.start()
+        time.sleep(0.3)
+        other.commit()
+        thread.join()
+        assert str(results[1].reference) == reference
+        assert results[0].reference is not None and results[0].error is None
+        assert db.query(CreditModel).filter(CreditModel.member_id == self.member_id).count() == 2
+        other.close()
+        self.cleanup(db)
+
+    def test_reference_taken_at_another_time(self, monkeypatch):
+        db = next(get_db())
+        self.cleanup(db)
+        first = CreditCRUD(db).add_item(self.make_item())
+        # uix_1 would let the same reference in with a later transaction_date
+        monkeypatch.setattr("services.credit.generate_reference", lambda: str(first.reference))
+        assert CreditCRUD(db).add_item(self.make_item()).context == {"message": "Reference in use"}
+        assert isinstance(CreditCRUD(db).add_item(self.make_item("order-1")), AppException.AddItem)
+        assert CreditCRUD(db).add_batch([self.make_item()]) is None
+        assert db.query(CreditModel).filter(CreditModel.member_id == self.member_id).count() == 1
+        # the key claimed alongside the taken reference was rolled back
+        assert db.query(CreditIdempotencyModel).filter(CreditIdempotencyModel.idempotency_key == "order-1") \
+            .count() == 0
+        self.cleanup(db)
+
+    def test_add_item_conflict_is_not_a_server_error(self, client_with_cleanup, monkeypatch):
+        client, headers = client_with_cleanup
+        db = next(get_db())
+        self.cleanup(db)
+        first = client.post("/credit/add/", json=self.make_item().model_dump(), headers=headers)
+        monkeypatch.setattr("services.credit.generate_reference", lambda: first.json()["reference"])
+        response = client.post("/credit/add/", json=self.make_item().model_dump(), headers=headers)
+        assert response.status_code == 400
+        self.cleanup(db)
+
+    def test_delete_releases_idempotency_key(self):
+        db = next(get_db())
+        self.cleanup(db)
+        first = CreditCRUD(db).add_item(self.make_item("order-1"))
+        assert CreditCRUD(db).delete_by_reference(str(first.reference), "DBS").boolean
+        assert db.query(CreditIdempotencyModel).filter(CreditIdempotencyModel.reference == first.reference).count() == 0
+        second = CreditCRUD(db).add_item(self.make_item("order-1"))
+        assert second.reference != first.reference
+        self.cleanup(db)
+
+
+class TestReference:
+    def test_uuid7_is_time_ordered(self):
+        references = [uuid7() for _ in range(10000)]
+        assert references == sorted(references)
+        assert len(set(references)) == len(references)
+        assert all(reference.version == 7 for reference in references)
+        assert abs(reference_time(str(references[0])) - datetime.now(timezone.utc)) < timedelta(seconds=5)
+
+    def test_reference_range(self):
+        reference = uuid7()
+        created = reference_time(reference)
+        low, high = reference_range(created, created + timedelta(milliseconds=1))
+        assert low <= reference < high
+        low, high = reference_range(created - timedelta(seconds=1), created)
+        assert not low <= reference < high
+
+    def test_get_items_created_between(self):
+        db = next(get_db())
+        start = datetime.now()
+        item = CreditCreate(member_id="1234567890", amount=100, first_name="You Xiang", last_name="Teo",
+                            airline_code="GJP", email="ryzeros@gmail.com", additional_info={})
+        item.set_partner_code("DBS")
+        credit = CreditCRUD(db).add_item(item)
+        items = CreditCRUD(db).get_items_created_between(start, datetime.now() + timedelta(seconds=1), "DBS")
+        assert credit.reference in [item.reference for item in items]
+        assert not CreditCRUD(db).get_items_created_between(start - timedelta(days=1), start, "TEST")
+        CreditCRUD(db).delete_by_reference(str(credit.reference), "DBS")
+
+
+class TestPagination:
+    member_id = "4444444444"
+
+    def setup_credits(self, db, count):
+        db.query(CreditModel).filter(CreditModel.member_id == self.member_id).delete()
+        db.commit()
+        batch = CreditBatch(items=[{"member_id": self.member_id, "amount": 100 + index, "first_name": "You Xiang",
+                                    "last_name": "Teo", "airline_code": "GJP", "email": "paging@gmail.com",
+                                    "additional_info": {}} for index in range(count)])
+        batch.set_partner_code("DBS")
+        return [str(result.reference) for result in CreditCRUD(db).add_batch(batch.items)]
+
+    def cleanup(self, db):
+        db.query(CreditModel).filter(CreditModel.member_id == self.member_id).delete()
+        db.query(CreditMonthlyRollupModel).filter(CreditMonthlyRollupModel.member_id == self.member_id).delete()
+        db.commit()
+
+    def test_keyset_pages(self, client_with_cleanup):
+        client, headers = client_with_cleanup
+        db = next(get_db())
+        references = self.setup_credits(db, 5)
+        for url, data in [("/credit/get_by_member_id/", {"member_id": self.member_id, "airline_code": "GJP"}),
+                          ("/credit/get_by_email/", {"email": "paging@gmail.com"})]:
+            pages, cursor = [], None
+            while True:
+                response = client.post(url, json={**data, "limit": 2, "cursor": cursor}, headers=headers)
+                assert response.status_code == 200
+                pages.append([item["reference"] for item in response.json()])
+                cursor = response.headers.get("X-Next-Cursor")
+                if cursor is None:
+                    break
+            assert [len(page) for page in pages] == [2, 2, 1]
+            assert sum(pages, []) == references
+
+            response = client.post(url, json=data, headers=headers)
+            assert len(response.json()) == 5
+            assert "X-Next-Cursor" not in response.headers
+        self.cleanup(db)
+
+    def test_last_page_empty(self, client_with_cleanup):
+        client, headers = client_with_cleanup
+        db = next(get_db())
+        self.setup_credits(db, 2)
+        data = {"member_id": self.member_id, "airline_code": "GJP", "limit": 2}
+        response = client.post("/credit/get_by_member_id/", json=data, headers=headers)
+        cursor = response.headers["X-Next-Cursor"]
+        response = client.post("/credit/get_by_member_id/", json={**data, "cursor": cursor}, headers=headers)
+        assert response.status_code == 200
+        assert response.json() == []
+        assert client.post("/credit/get_by_member_id/", json={**data, "limit": 0},
+                           headers=headers).status_code == 422
+        self.cleanup(db)
+
+    def test_ndjson_stream(self, client_with_cleanup):
+        client, headers = client_with_cleanup
+        db = next(get_db())
+        references = self.setup_credits(db, 3)
+        response = client.post("/credit/get_by_member_id/", json={"member_id": self.member_id, "airline_code": "GJP"},
+                               headers={**headers, "Accept": "application/x-ndjson"})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert [line["reference"] for line in lines] == references
+        assert lines[0]["amount"] == 100
+
+        response = client.post("/credit/get_by_email/", json={"email": "nobody@gmail.com"},
+                               headers={**headers, "Accept": "application/x-ndjson"})
+        assert response.status_code == 200
+        assert response.text == ""
+        self.cleanup(db)
+
+
+class TestPartitions:
+    table = "test_partitioned"
+
+    def setup_table(self, connection):
+        connection.execute(text(f"DROP TABLE IF EXISTS {self.table} CASCADE"))
+        connection.execute(text(f"DROP TABLE IF EXISTS {self.table}_p2024_01_archived"))
+        connection.execute(text(f"CREATE TABLE {self.table} (id integer, transaction_date timestamp) "
+                                "PARTITION BY RANGE (transaction_date)"))
+        create_default_partition(connection, self.table)
+
+    def test_maintain(self):
+        with engine.begin() as connection:
+            self.setup_table(connection)
+            connection.execute(text(f"INSERT INTO {self.table} VALUES (1, '2024-01-15'), (2, '2024-03-02')"))
+            created, detached = maintain(connection, months_ahead=2, retain_months=None, today=date(2024, 1, 20),
+                                         table=self.table)
+            assert created == [f"{self.table}_p2024_01", f"{self.table}_p2024_02", f"{self.table}_p2024_03"]
+            assert detached == []
+            assert connection.execute(text(f"SELECT count(*) FROM {self.table}_default")).scalar() == 0
+            assert connection.execute(text(f"SELECT id FROM {self.table}_p2024_03")).scalar() == 2
+
+            created, detached = maintain(connection, months_ahead=2, retain_months=1, today=date(2024, 3, 5),
+                                         table=self.table)
+            assert created == [f"{self.table}_p2024_04", f"{self.table}_p2024_05"]
+            assert detached == [f"{self.table}_p2024_01"]
+            assert connection.execute(text(f"SELECT count(*) FROM {self.table}")).scalar() == 1
+            assert connection.execute(text(f"SELECT id FROM {self.table}_p2024_01_archived")).scalar() == 1
+            connection.execute(text(f"DROP TABLE {self.table} CASCADE"))
+            connection.execute(text(f"DROP TABLE {self.table}_p2024_01_archived"))
+
+    def test_month_start(self):
+        assert month_start(date(2024, 12, 31), 1) == date(2025, 1, 1)
+        assert month_start(date(2024, 1, 31), -1) == date(2023, 12, 1)
+        assert partition_name(date(2024, 2, 1)) == "credit_p2024_02"
+
+    def test_reference_date_window(self):
+        start, end = reference_date_window(generate_reference())
+        assert start < datetime.now() < end
+        assert reference_date_window("not a reference") is None
+        assert reference_date_window(str(uuid.uuid4())) is None
+
+    def test_date_hint(self, client_with_cleanup):
+        client, headers = client_with_cleanup
+        add_response = add_data(client, headers)
+        data = {"member_id": "0987654321", "airline_code": "GJP"}
+        response = client.post("/credit/get_by_member_id/", headers=headers,
+                               json={**data, "from_date": (datetime.now() - timedelta(days=1)).isoformat()})
+        assert add_response.json()["reference"] in [item["reference"] for item in response.json()]
+        response = client.post("/credit/get_by_member_id/", headers=headers,
+                               json={**data, "to_date": (datetime.now() - timedelta(days=1)).isoformat()})
+        assert response.status_code == 404
+
+
+class TestFulfilment:
+    template = AccrualTemplate(header="H{airline_code}", row="{member_id}|{amount:>5}|{reference}",
+                               footer="T{count}|{total}", filename="{airline_code}.txt")
+
+    def add_pending(self, connection, count):
+        rows = [{"member_id": f"M{index}", "first_name": "You Xiang", "last_name": "Teo", "email": "ryzeros@gmail.com",
+                 "reference": generate_reference(), "airline_code": "FTEST", "partner_code": "DBS",
+                 "transaction_date": datetime.now(), "amount": 10 * (index + 1), "additional_info": {},
+                 "status": "In Progress"} for index in range(count)]
+        connection.execute(insert(CreditModel), rows)
+        return rows
+
+    def test_render(self):
+        template = AccrualTemplate(row="{member_id:<4}{{x}}{amount!s:>3}")
+        assert template.render(*self.row(member_id="12", amount=5)) == "12  {x}  5\n"
+        with pytest.raises(ValueError):
+            AccrualTemplate(row="{points}")
+
+    def row(self, **values):
+        from jobs.fulfilment import FIELDS
+        row = [None] * len(FIELDS)
+        for name, value in values.items():
+            row[FIELDS[name]] = value
+        return row
+
+    def test_fulfil_program(self, tmp_path):
+        with engine.connect() as connection:
+            with connection.begin() as transaction:
+                rows = self.add_pending(connection, 7)
+                accrual_file = fulfil_program(connection, "FTEST", self.template, tmp_path, batch_size=3)
+                assert accrual_file.count == 7 and accrual_file.total == 280
+                lines = (tmp_path / "FTEST" / "FTEST.txt").read_text().splitlines()
+                assert lines[0] == "HFTEST" and lines[-1] == "T7|280"
+                assert lines[1:-1] == [f"{row['member_id']}|{row['amount']:>5}|{row['reference']}" for row in rows]
+                assert list(tmp_path.joinpath("FTEST").iterdir()) == [accrual_file.path]
+                statuses = connection.execute(select(CreditModel.status).where(CreditModel.airline_code == "FTEST"))
+                assert set(statuses.scalars()) == {"Submitted"}
+
+                assert fulfil_program(connection, "FTEST", self.template, tmp_path) is None
+                self.add_pending(connection, 1)
+                with pytest.raises(FileExistsError):
+                    fulfil_program(connection, "FTEST", self.template, tmp_path)
+                transaction.rollback()
+
+
+class TestHandback:
+    def add_credits(self, connection, count, status="Submitted"):
+        rows = [{"member_id": f"M{index}", "first_name": "You Xiang", "last_name": "Teo", "email": "ryzeros@gmail.com",
+                 "reference": generate_reference(), "airline_code": "HTEST", "partner_code": "DBS",
+                 "transaction_date": datetime.now(), "amount": 100, "additional_info": {}, "status": status}
+                for index in range(count)]
+        connection.execute(insert(CreditModel), rows)
+        return rows
+
+    def handback_line(self, row, outcome_code):
+        return f"{row['transaction_date']:%Y-%m-%d},{row['amount']},{row['reference']},{outcome_code}\n"
+
+    def test_chunks(self, tmp_path):
+        path = tmp_path / "handback.csv"
+        lines = [f"2024-01-01,{index},{uuid.uuid4()},0000\n".encode() for index in range(100)]
+        path.write_bytes(HEADER + b"\r\n" + b"".join(lines))
+        pieces = list(chunks(path, chunk_bytes=500))
+        assert len(pieces) > 1
+        assert all(piece.endswith(b"\n") for piece in pieces)
+        assert b"".join(pieces) == b"".join(lines)
+        (tmp_path / "empty.csv").write_bytes(b"")
+        assert list(chunks(tmp_path / "empty.csv")) == []
+
+    def test_apply_chunk(self):
+        with engine.connect() as connection:
+            with connection.begin() as transaction:
+                approved, rejected, settled = self.add_credits(connection, 3)
+                connection.execute(text("UPDATE credit SET status = 'Rejected' WHERE reference = :reference"),
+                                   {"reference": settled["reference"]})
+                chunk = (self.handback_line(approved, "0000") + self.handback_line(rejected, "0001")
+                         + self.handback_line(settled, "0000") + f"2024-01-01,5,{uuid.uuid4()},0000\n").encode()
+                assert apply_chunk(connection, "HTEST", chunk) == (4, 2)
+                assert apply_chunk(connection, "OTHER", chunk)[1] == 0
+                statuses = {str(reference): status for reference, status in connection.execute(
+                    select(CreditModel.reference, CreditModel.status).where(CreditModel.airline_code == "HTEST"))}
+                assert statuses[approved["reference"]] == "Approved"
+                assert statuses[rejected["reference"]] == "Rejected"
+                assert statuses[settled["reference"]] == "Rejected"
+                outcome = connection.execute(select(CreditModel.outcome_code)
+                                             .where(CreditModel.reference == rejected["reference"])).scalar()
+                assert outcome == "0001"
+                transaction.rollback()
+
+    def test_ingest(self, tmp_path):
+        with engine.begin() as connection:
+            rows = self.add_credits(connection, 50)
+        try:
+            path = tmp_path / "handback.csv"
+            path.write_text("".join(self.handback_line(row, "0000") for row in rows))
+            result = ingest(engine, "HTEST", path, chunk_bytes=1000)
+            assert (result.rows, result.updated, result.skipped) == (50, 50, 0)
+            assert result.rows_per_second > 0
+            assert ingest(engine, "HTEST", path).updated == 0
+        finally:
+            with engine.begin() as connection:
+                connection.execute(delete(CreditModel).where(CreditModel.airline_code == "HTEST"))
+
+
+class TestSubscribe:
+    def set_status_later(self, reference, *statuses, delay=0.3):
+        def run():
+            for status in statuses:
+                time.sleep(delay)
+                with engine.begin() as connection:
+                    connection.execute(text("UPDATE credit SET status = :status WHERE reference = :reference"),
+                                       {"status": status, "reference": reference})
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread
+
+    def add_credit(self, client_, headers):
+        return add_data(client_, headers).json()["reference"]
+
+    def test_status_events(self, client_with_cleanup):
+        reference = self.add_credit(*client_with_cleanup)
+        events = StatusEvents()
+        channel = PostgresChannel(engine, poll_interval=0.1)
+        events.start(channel)
+        try:
+            assert channel.listening.wait(5)
+
+            async def wait():
+                with events.subscribe(reference) as subscription:
+                    self.set_status_later(reference, "Submitted")
+                    return await subscription.get(5), await subscription.get(0.1)
+            event, nothing = asyncio.run(wait())
+            assert event == {"reference": reference, "status": "Submitted", "outcome_code": None}
+            assert nothing is None
+            assert events.subscribers == 0
+        finally:
+            events.stop()
+
+    def test_long_poll(self, client_with_cleanup):
+        with TestClient(app) as client_:
+            _, headers = client_with_cleanup
+            assert status_events.channel.listening.wait(5)
+            reference = self.add_credit(client_, headers)
+            response = client_.post("/credit/subscribe/", headers=headers, json={"reference": reference})
+            assert response.json()["status"] == "In Progress"
+            response = client_.post("/credit/subscribe/", headers=headers,
+                                    json={"reference": reference, "status": "In Progress", "timeout": 0.2})
+            assert response.json()["status"] == "In Progress"
+
+            thread = self.set_status_later(reference, "Approved")
+            response = client_.post("/credit/subscribe/", headers=headers,
+                                    json={"reference": reference, "status": "In Progress", "timeout": 10})
+            thread.join()
+            assert response.status_code == 200
+            assert response.json()["status"] == "Approved"
+            assert status_events.subscribers == 0
+
+    def test_long_poll_any_reference_form(self, client_with_cleanup):
+        with TestClient(app) as client_:
+            _, headers = client_with_cleanup
+            assert status_events.channel.listening.wait(5)
+            reference = self.add_credit(client_, headers)
+            thread = self.set_status_later(reference, "Approved")
+            response = client_.post("/credit/subscribe/", headers=headers,
+                                    json={"reference": "{" + reference.upper() + "}", "status": "In Progress",
+                                          "timeout": 10})
+            thread.join()
+            assert response.json()["status"] == "Approved"
+
+    def test_event_stream(self, client_with_cleanup):
+        with TestClient(app) as client_:
+            _, headers = client_with_cleanup
+            assert status_events.channel.listening.wait(5)
+            reference = self.add_credit(client_, headers)
+            thread = self.set_status_later(reference, "Submitted", "Rejected")
+            with client_.stream("POST", "/credit/subscribe/", json={"reference": reference, "timeout": 10},
+                                headers={**headers, "Accept": "text/event-stream"}) as response:
+                assert response.headers["content-type"].startswith("text/event-stream")
+                events = [json.loads(line[len("data: "):]) for line in response.iter_lines()
+                          if line.startswith("data: ")]
+            thread.join()
+            assert [event["status"] for event in events] == ["In Progress", "Submitted", "Rejected"]
+
+    def test_unknown_reference(self, client_with_cleanup):
+        client_, headers = client_with_cleanup
+        response = client_.post("/credit/subscribe/", headers=headers, json={"reference": str(uuid.uuid4())})
+        assert response.status_code == 404
+        assert status_events.subscribers == 0
+        response = client_.post("/credit/subscribe/", headers=headers, json={"reference": "not-a-reference"})
+        assert response.status_code == 404
+        assert response.json()["detail"] == {"reference": "not-a-reference"}
+
+
+class TestCreditCache:
+    def item(self, status="In Progress"):
+        return CreditReferenceBoolean(reference=status, boolean=True)
+
+    def test_lru(self):
+        cache = CreditCache(size=2)
+        for reference in ("a", "b"):
+            cache.put((reference, "DBS"), self.item(), cache.version)
+        assert cache.get(("a", "DBS")) is not None
+        cache.put(("c", "DBS"), self.item(), cache.version)
+        assert cache.get(("b", "DBS")) is None
+        assert cache.get(("a", "DBS")) is not None and cache.get(("c", "DBS")) is not None
+        assert cache.get(("a", "OTHER")) is None
+        assert len(cache) == 2
+
+    def test_invalidate(self):
+        cache = CreditCache()
+        cache.put(("a", "DBS"), self.item(), cache.version)
+        cache.put(("b", "DBS"), self.item(), cache.version)
+        version = cache.version
+        cache.invalidate("a")
+        assert cache.get(("a", "DBS")) is None and cache.get(("b", "DBS")) is not None
+        # read before the invalidation, so possibly stale
+        cache.put(("a", "DBS"), self.item(), version)
+        assert cache.get(("a", "DBS")) is None
+        cache.invalidate()
+        assert len(cache) == 0
+
+    def test_ttl_and_enabled(self):
+        enabled = [True]
+        cache = CreditCache(ttl=0, enabled=lambda: enabled[0])
+        cache.put(("a", "DBS"), self.item(), cache.version)
+        assert cache.get(("a", "DBS")) is None
+        cache.ttl = 60
+        enabled[0] = False
+        cache.put(("b", "DBS"), self.item(), cache.version)
+        enabled[0] = True
+        assert cache.get(("b", "DBS")) is None
+
+    def test_helpers(self):
+        reference = str(uuid.uuid4())
+        assert canonical_reference(reference.upper().replace("-", "")) == reference
+        assert canonical_reference("b47bfecb-32b1-46ea-da-27edc30f8af1") is None
+        assert etag_matches('W/"abc", "def"', '"def"') and etag_matches("*", '"x"')
+        assert not etag_matches(None, '"x"') and not etag_matches('"abc"', '"def"')
+
+    def test_conditional_get(self, client_with_cleanup):
+        with TestClient(app) as client_:
+            _, headers = client_with_cleanup
+            assert status_events.channel.listening.wait(5)
+            reference = add_data(client_, headers).json()["reference"]
+            response = client_.get(f"/credit/get_by_reference/{reference}", headers=headers)
+            assert response.status_code == 200 and response.json()["reference"] == reference
+            tag = response.headers["etag"]
+
+            hits = credit_cache.hits
+            response = client_.get(f"/credit/get_by_reference/{reference}", headers={**headers, "If-None-Match": tag})
+            assert response.status_code == 304 and response.content == b""
+            assert credit_cache.hits == hits + 1
+
+            with engine.begin() as connection:
+                connection.execute(text("UPDATE credit SET status = 'Submitted' WHERE reference = :reference"),
+                                   {"reference": reference})
+            for _ in range(50):
+                response = client_.get(f"/credit/get_by_reference/{reference}",
+                                       headers={**headers, "If-None-Match": tag})
+                if response.status_code == 200:
+                    break
+                time.sleep(0.1)
+            assert response.json()["status"] == "Submitted" and response.headers["etag"] != tag
+
+            response = client_.post("/credit/get_by_reference/", json={"reference": reference}, headers=headers)
+            assert response.headers["etag"] == client_.get(f"/credit/get_by_reference/{reference}",
+                                                           headers=headers).headers["etag"]
+            assert client_.get("/credit/get_by_reference/not-a-reference", headers=headers).status_code == 404
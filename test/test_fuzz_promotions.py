@@ -1,4 +1,6 @@
 from utils.promotion_misc import eval_points_conditions, validate_promotions, calculate_points
+from utils.promotion_compiler import compile_points_rule, CompiledPromotion, PromotionCandidates, select_best_promotion
+from models.promotions import PromotionModel
 
 from hypothesis import given, strategies as st
 import pytest
@@ -29,6 +31,82 @@ def test_validate_promotions():
     inner_test()
 
 
+def test_compiled_points_rule_matches_linear_scan():
+    bound = st.integers(min_value=-50, max_value=50).map(lambda value: value * 10)
+    operator = st.sampled_from(["<", "<=", ">", ">="])
+    condition = st.one_of(
+        st.builds(lambda op, value: f"x {op} {value}", st.sampled_from(["<", "<=", ">", ">=", "==", "!="]), bound),
+        st.builds(lambda low, op_1, op_2, high: f"{low} {op_1} x {op_2} {high}", bound, operator, operator, bound)
+    )
+
+    @given(
+        conditions=st.lists(condition, max_size=8),
+        x=st.integers(min_value=-600, max_value=600)
+    )
+    def inner_test(conditions, x):
+        rule = compile_points_rule({"point_condition": [[condition, str(index)] for index, condition in enumerate(conditions)]})
+        expected = [index for index, condition in enumerate(conditions) if eval_points_conditions(condition, x)]
+        assert [int(formula(x)) for formula in rule.matching(x)] == expected
+
+    inner_test()
+
+
+def test_candidate_index_matches_validate_promotions():
+    keys = st.sampled_from(["card", "spend", "tier"])
+    rules = st.dictionaries(
+        keys=keys,
+        values=st.fixed_dictionaries({
+            'op': st.sampled_from(['eq', 'gt', 'gte', 'lt', 'lte', 'in']),
+            'value': st.one_of(st.integers(-3, 3), st.lists(st.integers(-3, 3), min_size=1, max_size=3))
+        })
+    )
+    data_values = st.one_of(st.integers(-3, 3), st.lists(st.integers(-3, 3), max_size=2))
+
+    @given(
+        rules=st.lists(rules, max_size=6),
+        data=st.dictionaries(keys=st.one_of(keys, st.just("other")), values=data_values)
+    )
+    def inner_test(rules, data):
+        promotions = [CompiledPromotion(PromotionModel(id=index, points_rule={"point_condition": []}, conditions=rule))
+                      for index, rule in enumerate(rules)]
+        expected = []
+        for promotion, rule in zip(promotions, rules):
+            try:
+                if validate_promotions(rule, data):
+                    expected.append(promotion.id)
+            except TypeError:
+                continue
+            assert promotion.matches(data) == (promotion.id in expected)
+        candidates = PromotionCandidates(promotions).for_info(data)
+        assert [promotion.id for promotion in candidates] == sorted(promotion.id for promotion in candidates)
+        assert expected == [promotion.id for promotion in candidates if promotion.id in expected]
+
+    inner_test()
+
+
+def test_branch_and_bound_matches_sequential_selection():
+    threshold = st.sampled_from([0, 100, 500, 900, 1000])
+    formula = st.sampled_from(["x", "x + 500", "x * 1.5", "(x - 900) * 1.5 + 500", "2000", "x / 2 + 300", "x ^ 2 / 1000"])
+    tiers = st.builds(lambda low, first, second: [[f"x < {low}", first], [f"x >= {low}", second]], threshold, formula, formula)
+    overlapping = st.lists(st.tuples(st.builds(lambda low: f"x > {low}", threshold), formula).map(list), max_size=3)
+    promotion = st.tuples(st.one_of(tiers, overlapping), st.sampled_from([{}, {"card": {"op": "eq", "value": "black"}},
+                                                                          {"card": {"op": "in", "value": ["gold", "black"]}}]))
+
+    @given(
+        promotions=st.lists(promotion, max_size=8),
+        amount=st.integers(min_value=-100, max_value=5000),
+        info=st.sampled_from([{}, {"card": "black"}, {"card": "gold"}, {"other": 1}])
+    )
+    def inner_test(promotions, amount, info):
+        promotions = [CompiledPromotion(PromotionModel(id=index + 1, points_rule={"point_condition": rule},
+                                                       conditions=conditions))
+                      for index, (rule, conditions) in enumerate(promotions)]
+        assert PromotionCandidates(promotions).select_best(amount, info) == \
+            select_best_promotion(promotions, amount, info)
+
+    inner_test()
+
+
 if __name__ == "__main__":
     pytest.main()
 
@@ -1,12 +1,12 @@
 import pytest
 from main import app
 from datetime import timedelta
-from config.database import get_db
+from config.database import get_db, AsyncSessionLocal
 from models.loyalty import LoyaltyModel
 from fastapi.testclient import TestClient
 from schemas.loyalty import LoyaltyValidate, LoyaltyItem
 from utils.credentials_misc import create_access_token
-from services.loyalty import LoyaltyService, LoyaltyCRUD
+from services.loyalty import LoyaltyService, LoyaltyCRUD, AsyncLoyaltyService, AsyncLoyaltyCRUD
 
 
 client = TestClient(app)
@@ -146,3 +146,14 @@ class TestGetLoyalty:
         items = LoyaltyCRUD(db).get_all()
         assert isinstance(items, list)
         assert isinstance(items[0], LoyaltyModel)
+
+    @pytest.mark.asyncio
+    async def test_async_loyalty_service_get(self):
+        async with AsyncSessionLocal() as db:
+            items = await AsyncLoyaltyService(db).get_all()
+            assert items.success
+            assert isinstance(items.value[0], LoyaltyModel)
+            crud_items = await AsyncLoyaltyCRUD(db).get_all()
+        assert [item.program_id for item in crud_items] == [item.program_id for item in items.value]
+        # still readable once the session is closed, as they are while a response is built
+        assert crud_items[0].program_name
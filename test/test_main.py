@@ -1,5 +1,16 @@
+import pytest
+import subprocess
+import sys
+from datetime import timedelta
 from fastapi.testclient import TestClient
-from main import app
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from main import app, warm_caches
+from config.database import SQLALCHEMY_DATABASE_URL
+from services.promotions import active_promotions
+from utils.credentials_misc import create_access_token
+from utils.pool_stats import PoolStats, InstrumentedQueuePool
+from utils.validators import loyalty_patterns
 
 client = TestClient(app)
 
@@ -12,3 +23,60 @@ def test_main():
     }
 
 
+class TestStartup:
+    def test_import_has_no_side_effects(self):
+        # a fresh interpreter, as this one has long since created the engines
+        check = ("import sys, main; from config import database; "
+                 "assert database.engine is None and database.async_engine is None; "
+                 "assert not {'sympy', 'psycopg2', 'asyncpg'} & set(sys.modules), sorted(sys.modules)")
+        subprocess.run([sys.executable, "-c", check], check=True)
+
+    def test_warm_caches(self):
+        active_promotions.invalidate()
+        loyalty_patterns.invalidate()
+        warm_caches()
+        assert active_promotions._loaded_at is not None
+        assert "GJP" in loyalty_patterns._patterns
+
+    def test_warm_caches_survives_a_failing_cache(self, monkeypatch):
+        def fail(db):
+            raise ValueError("Invalid points rule")
+        monkeypatch.setattr(active_promotions, "warm", fail)
+        loyalty_patterns.invalidate()
+        warm_caches()
+        assert "GJP" in loyalty_patterns._patterns
+
+
+class TestPoolStats:
+    def test_checkouts_and_timeouts(self):
+        engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=InstrumentedQueuePool, pool_size=1,
+                               max_overflow=0, pool_timeout=0.1)
+        stats = PoolStats("test", engine)
+        try:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+                with pytest.raises(PoolTimeoutError):
+                    engine.connect()
+                snapshot = stats.snapshot()
+                assert (snapshot["in_use"], snapshot["idle"], snapshot["timeouts"]) == (1, 0, 1)
+            snapshot = stats.snapshot()
+            assert (snapshot["in_use"], snapshot["idle"], snapshot["connects"], snapshot["checkouts"]) == (0, 1, 1, 1)
+            assert sum(bucket["count"] for bucket in snapshot["wait_histogram"]) == 1
+
+            # the pool engine.dispose() puts in place still reports to the same stats
+            engine.dispose()
+            with engine.connect():
+                pass
+            snapshot = stats.snapshot()
+            assert (snapshot["closes"], snapshot["connects"], snapshot["checkouts"]) == (1, 2, 2)
+        finally:
+            engine.dispose()
+
+    def test_admin_pool(self):
+        assert client.get("/admin/pool/").status_code == 401
+        token = create_access_token({"email": "ryzeros@gmail.com"}, timedelta(minutes=5))
+        response = client.get("/admin/pool/", headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 200
+        pools = {stats["name"]: stats for stats in response.json()}
+        assert {"api", "sync"} <= set(pools)
+        assert pools["api"]["checkouts"] >= 1
@@ -0,0 +1,50 @@
+from sqlalchemy import create_engine, inspect, text
+from config.database import engine, SQLALCHEMY_DATABASE_URL
+from migrations import discover, applied_versions, upgrade, sequential_scans, hot_queries
+
+FRESH_DATABASE = "migrations_fresh_test"
+
+
+class TestMigrations:
+    def test_discover_in_order(self):
+        versions = [migration.version for migration in discover()]
+        assert versions == sorted(versions)
+        assert versions[:2] == ["m0001_baseline", "m0002_hot_query_indexes"]
+        assert not discover()[1].transactional
+
+    def test_all_applied(self):
+        with engine.connect() as connection:
+            assert {migration.version for migration in discover()} <= applied_versions(connection)
+
+    def test_upgrade_when_up_to_date(self):
+        assert upgrade(engine, report=lambda message: None) == []
+
+    def test_upgrade_fresh_database(self):
+        admin = engine.execution_options(isolation_level="AUTOCOMMIT")
+        with admin.connect() as connection:
+            connection.execute(text(f"DROP DATABASE IF EXISTS {FRESH_DATABASE}"))
+            connection.execute(text(f"CREATE DATABASE {FRESH_DATABASE}"))
+        fresh = create_engine(f"{SQLALCHEMY_DATABASE_URL}/{FRESH_DATABASE}")
+        try:
+            assert upgrade(fresh, report=lambda message: None) == [migration.version for migration in discover()]
+            with fresh.connect() as connection:
+                assert connection.execute(text("SELECT relkind FROM pg_class WHERE relname = 'credit'")).scalar() == "p"
+                columns = {column["name"] for column in inspect(connection).get_columns("credit")}
+                assert "outcome_code" in columns and "idempotency_key" not in columns
+                assert inspect(connection).get_pk_constraint("credit_reference")["constrained_columns"] == ["reference"]
+                assert {index["name"] for index in inspect(connection).get_indexes("notification_outbox")} == \
+                    {"ix_notification_outbox_due", "ix_notification_outbox_reference"}
+        finally:
+            fresh.dispose()
+            with admin.connect() as connection:
+                connection.execute(text(f"DROP DATABASE IF EXISTS {FRESH_DATABASE}"))
+
+
+class TestPlanCheck:
+    def test_hot_queries_use_indexes(self):
+        with engine.connect() as connection:
+            assert sequential_scans(connection) == []
+
+    def test_hot_queries_compile(self):
+        for name, statement in hot_queries().items():
+            assert "WHERE" in str(statement), name
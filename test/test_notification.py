@@ -0,0 +1,218 @@
+import asyncio
+import json
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from main import app
+from datetime import datetime, timedelta
+from fastapi.testclient import TestClient
+from sqlalchemy import delete, insert, select, update
+from config.database import engine
+from jobs.handback import apply_chunk
+from jobs.notifications import Dispatcher
+from models.credit import CreditModel
+from models.notification import NotificationTargetModel, NotificationOutboxModel
+from utils.credentials_misc import create_access_token
+from utils.misc import generate_reference
+
+client = TestClient(app)
+DESCRIPTION = "test notification target"
+
+
+class StandIn(object):
+    """
+    Local HTTP server standing in for a bank's notification endpoint. The first `failures` requests to
+    /flaky get a 503; /gone always answers 410.
+    """
+
+    def __init__(self, failures: int = 0):
+        self.received = []
+        self.failures = failures
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                status = 200
+                if self.path == "/gone":
+                    status = 410
+                elif self.path == "/flaky" and stand_in.failures > 0:
+                    stand_in.failures -= 1
+                    status = 503
+                else:
+                    stand_in.received.append((self.headers["X-Notification-Id"], body))
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}{path}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture(scope="module")
+def client_with_cleanup():
+    headers = startup()
+    yield client, headers
+    cleanup(headers)
+
+
+def startup():
+    data = {"email": "admin@dbs.com"}
+    token = create_access_token(data, timedelta(minutes=5))
+    return {"Authorization": f"Bearer {token}"}
+
+
+def cleanup(headers=None):
+    with engine.begin() as connection:
+        targets = select(NotificationTargetModel.id).where(NotificationTargetModel.description == DESCRIPTION)
+        connection.execute(delete(NotificationOutboxModel).where(NotificationOutboxModel.target_id.in_(targets)))
+        connection.execute(delete(NotificationTargetModel).where(NotificationTargetModel.description == DESCRIPTION))
+    if headers is not None:
+        client.post("/credit/delete_by_email/", json={"email": "notify@example.com"}, headers=headers)
+
+
+def add_target(connection, url: str, partner_code: str = "DBS") -> int:
+    return connection.execute(insert(NotificationTargetModel).values(partner_code=partner_code, url=url,
+                                                                     description=DESCRIPTION, active=True)
+                              .returning(NotificationTargetModel.id)).scalar()
+
+
+def queue(connection, target_id: int, count: int) -> list[int]:
+    rows = [{"target_id": target_id, "reference": generate_reference(), "payload": {"index": index}}
+            for index in range(count)]
+    return list(connection.execute(insert(NotificationOutboxModel).returning(NotificationOutboxModel.id),
+                                   rows).scalars())
+
+
+def outbox(ids: list[int]) -> dict[int, NotificationOutboxModel]:
+    with engine.connect() as connection:
+        rows = connection.execute(select(NotificationOutboxModel).where(NotificationOutboxModel.id.in_(ids)))
+        return {row.id: row for row in rows}
+
+
+def dispatch(**options) -> int:
+    async def run():
+        dispatcher = Dispatcher(engine, **options)
+        try:
+            return await dispatcher.drain()
+        finally:
+            await dispatcher.aclose()
+    return asyncio.run(run())
+
+
+class TestTargets:
+    def test_register(self, client_with_cleanup):
+        client_, headers = client_with_cleanup
+        response = client_.post("/notification/register/", headers=headers,
+                                json={"url": "https://bank.example.com/hooks/credit", "description": DESCRIPTION})
+        assert response.status_code == 200
+        target = response.json()
+        assert target["url"] == "https://bank.example.com/hooks/credit" and target["active"]
+        response = client_.get("/notification/targets/", headers=headers)
+        assert target in response.json()
+
+    def test_register_invalid_url(self, client_with_cleanup):
+        client_, headers = client_with_cleanup
+        response = client_.post("/notification/register/", headers=headers, json={"url": "not a url"})
+        assert response.status_code == 422
+
+
+class TestOutbox:
+    def test_handback_queues_notifications(self):
+        with engine.connect() as connection:
+            with connection.begin() as transaction:
+                target_id = add_target(connection, "http://127.0.0.1:9/hook")
+                reference = generate_reference()
+                connection.execute(insert(CreditModel).values(
+                    member_id="1234567890", first_name="You Xiang", last_name="Teo", email="notify@example.com",
+                    reference=reference, airline_code="NTEST", partner_code="DBS", transaction_date=datetime.now(),
+                    amount=100, additional_info={}, status="Submitted"))
+                apply_chunk(connection, "NTEST", f"{datetime.now():%Y-%m-%d},100,{reference},0001\n".encode())
+                payloads = connection.execute(select(NotificationOutboxModel.payload)
+                                              .where(NotificationOutboxModel.target_id == target_id)).scalars().all()
+                assert len(payloads) == 1
+                assert payloads[0]["reference"] == reference
+                assert (payloads[0]["status"], payloads[0]["outcome_code"]) == ("Rejected", "0001")
+                transaction.rollback()
+
+    def test_resend(self, client_with_cleanup):
+        client_, headers = client_with_cleanup
+        with engine.begin() as connection:
+            add_target(connection, "http://127.0.0.1:9/hook")
+        credit = client_.post("/credit/add/", headers=headers, json={
+            "member_id": "1234567890", "amount": 100, "first_name": "You Xiang", "last_name": "Teo",
+            "airline_code": "GJP", "email": "notify@example.com", "additional_info": {}}).json()
+        data = {"reference": credit["reference"]}
+        assert client_.post("/notification/get_by_reference/", headers=headers, json=data).status_code == 404
+        response = client_.post("/notification/resend/", headers=headers, json=data)
+        assert response.status_code == 200
+        assert response.json()["queued"] >= 1
+        items = client_.post("/notification/get_by_reference/", headers=headers, json=data).json()
+        assert {item["payload"]["status"] for item in items} == {"In Progress"}
+        assert all(item["sent_at"] is None for item in items)
+
+    def test_resend_unknown_reference(self, client_with_cleanup):
+        client_, headers = client_with_cleanup
+        response = client_.post("/notification/resend/", headers=headers, json={"reference": generate_reference()})
+        assert response.status_code == 404
+
+
+class TestDispatcher:
+    def setup_method(self):
+        cleanup()
+
+    def teardown_method(self):
+        cleanup()
+
+    def test_delivers_batches(self):
+        with StandIn() as stand_in:
+            with engine.begin() as connection:
+                ids = queue(connection, add_target(connection, stand_in.url("/hook")), 25)
+            assert dispatch(batch_size=10, concurrency=4) == 25
+        assert sorted(int(notification_id) for notification_id, _ in stand_in.received) == ids
+        assert all(row.sent_at is not None and row.attempts == 1 for row in outbox(ids).values())
+
+    def test_retries_with_backoff(self):
+        with StandIn(failures=2) as stand_in:
+            with engine.begin() as connection:
+                ids = queue(connection, add_target(connection, stand_in.url("/flaky")), 3)
+            dispatch(concurrency=1, backoff=60)
+            rows = outbox(ids)
+            assert sum(row.sent_at is None for row in rows.values()) == 2
+            pending = [row for row in rows.values() if row.sent_at is None]
+            assert all(row.last_error == "HTTP 503" and row.next_attempt_at > datetime.now() for row in pending)
+
+            with engine.begin() as connection:
+                connection.execute(update(NotificationOutboxModel).where(NotificationOutboxModel.id.in_(ids))
+                                   .values(next_attempt_at=datetime(2000, 1, 1)))
+            assert dispatch() == 2
+        rows = outbox(ids)
+        assert all(row.sent_at is not None and row.last_error is None for row in rows.values())
+        assert sorted(row.attempts for row in rows.values()) == [1, 2, 2]
+
+    def test_gives_up(self):
+        with StandIn() as stand_in:
+            with engine.begin() as connection:
+                target_id = add_target(connection, stand_in.url("/gone"))
+                gone = queue(connection, target_id, 1)[0]
+                unreachable = queue(connection, add_target(connection, "http://127.0.0.1:9/hook"), 1)[0]
+            dispatch(max_attempts=1, timeout=1)
+        rows = outbox([gone, unreachable])
+        assert rows[gone].failed_at is not None and rows[gone].last_error == "HTTP 410"
+        assert rows[unreachable].failed_at is not None and rows[unreachable].last_error.startswith("ConnectError")
@@ -1,15 +1,22 @@
+import asyncio
 import datetime
+import math
 
 from main import app
 import pytest
 from fastapi.testclient import TestClient
-from config.database import get_db
+from config.database import get_db, AsyncSessionLocal
 from models.promotions import PromotionModel
 from datetime import timedelta
-from schemas.promotions import PromotionBase
-from services.promotions import PromotionCRUD, PromotionService
+from schemas.promotions import PromotionBase, PromotionQuoteItem
+from services.promotions import PromotionCRUD, PromotionService, AsyncPromotionCRUD, active_promotions
+from utils.app_exceptions import AppException
 from utils.credentials_misc import create_access_token
-from utils.promotion_misc import eval_points_conditions
+from utils.promotion_misc import eval_points_conditions, calculate_points
+from utils.promotion_compiler import compile_formula, compile_points_rule, get_points_rule, formula_upper_bound
+from utils.promotion_index import ActivePromotionIndex
+from utils.promotion_compiler import CompiledPromotion, PromotionCandidates, select_best_promotion
+from utils.promotion_quote import quote_best_promotions
 
 client = TestClient(app)
 
@@ -178,6 +185,51 @@ class TestAddPromotions:
         assert response_data["airline_code"] == "GJP"
         assert response_data["partner_code"] == "TEST"
 
+    def test_add_promotion_invalid_points_rule(self, client_with_cleanup):
+        token_data = {
+            "email": "ryzeros@gmail.com"
+        }
+        data = {
+            "name": "1.5 times more exchange rate",
+            "description": "Get 1.5 times more miles when you spend more than $1000 on a card in a year.",
+            "airline_code": "GJP",
+            "partner_code": "TEST",
+            "expiry": (datetime.datetime.now() + timedelta(days=30)).isoformat(),
+            "points_rule": {"point_condition": [["x > 1500", "__import__('os')"]]},
+            "conditions": {"TUG Max": {"op": "gt", "value": "1000"}},
+            "start_date_for_card": datetime.datetime(2024, 1, 1, 0, 0, 0).isoformat(),
+            "end_date_for_card": datetime.datetime(2024, 12, 31, 23, 59, 59).isoformat()
+        }
+        token = create_access_token(token_data, timedelta(minutes=5))
+        headers = {
+            "Authorization": f"Bearer {token}"
+        }
+        response = client.post("/promotions/add", json=data, headers=headers)
+        assert response.status_code == 400
+        assert response.json()["detail"]["message"] == "Points rule invalid"
+
+    def test_promotion_service_add_item_invalid_conditions(self):
+        item = PromotionBase(
+            name="1.5 times more exchange rate",
+            description="Get 1.5 times more miles when you spend more than $1000 on a card in a year.",
+            airline_code="GJP",
+            partner_code="TEST",
+            expiry=(datetime.datetime.now() + timedelta(days=30)).isoformat(),
+            points_rule={"point_condition": [["x > 1500", "x * 1.5"]]},
+            conditions={"TUG Max": {"op": "approximately", "value": "1000"}},
+            start_date_for_card=datetime.datetime(2024, 1, 1, 0, 0, 0).isoformat(),
+            end_date_for_card=datetime.datetime(2024, 12, 31, 23, 59, 59).isoformat()
+        )
+        db = next(get_db())
+        resp = PromotionService(db).add_item(item)
+        assert resp.status_code == 400
+        assert resp.value.context == {"message": "Conditions invalid"}
+
+        item.conditions = {"TUG Max": {"op": "gt"}}
+        resp = PromotionCRUD(db).add_items(item)
+        assert isinstance(resp, AppException.AddItem)
+        assert resp.context == {"message": "Conditions invalid"}
+
     def test_promotion_service_add_item(self):
         item = PromotionBase(
             name="1.5 times more exchange rate",
@@ -227,6 +279,201 @@ class TestGetAirlinePartnerPromotions:
         item = PromotionCRUD(db).get_airline_partner_promotions("NOT EXIST", "DBS")
         assert item is None
 
+    def test_get_active_promotions(self):
+        db = next(get_db())
+        items = PromotionCRUD(db).get_active_promotions()
+        assert [item.id for item in items] == sorted(item.id for item in items)
+        assert all(item.expiry > datetime.datetime.now() for item in items)
+
+
+class TestActivePromotionIndex:
+    @staticmethod
+    def make_promotion(promotion_id, airline_code="GJP", partner_code="DBS", expiry=None):
+        return PromotionModel(id=promotion_id, airline_code=airline_code, partner_code=partner_code,
+                              expiry=expiry or datetime.datetime.now() + timedelta(days=1),
+                              points_rule={"point_condition": [["x > 0", "x * 2"]]}, conditions={})
+
+    def test_loads_once_and_groups_by_airline_partner(self):
+        calls = []
+        promotions = [self.make_promotion(1), self.make_promotion(2, partner_code="OCBC"), self.make_promotion(3)]
+        index = ActivePromotionIndex(lambda db: calls.append(db) or promotions)
+
+        assert [item.id for item in index.get(None, "GJP", "DBS")] == [1, 3]
+        assert [item.id for item in index.get(None, "GJP", "OCBC")] == [2]
+        assert index.get(None, "NON", "DBS") == []
+        assert index.get_by_id(None, 2).partner_code == "OCBC"
+        assert len(calls) == 1
+
+        index.invalidate()
+        promotions.pop()
+        assert [item.id for item in index.get(None, "GJP", "DBS")] == [1]
+        assert len(calls) == 2
+
+    def test_drops_expired_promotions(self):
+        now = datetime.datetime.now()
+        promotions = [self.make_promotion(1, expiry=now + timedelta(minutes=1)),
+                      self.make_promotion(2, expiry=now + timedelta(minutes=2))]
+        index = ActivePromotionIndex(lambda db: promotions)
+
+        assert [item.id for item in index.get(None, "GJP", "DBS", now=now)] == [1, 2]
+        assert [item.id for item in index.get(None, "GJP", "DBS", now=now + timedelta(minutes=1))] == [2]
+        assert index.get_by_id(None, 1, now=now + timedelta(minutes=1)) is None
+        assert index.get(None, "GJP", "DBS", now=now + timedelta(minutes=3)) == []
+
+    def test_refreshes_after_interval(self):
+        calls = []
+        index = ActivePromotionIndex(lambda db: calls.append(db) or [], refresh_interval=0)
+        index.get(None, "GJP", "DBS")
+        index.get(None, "GJP", "DBS")
+        assert len(calls) == 2
+
+    def test_skips_promotion_that_does_not_compile(self):
+        broken = self.make_promotion(2)
+        broken.points_rule = {"point_condition": [["x > 0", "sqrt(x)"]]}
+        index = ActivePromotionIndex(lambda db: [self.make_promotion(1), broken, self.make_promotion(3)])
+        assert [item.id for item in index.get(None, "GJP", "DBS")] == [1, 3]
+        assert index.get_by_id(None, 2) is None
+
+    def test_invalidated_while_loading(self):
+        calls = []
+        index = ActivePromotionIndex(lambda db: calls.append(db) or index.invalidate() or [])
+        index.get(None, "GJP", "DBS")
+        index.get(None, "GJP", "DBS")
+        assert len(calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_concurrent_loads_on_one_event_loop(self):
+        # each load yields to the event loop inside run_sync; a lock held across it would hang the loop
+        active_promotions.invalidate()
+        items = [PromotionQuoteItem(amount=1000, airline_code="GJP")]
+        async with AsyncSessionLocal() as first, AsyncSessionLocal() as second:
+            quotes = await asyncio.gather(AsyncPromotionCRUD(first).quote(items, "DBS"),
+                                          AsyncPromotionCRUD(second).quote(items, "DBS"))
+        assert quotes[0] == quotes[1]
+
+    def test_add_promotion_invalidates_index(self):
+        db = next(get_db())
+        active_promotions.get(db, "GJP", "TEST")
+        item = PromotionBase(
+            name="1.5 times more exchange rate",
+            description="Get 1.5 times more miles when you spend more than $1000 on a card in a year.",
+            airline_code="GJP",
+            partner_code="TEST",
+            expiry=(datetime.datetime.now() + timedelta(days=30)).isoformat(),
+            points_rule={"point_condition": [["x > 1500", "x * 1.5"]]},
+            conditions={"TUG Max": {"op": "gt", "value": "1000"}},
+            start_date_for_card=datetime.datetime(2024, 1, 1, 0, 0, 0).isoformat(),
+            end_date_for_card=datetime.datetime(2024, 12, 31, 23, 59, 59).isoformat()
+        )
+        resp = PromotionCRUD(db).add_items(item)
+        assert resp.id in [item.id for item in active_promotions.get(db, "GJP", "TEST")]
+        cleanup()
+
+
+class TestPromotionCandidates:
+    @staticmethod
+    def make_promotion(promotion_id, conditions):
+        return CompiledPromotion(PromotionModel(id=promotion_id, points_rule={"point_condition": []},
+                                                conditions=conditions))
+
+    def test_for_info(self):
+        promotions = [
+            self.make_promotion(1, {"card": {"op": "eq", "value": "black"}, "spend": {"op": "gt", "value": 1000}}),
+            self.make_promotion(2, {"card": {"value": ["gold", "black"]}}),
+            self.make_promotion(3, {"tier": {"op": "gte", "value": 2}}),
+            self.make_promotion(4, {}),
+            self.make_promotion(5, {"card": {"op": "eq", "value": {"nested": True}}})
+        ]
+        candidates = PromotionCandidates(promotions)
+
+        assert candidates.for_info({}) == []
+        assert [item.id for item in candidates.for_info({"other": 1})] == [4]
+        assert [item.id for item in candidates.for_info({"card": "black"})] == [2, 4, 5]
+        assert [item.id for item in candidates.for_info({"card": "gold", "spend": 10})] == [2, 4, 5]
+        assert [item.id for item in candidates.for_info({"card": "black", "spend": 10, "tier": 1})] == [1, 2, 3, 4, 5]
+        assert [item.id for item in candidates.for_info({"card": ["black"]})] == [2, 4, 5]
+
+    def test_select_best(self):
+        promotions = [
+            self.make_promotion(1, {"card": {"op": "eq", "value": "black"}}),
+            self.make_promotion(2, {"card": {"op": "eq", "value": "gold"}}),
+            self.make_promotion(3, {})
+        ]
+        for promotion, rule in zip(promotions, [[["x < 900", "x + 500"], ["x >= 900", "x * 2"]],
+                                                [["x > 0", "x * 3"]],
+                                                [["x > 0", "x + 500"]]]):
+            promotion.point_conditions = compile_points_rule({"point_condition": rule})
+        candidates = PromotionCandidates(promotions)
+        assert candidates.bounded
+        assert candidates.select_best(100, {"card": "black"}) == (600, 1)
+        assert candidates.select_best(100, {"card": "gold"}) == (600, 3)
+        assert candidates.select_best(1000, {"card": "gold"}) == (3000, 2)
+        assert candidates.select_best(1000, {"card": "black"}) == (2000, 1)
+        assert candidates.select_best(0, {"card": "black"}) == (500, 1)
+        assert candidates.select_best(100, {}) == (100, 0)
+
+        promotions[2].point_conditions = compile_points_rule({"point_condition": [["x > 0", "x + 1"], ["x > 0", "x + 2"]]})
+        assert not PromotionCandidates(promotions).bounded
+        assert PromotionCandidates(promotions).select_best(100, {"card": "black"}) == (600, 1)
+
+    def test_matches(self):
+        promotion = self.make_promotion(1, {"card": {"op": "in", "value": ["gold", "black"]},
+                                            "spend": {"op": "in", "value": 5}})
+        assert promotion.condition_checks[0][3] == frozenset(["gold", "black"])
+        assert promotion.matches({"card": "gold", "spend": 5})
+        assert not promotion.matches({"card": ["gold"], "spend": 5})
+        assert not promotion.matches({"card": "gold", "spend": 6})
+
+        promotion = self.make_promotion(2, {"card": {"op": "unknown", "value": 1}})
+        assert promotion.condition_checks is None
+        assert not promotion.matches({"other": 1})
+        with pytest.raises(KeyError):
+            promotion.matches({"card": 1})
+
+
+class TestQuotePromotions:
+    def test_quote_valid(self, client_with_cleanup):
+        client_with_cleanup, header = client_with_cleanup
+        data = {
+            "items": [
+                {"amount": 100, "airline_code": "GJP",
+                 "additional_info": {"black_card_holder": "true", "monthly_spending": 2000}},
+                {"amount": 100, "airline_code": "GJP", "additional_info": {}},
+                {"amount": 100, "airline_code": "NON", "additional_info": {"black_card_holder": "true"}}
+            ]
+        }
+        resp = client.post(url="/promotions/quote", headers=header, json=data)
+        assert resp.status_code == 200
+        response_data = resp.json()
+        assert [item["points"] for item in response_data] == [700, 100, 100]
+        assert [item["promotion_id"] for item in response_data] == [8, None, None]
+
+    def test_quote_invalid(self, client_with_cleanup):
+        client_with_cleanup, header = client_with_cleanup
+        resp = client.post(url="/promotions/quote", headers=header, json={"items": []})
+        assert resp.status_code == 422
+        resp = client.post(url="/promotions/quote", json={"items": [{"amount": 1, "airline_code": "GJP"}]})
+        assert resp.status_code == 401
+
+    def test_quote_matches_select_best_promotion(self):
+        rules = [
+            [["x < 900", "x + 500"], ["x >= 900", "(x-900) * 1.5 + 500"]],
+            [["x > 100", "x * 2"], ["x > 0", "x * 3"], ["x == 50", "1000"]],
+            [["100 <= x <= 2000", "x + 700"], ["x != 1500", "x / 3"]],
+            [["x >= 0", "x - 1"]]
+        ]
+        conditions = [{}, {"card": {"op": "eq", "value": "black"}}, {"spend": {"op": "gt", "value": 10}}, {}]
+        promotions = [CompiledPromotion(PromotionModel(id=index + 1, points_rule={"point_condition": rule},
+                                                       conditions=conditions[index]))
+                      for index, rule in enumerate(rules)]
+        amounts = [-5, 0, 50, 99, 100, 101, 899, 900, 901, 1500, 2000, 2001, 10000]
+        infos = [{}, {"card": "black"}, {"spend": 20}, {"card": "black", "spend": 5}]
+        cases = [(amount, info) for amount in amounts for info in infos]
+
+        best, best_id = quote_best_promotions(promotions, [amount for amount, _ in cases], [info for _, info in cases])
+        assert list(zip(best.tolist(), best_id.tolist())) == \
+            [select_best_promotion(promotions, amount, info) for amount, info in cases]
+
 
 class TestPromotionsMisc:
     def test_eval_points_conditions(self):
@@ -263,3 +510,57 @@ class TestPromotionsMisc:
         assert eval_points_conditions("x >= 1000", 1000)
         assert not eval_points_conditions("x > 1000", 1000)
         assert not eval_points_conditions("x >= 1000", 999)
+
+        assert not eval_points_conditions("600 < x < 400", 500)
+        assert not eval_points_conditions("600 <= x < 600", 600)
+        assert eval_points_conditions("600 <= x <= 600", 600)
+        assert eval_points_conditions("-1.5 < x < 0", -1)
+
+    def test_compile_formula(self):
+        for formula in ["x + 600", "(1.5 * x) + 200", "1.5 * x", "(x-900) * 1.5 + 500", "x / 3", "-x + 2^10"]:
+            function = compile_formula(formula)
+            for x in [0, 1, 599, 900, 1000, 123456]:
+                assert int(function(x)) == calculate_points(x, formula)
+
+        for formula in ["", "x +", "y + 1", "abs(x)", "x.real", "x if x else 1", "True + x", "'1' * x", 1.5]:
+            with pytest.raises(ValueError):
+                compile_formula(formula)
+
+    def test_formula_upper_bound(self):
+        assert formula_upper_bound(compile_formula("x * 1.5 + 500"), 0, 1000) >= 2000
+        assert formula_upper_bound(compile_formula("x * 1.5 + 500"), 0, 1000) <= 2001
+        assert formula_upper_bound(compile_formula("1000 - x"), 100, 200) == 901
+        assert formula_upper_bound(compile_formula("-x * -x"), -10, 5) == 101
+        assert formula_upper_bound(compile_formula("x / 2"), 10, 20) == 11
+        assert formula_upper_bound(compile_formula("1 / x"), -1, 1) == math.inf
+        assert formula_upper_bound(compile_formula("x ^ 2"), 1, 10) == 101
+        assert formula_upper_bound(compile_formula("x ^ 0.5"), -1, 10) == math.inf
+        assert formula_upper_bound(compile_formula("10 ^ x"), 1, 10000) == math.inf
+
+    def test_compile_points_rule(self):
+        rule = compile_points_rule({"point_condition": [["x < 900", "x + 500"], ["x >= 900", "(x-900) * 1.5 + 500"]]})
+        assert [condition for condition, _, _ in rule.point_conditions] == ["x < 900", "x >= 900"]
+        assert [formula(1000) for formula in rule.matching(1000)] == [650]
+        assert [formula(900) for formula in rule.matching(900)] == [500]
+        assert [formula(899) for formula in rule.matching(899)] == [1399]
+
+        rule = compile_points_rule({"point_condition": [["x > 100", "x + 1"], ["x != 200", "x + 2"], ["x == 200", "x + 3"],
+                                                        ["600 >= x > 100", "x + 4"]]})
+        assert [formula(0) for formula in rule.matching(0)] == [2]
+        assert [formula(0) for formula in rule.matching(100)] == [2]
+        assert [formula(0) for formula in rule.matching(200)] == [1, 3, 4]
+        assert [formula(0) for formula in rule.matching(600)] == [1, 2, 4]
+        assert [formula(0) for formula in rule.matching(601)] == [1, 2]
+
+        for points_rule in [{}, {"point_condition": [["x > 1"]]}, {"point_condition": [["x > 1", "z"]]},
+                            {"point_condition": [["x ! 1", "x"]]}]:
+            with pytest.raises(ValueError):
+                compile_points_rule(points_rule)
+
+    def test_get_points_rule_recompiles_changed_rule(self):
+        promotion = PromotionModel(id=-1, points_rule={"point_condition": [["x > 0", "x + 1"]]})
+        assert get_points_rule(promotion).matching(1)[0](1) == 2
+        assert get_points_rule(promotion) is get_points_rule(promotion)
+
+        promotion.points_rule = {"point_condition": [["x > 0", "x + 2"]]}
+        assert get_points_rule(promotion).matching(1)[0](1) == 3
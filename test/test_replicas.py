@@ -0,0 +1,152 @@
+import pytest
+from datetime import datetime
+from sqlalchemy import delete, false, insert, text, update
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from config.database import async_engine, engine, USERNAME, PASSWORD, URL, PORT
+from models.credit import CreditModel
+from models.loyalty import LoyaltyModel
+from schemas.credit import CreditReference
+from services.credit import AsyncCreditCRUD, AsyncCreditService
+from services.loyalty import AsyncLoyaltyCRUD
+from utils.misc import generate_reference
+from utils.pool_stats import PoolStats, InstrumentedNullPool
+from utils.replicas import ReplicaSet, RoutingSession
+
+# a schema with an empty credit table, standing in for a replica that has not caught up yet
+LAGGING_SCHEMA = "replica_lag_test"
+
+
+def simulated_replica(address: str = f"{URL}:{PORT}", **server_settings):
+    """
+    An engine on the primary (or nowhere) standing in for a replica, with its checkouts counted
+    """
+    replica = create_async_engine(f"postgresql+asyncpg://{USERNAME}:{PASSWORD}@{address}",
+                                  poolclass=InstrumentedNullPool,
+                                  connect_args={"timeout": 1, "server_settings": server_settings})
+    return replica, PoolStats(address, replica.sync_engine)
+
+
+def session_factory(replicas: ReplicaSet):
+    return async_sessionmaker(async_engine, expire_on_commit=False, sync_session_class=RoutingSession,
+                              replicas=replicas)
+
+
+async def dispose(*engines):
+    for replica in engines:
+        await replica.dispose()
+
+
+class TestRouting:
+    @pytest.mark.asyncio
+    async def test_reads_go_to_replicas_in_turn(self):
+        (first, first_stats), (second, second_stats) = simulated_replica(), simulated_replica()
+        Session = session_factory(ReplicaSet([first, second]))
+        try:
+            for _ in range(4):
+                async with Session() as db:
+                    assert await AsyncLoyaltyCRUD(db).get_all()
+            assert (first_stats.checkouts, second_stats.checkouts) == (2, 2)
+        finally:
+            await dispose(first, second)
+
+    @pytest.mark.asyncio
+    async def test_writes_stay_on_primary(self):
+        replica, stats = simulated_replica()
+        Session = session_factory(ReplicaSet([replica]))
+        try:
+            async with Session() as db:
+                await db.execute(update(LoyaltyModel).where(false()).values(program_name="unchanged"))
+                assert await AsyncLoyaltyCRUD(db).get_all()
+            assert stats.checkouts == 0
+        finally:
+            await dispose(replica)
+
+    @pytest.mark.asyncio
+    async def test_unreachable_replica_passed_over(self):
+        unreachable, unreachable_stats = simulated_replica("127.0.0.1:9")
+        replica, stats = simulated_replica()
+        replicas = ReplicaSet([unreachable, replica])
+        Session = session_factory(replicas)
+        try:
+            for _ in range(2):
+                async with Session() as db:
+                    assert await AsyncLoyaltyCRUD(db).get_all()
+            assert not replicas.is_up(unreachable)
+            assert (unreachable_stats.connects, stats.checkouts) == (0, 2)
+        finally:
+            await dispose(unreachable, replica)
+
+    @pytest.mark.asyncio
+    async def test_no_replica_up(self):
+        unreachable, _ = simulated_replica("127.0.0.1:9")
+        Session = session_factory(ReplicaSet([unreachable]))
+        try:
+            async with Session() as db:
+                assert await AsyncLoyaltyCRUD(db).get_all()
+                assert db.sync_session.replica is None
+        finally:
+            await dispose(unreachable)
+
+    @pytest.mark.asyncio
+    async def test_health_check(self):
+        unreachable, _ = simulated_replica("127.0.0.1:9")
+        replica, _ = simulated_replica()
+        replicas = ReplicaSet([unreachable, replica])
+        try:
+            await replicas.check(timeout=2)
+            assert [replicas.is_up(engine) for engine in replicas.engines] == [False, True]
+            assert replicas.choose() is replica
+        finally:
+            await dispose(unreachable, replica)
+
+
+class TestLaggingReplica:
+    def setup_method(self):
+        self.reference = generate_reference()
+        with engine.begin() as connection:
+            connection.execute(text(f"CREATE SCHEMA IF NOT EXISTS {LAGGING_SCHEMA}"))
+            connection.execute(text(f"CREATE TABLE IF NOT EXISTS {LAGGING_SCHEMA}.credit (LIKE public.credit)"))
+            connection.execute(insert(CreditModel).values(
+                member_id="1234567890", first_name="You Xiang", last_name="Teo", email="replica@example.com",
+                reference=self.reference, airline_code="GJP", partner_code="DBS", transaction_date=datetime.now(),
+                amount=100, additional_info={}, status="In Progress"))
+
+    def teardown_method(self):
+        with engine.begin() as connection:
+            connection.execute(delete(CreditModel).where(CreditModel.email == "replica@example.com"))
+            connection.execute(text(f"DROP SCHEMA IF EXISTS {LAGGING_SCHEMA} CASCADE"))
+
+    @pytest.mark.asyncio
+    async def test_empty_result_rechecked_on_primary(self):
+        replica, stats = simulated_replica(search_path=f"{LAGGING_SCHEMA},public")
+        Session = session_factory(ReplicaSet([replica]))
+        item = CreditReference(reference=self.reference)
+        item.set_partner_code("DBS")
+        try:
+            async with Session() as db:
+                credit = await AsyncCreditCRUD(db).get_item_by_reference(item)
+            assert stats.checkouts == 1
+            assert str(credit.reference) == self.reference
+        finally:
+            await dispose(replica)
+
+    @pytest.mark.asyncio
+    async def test_primary_read_skips_lagging_replica(self):
+        with engine.begin() as connection:
+            connection.execute(text(f"INSERT INTO {LAGGING_SCHEMA}.credit SELECT * FROM public.credit "
+                                    "WHERE reference = :reference"), {"reference": self.reference})
+            connection.execute(update(CreditModel).where(CreditModel.reference == self.reference)
+                               .values(status="Approved"))
+        replica, stats = simulated_replica(search_path=f"{LAGGING_SCHEMA},public")
+        Session = session_factory(ReplicaSet([replica]))
+        item = CreditReference(reference=self.reference)
+        item.set_partner_code("DBS")
+        try:
+            async with Session() as db:
+                assert (await AsyncCreditCRUD(db).get_item_by_reference(item)).status == "In Progress"
+            async with Session() as db:
+                result = await AsyncCreditService(db).get_item_by_reference(item, primary=True)
+            assert result.value.status == "Approved"
+            assert stats.checkouts == 1
+        finally:
+            await dispose(replica)
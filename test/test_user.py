@@ -5,7 +5,7 @@ import time
 from datetime import timedelta
 import pytest
 from fastapi.testclient import TestClient
-from config.database import get_db
+from config.database import get_db, AsyncSessionLocal
 from main import app
 from models.user import UserModel
 from services.user import UserService, UserCRUD
@@ -216,12 +216,17 @@ class TestGetMe:
         assert resp.json()["detail"] == "Not authenticated"
 
 
+async def current_user(token: str):
+    async with AsyncSessionLocal() as db:
+        return await get_current_user(token, db)
+
+
 class TestCredentialsMisc:
     @pytest.mark.asyncio
     async def test_get_current_user_valid(self):
         data = {"email": "ryzeros@gmail.com"}
         token = create_access_token(data, timedelta(minutes=5))
-        user = await get_current_user(token, db=next(get_db()))
+        user = await current_user(token)
         assert user.email == "ryzeros@gmail.com"
         assert user.roles == "user,admin"
 
@@ -230,7 +235,7 @@ class TestCredentialsMisc:
         data = {"email": "ryzeros1@gmail.com"}
         token = create_access_token(data, timedelta(minutes=5))
         with pytest.raises(HTTPException) as exception_info:
-            await get_current_user(token, db=next(get_db()))
+            await current_user(token)
         assert exception_info.value.status_code == 401
         assert exception_info.value.detail == "Could not validate credentials"
 
@@ -240,7 +245,7 @@ class TestCredentialsMisc:
         token = create_access_token(data, timedelta(seconds=1))
         time.sleep(2)
         with pytest.raises(HTTPException) as exception_info:
-            await get_current_user(token, db=next(get_db()))
+            await current_user(token)
         assert exception_info.value.status_code == 401
         assert exception_info.value.detail == "Expired token"
 
@@ -248,7 +253,7 @@ class TestCredentialsMisc:
     async def test_get_current_user_jwt_error(self):
         token = "ASDASCREGERF"
         with pytest.raises(HTTPException) as exception_info:
-            await get_current_user(token, db=next(get_db()))
+            await current_user(token)
         assert exception_info.value.status_code == 401
         assert exception_info.value.detail == "Could not validate credentials"
 
@@ -257,7 +262,7 @@ class TestCredentialsMisc:
         data = {"not_email": "ryzeros@gmail.com"}
         token = create_access_token(data, timedelta(seconds=1))
         with pytest.raises(HTTPException) as exception_info:
-            await get_current_user(token, db=next(get_db()))
+            await current_user(token)
         assert exception_info.value.status_code == 401
         assert exception_info.value.detail == "Could not validate credentials"
 
@@ -265,7 +270,7 @@ class TestCredentialsMisc:
     async def test_get_current_active_user_(self, client_with_cleanup):
         data = {"email": "ryzroz@gmail.com"}
         token = create_access_token(data, timedelta(seconds=1))
-        user = await get_current_active_user(await get_current_user(token, next(get_db())))
+        user = await get_current_active_user(await current_user(token))
         assert user.email == "ryzroz@gmail.com"
 
     @pytest.mark.asyncio
@@ -288,7 +293,7 @@ class TestCredentialsMisc:
         data = {"email": "ryzroz@gmail.com"}
         token = create_access_token(data, timedelta(seconds=1))
         with pytest.raises(HTTPException) as exception_info:
-            await get_current_active_user(await get_current_user(token, next(get_db())))
+            await get_current_active_user(await current_user(token))
         assert exception_info.value.status_code == 400
         assert exception_info.value.detail == "Inactive user"
         db.query(UserModel).filter(UserModel.email == "ryzroz@gmail.com").update({"disabled": False})
@@ -299,7 +304,7 @@ class TestCredentialsMisc:
         data = {"email": "ryzroz@gmail.com"}
         token = create_access_token(data, timedelta(seconds=1))
         with pytest.raises(HTTPException) as exception_info:
-            await require_role("admin")(await get_current_active_user(await get_current_user(token, next(get_db()))))
+            await require_role("admin")(await get_current_active_user(await current_user(token)))
         assert exception_info.value.status_code == 403
         assert exception_info.value.detail == "Insufficient permissions"
 
@@ -307,5 +312,5 @@ class TestCredentialsMisc:
     async def test_require_role_valid(self, client_with_cleanup):
         data = {"email": "ryzeros@gmail.com"}
         token = create_access_token(data, timedelta(seconds=1))
-        user = await require_role("admin")(await get_current_active_user(await get_current_user(token, next(get_db()))))
+        user = await require_role("admin")(await get_current_active_user(await current_user(token)))
         assert user.email == "ryzeros@gmail.com"
@@ -0,0 +1,153 @@
+import hashlib
+import math
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Iterable
+from sqlalchemy.orm import Session
+
+
+class BloomFilter(object):
+    """
+    Fixed-size Bloom filter over strings. Sized for capacity items at error_rate false positives;
+    k bit positions per item are derived from one blake2b digest by double hashing.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.size = max(int(math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)), 8)
+        self.hashes = max(int(round(self.size / self.capacity * math.log(2))), 1)
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, item: str) -> bool:
+        """
+        Add item, returning False if it was (probably) already present.
+        """
+        added = False
+        for position in self._positions(item):
+            byte, bit = divmod(position, 8)
+            if not self._bits[byte] & (1 << bit):
+                self._bits[byte] |= 1 << bit
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+    def __contains__(self, item: str) -> bool:
+        for position in self._positions(item):
+            byte, bit = divmod(position, 8)
+            if not self._bits[byte] & (1 << bit):
+                return False
+        return True
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self._bits)
+
+    @property
+    def false_positive_rate(self) -> float:
+        """
+        Expected false-positive rate for the items added so far.
+        """
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+
+class SeenMemberFilter(object):
+    """
+    Per-airline Bloom filters of the credited member IDs, built by rebuild() or refresh(). "Not seen" is
+    certain, as the credits added since the last load are loaded first; "maybe seen" needs confirming.
+    """
+
+    def __init__(self, counter: Callable[[Session], dict[str, int]],
+                 loader: Callable[[Session, int], Iterable[tuple[int, str, str, datetime]]],
+                 error_rate: float = 0.01, min_capacity: int = 10000, settle_seconds: float = 60):
+        self._counter = counter
+        self._loader = loader
+        self._error_rate = error_rate
+        self._min_capacity = min_capacity
+        self._settle_seconds = settle_seconds
+        self._lock = threading.Lock()
+        self._filters: dict[str, BloomFilter] = {}
+        self._last_id = 0
+        self._loaded = False
+
+    def rebuild(self, db: Session):
+        counts = self._counter(db) or {}
+        filters = {airline_code: self._new_filter(count) for airline_code, count in counts.items()}
+        last_id = self._apply(filters, self._loader(db, 0), 0)
+        with self._lock:
+            self._filters, self._last_id, self._loaded = filters, last_id, True
+
+    def refresh(self, db: Session):
+        with self._lock:
+            rebuild = not self._loaded or any(bloom.count > bloom.capacity for bloom in self._filters.values())
+        if rebuild:
+            self.rebuild(db)
+        else:
+            self._catch_up(db)
+
+    def might_have_seen(self, db: Session, airline_code: str, member_id: str) -> bool:
+        with self._lock:
+            if not self._loaded or self._contains(airline_code, member_id):
+                return True
+        # other workers' credits are only in the filter once loaded from the table
+        self._catch_up(db)
+        with self._lock:
+            return self._contains(airline_code, member_id)
+
+    def add(self, airline_code: str, member_id: str):
+        with self._lock:
+            if self._loaded:
+                self._add(self._filters, airline_code, member_id)
+
+    def stats(self) -> list[dict]:
+        with self._lock:
+            return [{"airline_code": airline_code,
+                     "members": bloom.count,
+                     "capacity": bloom.capacity,
+                     "hashes": bloom.hashes,
+                     "memory_bytes": bloom.memory_bytes,
+                     "target_false_positive_rate": bloom.error_rate,
+                     "false_positive_rate": bloom.false_positive_rate}
+                    for airline_code, bloom in sorted(self._filters.items())]
+
+    def _contains(self, airline_code: str, member_id: str) -> bool:
+        bloom = self._filters.get(airline_code)
+        return bloom is not None and member_id in bloom
+
+    def _catch_up(self, db: Session):
+        with self._lock:
+            last_id = self._last_id
+        rows = list(self._loader(db, last_id))
+        with self._lock:
+            self._last_id = max(self._last_id, self._apply(self._filters, rows, last_id))
+
+    def _apply(self, filters: dict[str, BloomFilter], rows: Iterable[tuple[int, str, str, datetime]],
+               last_id: int) -> int:
+        """
+        Add rows, in id order, to filters and return the id the next load starts after
+        """
+        # a gap below a recent credit may be a credit not yet committed, so it is loaded again
+        settled = datetime.now() - timedelta(seconds=self._settle_seconds)
+        gap = False
+        for credit_id, airline_code, member_id, transaction_date in rows:
+            self._add(filters, airline_code, member_id)
+            gap = gap or (credit_id > last_id + 1 and transaction_date > settled)
+            if not gap:
+                last_id = credit_id
+        return last_id
+
+    def _add(self, filters: dict[str, BloomFilter], airline_code: str, member_id: str):
+        bloom = filters.get(airline_code)
+        if bloom is None:
+            bloom = filters[airline_code] = self._new_filter(0)
+        bloom.add(member_id)
+
+    def _new_filter(self, count: int) -> BloomFilter:
+        return BloomFilter(max(self._min_capacity, 2 * count), self._error_rate)
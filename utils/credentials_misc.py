@@ -3,7 +3,7 @@ from typing import Optional
 from datetime import timedelta, datetime
 from fastapi import Depends, HTTPException, status
 from config.credentials_config import SECRET_KEY, ALGORITHM, oauth2_scheme
-from config.database import get_db
+from config.database import get_async_db
 from models.user import UserModel
 import jwt
 
@@ -29,7 +29,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: get_db = Depends()):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: get_async_db = Depends()):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -49,7 +49,9 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: get_db = Dep
         raise expired_exception
     except jwt.PyJWTError:
         raise credentials_exception
-    user = db.query(UserModel).filter(UserModel.email == email).first()
+    # imported here, as services.user imports this module
+    from services.user import AsyncUserCRUD
+    user = await AsyncUserCRUD(db).get_by_email(email)
     if user is None:
         raise credentials_exception
     return user
@@ -0,0 +1,101 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable
+from pydantic import BaseModel
+
+
+class CreditCache(object):
+    """
+    Bounded LRU of recently read credits by (reference, partner_code), for the status polls that hit the
+    same few in-flight credits over and over.
+
+    Entries are dropped when a status change for the reference is published (see utils.status_events),
+    so the cache is only used while enabled() says those events are arriving; otherwise every read goes
+    to the database. A read racing a change can't cache the old status: put() takes the version seen
+    before the database read and is ignored if anything was invalidated since. Entries also expire after
+    ttl seconds, which bounds how long another worker's delete goes unnoticed.
+    """
+
+    def __init__(self, size: int = 10000, ttl: float = 60, enabled: Callable[[], bool] = lambda: True):
+        self.size = size
+        self.ttl = ttl
+        self._enabled = enabled
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple[str, str], tuple[float, BaseModel]] = OrderedDict()
+        self._partners: dict[str, set[str]] = {}
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple[str, str]) -> BaseModel | None:
+        if not self._enabled():
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: tuple[str, str], item: BaseModel, version: int):
+        if not self._enabled():
+            return
+        with self._lock:
+            if version != self.version:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, item)
+            self._entries.move_to_end(key)
+            self._partners.setdefault(key[0], set()).add(key[1])
+            while len(self._entries) > self.size:
+                (reference, partner_code), _ = self._entries.popitem(last=False)
+                self._forget(reference, partner_code)
+
+    def invalidate(self, reference: str | None = None):
+        """
+        Drop the reference's entries, or every entry without one
+        """
+        with self._lock:
+            self.version += 1
+            if reference is None:
+                self._entries.clear()
+                self._partners.clear()
+                return
+            for partner_code in self._partners.pop(str(reference), ()):
+                self._entries.pop((str(reference), partner_code), None)
+
+    def _forget(self, reference: str, partner_code: str):
+        partners = self._partners.get(reference)
+        if partners is not None:
+            partners.discard(partner_code)
+            if not partners:
+                del self._partners[reference]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def canonical_reference(reference: str) -> str | None:
+    """
+    The reference in the database's text form, or None if it is not a UUID (checked here rather than
+    by a failing query)
+    """
+    try:
+        return str(uuid.UUID(reference))
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+
+def etag(item: BaseModel) -> str:
+    return '"' + hashlib.blake2b(item.model_dump_json().encode(), digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: str | None, tag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == tag for candidate in candidates)
@@ -1,5 +1,65 @@
+import os
+import threading
+import time
 import uuid
+from datetime import datetime, timedelta, timezone
+
+_uuid7_lock = threading.Lock()
+_uuid7_last = (0, 0)
+
+
+def uuid7() -> uuid.UUID:
+    """
+    Time-ordered UUID (RFC 9562 version 7): 48 bits of Unix milliseconds, a 12-bit counter that starts at
+    a random value each millisecond, then 62 random bits. UUIDs from one process are strictly increasing.
+    """
+    global _uuid7_last
+    with _uuid7_lock:
+        timestamp, counter = time.time_ns() // 1_000_000, None
+        last_timestamp, last_counter = _uuid7_last
+        if timestamp <= last_timestamp:
+            timestamp, counter = last_timestamp, last_counter + 1
+            if counter > 0xFFF:
+                timestamp, counter = last_timestamp + 1, None
+        if counter is None:
+            counter = int.from_bytes(os.urandom(2), "big") & 0x7FF
+        _uuid7_last = (timestamp, counter)
+    random_bits = int.from_bytes(os.urandom(8), "big") & ((1 << 62) - 1)
+    return uuid.UUID(int=(timestamp << 80) | (0x7 << 76) | (counter << 64) | (0b10 << 62) | random_bits)
 
 
 def generate_reference():
-    return str(uuid.uuid4())
+    return str(uuid7())
+
+
+def reference_time(reference: str | uuid.UUID) -> datetime:
+    """
+    Creation time of a reference made by generate_reference (UTC, millisecond precision)
+    """
+    reference = reference if isinstance(reference, uuid.UUID) else uuid.UUID(reference)
+    return datetime.fromtimestamp((reference.int >> 80) / 1000, tz=timezone.utc)
+
+
+def reference_range(start: datetime, end: datetime) -> tuple[uuid.UUID, uuid.UUID]:
+    """
+    Bounds such that start <= reference_time(reference) < end exactly when low <= reference < high.
+    Naive datetimes are taken as local time.
+    """
+    def bound(moment: datetime) -> uuid.UUID:
+        return uuid.UUID(int=(int(moment.timestamp() * 1000) << 80) | (0x7 << 76) | (0b10 << 62))
+    return bound(start), bound(end)
+
+
+def reference_date_window(reference: str, margin: timedelta = timedelta(days=1)) -> tuple[datetime, datetime] | None:
+    """
+    Naive local-time bounds on the transaction_date of the credit with this reference, for partition
+    pruning. None if the reference is not a time-ordered (version 7) UUID.
+    """
+    try:
+        reference = uuid.UUID(reference)
+    except (ValueError, TypeError, AttributeError):
+        return None
+    if reference.version != 7:
+        return None
+    created = reference_time(reference).astimezone().replace(tzinfo=None)
+    return created - margin, created + margin
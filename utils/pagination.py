@@ -0,0 +1,43 @@
+from typing import Iterator
+from fastapi import Response
+from pydantic import BaseModel
+from sqlalchemy import BindParameter, Select
+from sqlalchemy.orm import InstrumentedAttribute, sessionmaker
+
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/ndjson")
+DEFAULT_PAGE_SIZE = 100
+
+
+def wants_ndjson(accept: str | None) -> bool:
+    return accept is not None and any(media_type in accept for media_type in NDJSON_MEDIA_TYPES)
+
+
+def paginate(statement: Select, key: InstrumentedAttribute, cursor: int | BindParameter | None,
+             limit: int | BindParameter | None) -> Select:
+    """
+    Keyset page of statement: rows with key after cursor, ordered by key. cursor and limit may be bind
+    parameters, for a statement built once.
+    """
+    if cursor is not None:
+        statement = statement.where(key > cursor)
+    return statement.order_by(key).limit(DEFAULT_PAGE_SIZE if limit is None else limit)
+
+
+def set_next_cursor(response: Response, items: list, limit: int | None):
+    if len(items) == (limit or DEFAULT_PAGE_SIZE):
+        response.headers["X-Next-Cursor"] = str(items[-1].id)
+
+
+def stream_ndjson(session_factory: sessionmaker, statement: Select, schema: type[BaseModel],
+                  chunk_size: int = 1000) -> Iterator[str]:
+    """
+    Yield the rows of statement as NDJSON, chunk_size rows at a time, read through a server-side cursor.
+    Opens its own session because the request's session is closed before a streamed body is sent.
+    """
+    db = session_factory()
+    try:
+        for rows in db.scalars(statement.execution_options(yield_per=chunk_size)).partitions():
+            yield "".join(schema.model_validate(row, from_attributes=True).model_dump_json() + "\n" for row in rows)
+            db.expunge_all()
+    finally:
+        db.close()
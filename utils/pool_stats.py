@@ -0,0 +1,138 @@
+import bisect
+import threading
+import time
+from typing import Any
+from sqlalchemy import Engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, Pool, QueuePool
+
+# upper bounds, in milliseconds, of the checkout wait histogram's buckets; the last bucket is unbounded
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+
+class PoolStats(object):
+    """
+    Counters for one engine's connection pool. Connections opened, closed and invalidated, and those in
+    use, come from the pool's events; the time each checkout waited for a connection (including opening
+    or pre-pinging it) and the checkouts that timed out come from the pool class, an InstrumentedPool.
+    """
+
+    def __init__(self, name: str, engine: Engine):
+        self.name = name
+        self.engine = engine
+        self._lock = threading.Lock()
+        self.reset()
+        engine.pool.stats = self
+        for event_name, listener in (("connect", self._connect), ("close", self._close), ("detach", self._detach),
+                                     ("invalidate", self._invalidate), ("checkout", self._checkout),
+                                     ("checkin", self._checkin)):
+            event.listen(engine, event_name, listener)
+
+    def reset(self):
+        with self._lock:
+            self.connects = 0
+            self.closes = 0
+            self.invalidations = 0
+            self.in_use = 0
+            self.checkouts = 0
+            self.timeouts = 0
+            self.wait_seconds = 0.0
+            self.max_wait_seconds = 0.0
+            self.wait_buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+
+    def observe_wait(self, seconds: float):
+        bucket = bisect.bisect_left(WAIT_BUCKETS_MS, seconds * 1000)
+        with self._lock:
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+            self.wait_buckets[bucket] += 1
+
+    def observe_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def _connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    def _close(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.closes += 1
+
+    def _detach(self, dbapi_connection, connection_record):
+        # a detached connection leaves the pool while checked out, and is never checked in
+        with self._lock:
+            self.closes += 1
+            self.in_use -= 1
+
+    def _invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidations += 1
+
+    def _checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+
+    def _checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.in_use -= 1
+
+    def snapshot(self) -> dict[str, Any]:
+        pool = self.engine.pool
+        with self._lock:
+            waits = sum(self.wait_buckets)
+            return {
+                "name": self.name,
+                "pool": type(pool).__name__,
+                "size": pool.size() if isinstance(pool, QueuePool) else None,
+                "max_overflow": pool._max_overflow if isinstance(pool, QueuePool) else None,
+                "in_use": self.in_use,
+                "idle": pool.checkedin() if isinstance(pool, QueuePool) else 0,
+                "connects": self.connects,
+                "closes": self.closes,
+                "invalidations": self.invalidations,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "mean_wait_ms": self.wait_seconds * 1000 / waits if waits else 0.0,
+                "max_wait_ms": self.max_wait_seconds * 1000,
+                "wait_histogram": [{"le_ms": bound, "count": count} for bound, count
+                                   in zip(WAIT_BUCKETS_MS + (None,), self.wait_buckets)],
+            }
+
+
+class InstrumentedPool(Pool):
+    """
+    Pool mixin reporting how long each checkout waited, and checkouts that timed out, to its PoolStats
+    """
+    stats: PoolStats | None = None
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            if self.stats is not None:
+                self.stats.observe_timeout()
+            raise
+        if self.stats is not None:
+            self.stats.observe_wait(time.perf_counter() - started)
+        return connection
+
+    def recreate(self):
+        # engine.dispose() replaces the pool with a new one
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+class InstrumentedQueuePool(InstrumentedPool, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(InstrumentedPool, AsyncAdaptedQueuePool):
+    pass
+
+
+class InstrumentedNullPool(InstrumentedPool, NullPool):
+    pass
@@ -0,0 +1,375 @@
+import ast
+import hashlib
+import json
+import math
+from bisect import bisect_left
+from typing import Any, Callable
+from utils.promotion_misc import Interval, OPERATOR_MAP, normalise_condition, parse_points_condition, validate_promotions
+
+_ALLOWED_BINARY_OPS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow)
+_ALLOWED_UNARY_OPS = (ast.UAdd, ast.USub)
+
+_MAX_BOUND_ORDERS = 256
+
+_compiled_points_rules: dict[tuple[int, str], "CompiledPointsRule"] = {}
+
+
+def _check_formula_node(node: ast.AST, formula: str):
+    if isinstance(node, ast.BinOp) and isinstance(node.op, _ALLOWED_BINARY_OPS):
+        _check_formula_node(node.left, formula)
+        _check_formula_node(node.right, formula)
+    elif isinstance(node, ast.UnaryOp) and isinstance(node.op, _ALLOWED_UNARY_OPS):
+        _check_formula_node(node.operand, formula)
+    elif isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        node.value = float(node.value)
+    elif isinstance(node, ast.Name) and node.id == "x":
+        pass
+    else:
+        raise ValueError(f"Invalid formula: {formula}")
+
+
+def compile_formula(formula: str) -> Callable[[float], float]:
+    """
+    Compile a points formula such as "(x-900) * 1.5 + 500" into a plain function of x.
+    Only numbers, x, + - * / ** (or ^ as sympify reads it) and parentheses are accepted.
+    """
+    if not isinstance(formula, str):
+        raise ValueError(f"Invalid formula: {formula}")
+    try:
+        tree = ast.parse(formula.replace("^", "**").strip(), mode="eval")
+    except SyntaxError:
+        raise ValueError(f"Invalid formula: {formula}")
+    _check_formula_node(tree.body, formula)
+
+    function = ast.Expression(body=ast.Lambda(
+        args=ast.arguments(posonlyargs=[], args=[ast.arg(arg="x")], kwonlyargs=[], kw_defaults=[], defaults=[]),
+        body=tree.body
+    ))
+    ast.fix_missing_locations(function)
+    function = eval(compile(function, "<formula>", "eval"), {"__builtins__": {}})
+    function.expression = tree.body
+    return function
+
+
+def _binary_range(op: ast.operator, left: tuple[float, float], right: tuple[float, float]) -> tuple[float, float]:
+    if isinstance(op, ast.Add):
+        values = [left[0] + right[0], left[1] + right[1]]
+    elif isinstance(op, ast.Sub):
+        values = [left[0] - right[1], left[1] - right[0]]
+    elif isinstance(op, ast.Div) and right[0] <= 0 <= right[1]:
+        return -math.inf, math.inf
+    elif isinstance(op, (ast.Mult, ast.Div)):
+        if isinstance(op, ast.Div):
+            right = 1 / right[1], 1 / right[0]
+        values = [a * b for a in left for b in right]
+    elif left[0] > 0:
+        # a ** b is monotonic in both arguments for a > 0, so the extremes are at the corners
+        values = [a ** b for a in left for b in right]
+    else:
+        return -math.inf, math.inf
+    if any(isinstance(value, complex) or math.isnan(value) for value in values):
+        return -math.inf, math.inf
+    return min(values), max(values)
+
+
+def _formula_range(node: ast.expr, low: float, high: float) -> tuple[float, float]:
+    if isinstance(node, ast.Constant):
+        return node.value, node.value
+    if isinstance(node, ast.Name):
+        return low, high
+    if isinstance(node, ast.UnaryOp):
+        operand = _formula_range(node.operand, low, high)
+        return operand if isinstance(node.op, ast.UAdd) else (-operand[1], -operand[0])
+    return _binary_range(node.op, _formula_range(node.left, low, high), _formula_range(node.right, low, high))
+
+
+def formula_upper_bound(formula: Callable[[float], float], low: float, high: float) -> float:
+    """
+    Upper bound of int(formula(x)) for low <= x <= high, by interval arithmetic over the formula's expression
+    """
+    try:
+        result = _formula_range(formula.expression, low, high)
+    except ArithmeticError:
+        return math.inf
+    # one extra point of slack absorbs float rounding in the bound itself
+    return math.ceil(result[1]) + 1 if math.isfinite(result[1]) else result[1]
+
+
+class CompiledPointsRule(object):
+    """
+    The point_condition list of a promotion, parsed once.
+
+    Every bound used by any condition splits the number line into elementary regions (the bounds
+    themselves and the open gaps between them). No condition changes truth value inside a region,
+    so the formulas whose condition holds are precomputed per region, in their original order,
+    and looking up an amount is a single bisect.
+    """
+
+    def __init__(self, point_conditions: list[tuple[str, tuple[Interval, ...], Callable[[float], float]]]):
+        self.point_conditions = point_conditions
+        self.bounds = sorted({bound
+                              for _, intervals, _ in point_conditions
+                              for interval in intervals
+                              for bound in (interval.low, interval.high)
+                              if bound not in (-math.inf, math.inf)})
+        self.regions = [
+            tuple(formula for _, intervals, formula in point_conditions
+                  if any(sample in interval for interval in intervals))
+            for sample in self._region_samples()
+        ]
+        self.overlapping = any(len(region) > 1 for region in self.regions)
+
+    def _region_samples(self) -> list[float]:
+        bounds = self.bounds
+        if not bounds:
+            return [0.0]
+        samples = [bounds[0] - max(1.0, abs(bounds[0]))]
+        for low, high in zip(bounds, bounds[1:]):
+            samples += [low, low + (high - low) / 2]
+        samples += [bounds[-1], bounds[-1] + max(1.0, abs(bounds[-1]))]
+        return samples
+
+    def matching(self, x: float) -> tuple[Callable[[float], float], ...]:
+        """
+        The formulas whose condition holds for x, in the order they appear in point_condition
+        """
+        index = bisect_left(self.bounds, x)
+        if index < len(self.bounds) and self.bounds[index] == x:
+            return self.regions[2 * index + 1]
+        return self.regions[2 * index]
+
+    def upper_bound(self, low: float, high: float) -> float:
+        """
+        Upper bound on the points any condition can give for an amount between low and high
+        """
+        bound = -math.inf
+        for _, intervals, formula in self.point_conditions:
+            for interval in intervals:
+                if max(low, interval.low) <= min(high, interval.high):
+                    bound = max(bound, formula_upper_bound(formula, max(low, interval.low), min(high, interval.high)))
+        return bound
+
+
+def compile_points_rule(points_rule: dict[str, Any]) -> CompiledPointsRule:
+    try:
+        point_conditions = points_rule["point_condition"]
+        return CompiledPointsRule([(condition, parse_points_condition(condition), compile_formula(formula))
+                                   for condition, formula in point_conditions])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"Invalid points rule: {points_rule}")
+
+
+def points_rule_version(points_rule: dict[str, Any]) -> str:
+    return hashlib.sha1(json.dumps(points_rule, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def cache_points_rule(promotion_id: int, points_rule: dict[str, Any], compiled: CompiledPointsRule):
+    version = points_rule_version(points_rule)
+    for key in [key for key in _compiled_points_rules if key[0] == promotion_id and key[1] != version]:
+        del _compiled_points_rules[key]
+    _compiled_points_rules[(promotion_id, version)] = compiled
+
+
+def get_points_rule(promotion) -> CompiledPointsRule:
+    """
+    Return the compiled points rule of a promotion, compiling it on first use.
+    The cache is keyed by promotion id and a hash of its points_rule, so edited rules are recompiled.
+    """
+    compiled = _compiled_points_rules.get((promotion.id, points_rule_version(promotion.points_rule)))
+    if compiled is None:
+        compiled = compile_points_rule(promotion.points_rule)
+        cache_points_rule(promotion.id, promotion.points_rule, compiled)
+    return compiled
+
+
+def _contains(a, b: frozenset) -> bool:
+    try:
+        return a in b
+    except TypeError:
+        # an unhashable value cannot equal any of the (hashable) members
+        return False
+
+
+def compile_conditions(conditions: dict[str, dict[str, Any]]) -> list[tuple[str, str, Callable[[Any, Any], bool], Any]]:
+    """
+    Turn promotion conditions into (key, operation, function, value) checks, with "in" lists as frozensets.
+    Raises KeyError/TypeError/AttributeError for malformed conditions.
+    """
+    checks = []
+    for key, condition in conditions.items():
+        operation, value = normalise_condition(condition)
+        function = OPERATOR_MAP[operation]
+        if operation == "in" and isinstance(value, list):
+            try:
+                value, function = frozenset(value), _contains
+            except TypeError:
+                pass
+        checks.append((key, operation, function, value))
+    return checks
+
+
+class CompiledPromotion(object):
+    """
+    Snapshot of a promotion row with its points rule and conditions compiled, safe to keep after the session is gone
+    """
+
+    def __init__(self, promotion):
+        self.id = promotion.id
+        self.airline_code = promotion.airline_code
+        self.partner_code = promotion.partner_code
+        self.expiry = promotion.expiry
+        self.conditions = promotion.conditions
+        self.point_conditions = get_points_rule(promotion)
+        try:
+            self.condition_checks = compile_conditions(self.conditions)
+        except (KeyError, TypeError, AttributeError):
+            # keep validate_promotions' behaviour (including its errors) for rows that predate validation
+            self.condition_checks = None
+
+    def matches(self, additional_info: dict[str, Any]) -> bool:
+        """
+        Same result as validate_promotions(self.conditions, additional_info)
+        """
+        if self.condition_checks is None:
+            return validate_promotions(self.conditions, additional_info)
+        if len(additional_info) == 0:
+            return False
+        for key, _, function, value in self.condition_checks:
+            if key not in additional_info or not function(additional_info[key], value):
+                return False
+        return True
+
+
+class PromotionCandidates(object):
+    """
+    Inverted index from condition keys, and from "eq"/"in" values, to the promotions that need them.
+
+    for_info() only returns promotions whose required keys all appear in additional_info and whose
+    "eq"/"in" conditions can hold for the values given, so the remaining checks run on far fewer promotions.
+    Results keep the original promotion order.
+    """
+
+    def __init__(self, promotions: list[CompiledPromotion]):
+        self.promotions = promotions
+        self._always = []
+        self._required = {}
+        self._by_key = {}
+        self._by_value = {}
+        self._valued_keys = {}
+        self._bound_orders = {}
+        self.condition_keys = frozenset(key for promotion in promotions for key in promotion.conditions)
+        self.bounded = all(promotion.condition_checks is not None and not promotion.point_conditions.overlapping
+                           for promotion in promotions)
+        for position, promotion in enumerate(promotions):
+            if not promotion.condition_checks:
+                self._always.append(position)
+                continue
+            self._required[position] = len(promotion.condition_checks)
+            for key, operation, _, value in promotion.condition_checks:
+                values = self._indexable_values(operation, value)
+                if values is None:
+                    self._by_key.setdefault(key, []).append(position)
+                    continue
+                self._valued_keys.setdefault(key, []).append(position)
+                for item in values:
+                    self._by_value.setdefault((key, item), []).append(position)
+
+    @staticmethod
+    def _indexable_values(operation: str, value: Any) -> tuple | frozenset | None:
+        if operation == "in" and isinstance(value, frozenset):
+            return value
+        if operation == "eq":
+            try:
+                hash(value)
+                return value,
+            except TypeError:
+                pass
+        return None
+
+    @staticmethod
+    def amount_range(amount: int) -> tuple[int, int]:
+        """
+        The bucket of amounts that amount falls in: each power of two split into 16, e.g. 100 -> (100, 103)
+        """
+        shift = max(abs(amount).bit_length() - 5, 0)
+        low = abs(amount) >> shift << shift
+        high = low + (1 << shift) - 1
+        return (low, high) if amount >= 0 else (-high, -low)
+
+    def _bound_order(self, amount: int) -> list[tuple[float, int]]:
+        amount_range = self.amount_range(amount)
+        order = self._bound_orders.get(amount_range)
+        if order is None:
+            order = []
+            for position, promotion in enumerate(self.promotions):
+                bound = promotion.point_conditions.upper_bound(*amount_range)
+                if bound > -math.inf:
+                    order.append((bound, position))
+            order.sort(key=lambda entry: (-entry[0], entry[1]))
+            if len(self._bound_orders) >= _MAX_BOUND_ORDERS:
+                del self._bound_orders[next(iter(self._bound_orders))]
+            self._bound_orders[amount_range] = order
+        return order
+
+    def select_best(self, amount: int, additional_info: dict[str, Any]) -> tuple[int, int]:
+        """
+        Same result as select_best_promotion(self.promotions, amount, additional_info), by branch and bound.
+
+        Promotions are visited in descending order of their upper bound for the amount's bucket and the
+        search stops once no remaining bound can beat the best so far, so usually only a handful of the
+        promotions are evaluated. Ties go to the earliest promotion, as in the sequential loop. When a
+        promotion has overlapping point conditions its result depends on the running best, so the
+        sequential loop is used instead.
+        """
+        if not self.bounded:
+            return select_best_promotion(self.for_info(additional_info), amount, additional_info)
+
+        best_points, best_position = amount, None
+        for bound, position in self._bound_order(amount):
+            if bound <= amount or bound < best_points:
+                break
+            promotion = self.promotions[position]
+            if not promotion.matches(additional_info):
+                continue
+            for formula in promotion.point_conditions.matching(amount):
+                points = int(formula(amount))
+                if points > best_points or (points == best_points and best_position is not None
+                                            and position < best_position):
+                    best_points, best_position = points, position
+        return best_points, 0 if best_position is None else self.promotions[best_position].id
+
+    def positions_for_info(self, additional_info: dict[str, Any]) -> list[int]:
+        if len(additional_info) == 0:
+            return []
+        hits = {}
+        for key, value in additional_info.items():
+            positions = self._by_key.get(key, [])
+            if key in self._valued_keys:
+                try:
+                    positions = positions + self._by_value.get((key, value), [])
+                except TypeError:
+                    positions = positions + self._valued_keys[key]
+            for position in positions:
+                hits[position] = hits.get(position, 0) + 1
+        return sorted([position for position, count in hits.items() if count == self._required[position]]
+                      + self._always)
+
+    def for_info(self, additional_info: dict[str, Any]) -> list[CompiledPromotion]:
+        return [self.promotions[position] for position in self.positions_for_info(additional_info)]
+
+
+def select_best_promotion(promotions: list[CompiledPromotion], amount: int,
+                          additional_info: dict[str, Any]) -> tuple[int, int]:
+    """
+    Return the most points any promotion gives for amount and the id of that promotion (0 if none beats amount)
+    """
+    max_point = [amount, 0]
+    for promo_item in promotions:
+        if promo_item.matches(additional_info):
+            for formula in promo_item.point_conditions.matching(amount):
+                points = int(formula(amount))
+                if points > max_point[0]:
+                    max_point[0] = points
+                    max_point[1] = promo_item.id
+                    break
+    return max_point[0], max_point[1]
@@ -0,0 +1,106 @@
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Callable
+from sqlalchemy.orm import Session
+from utils.promotion_compiler import CompiledPromotion, PromotionCandidates
+
+logger = logging.getLogger(__name__)
+
+
+def compile_promotion(promotion) -> CompiledPromotion | None:
+    """
+    The compiled promotion, or None (logged) if its points rule does not compile
+    """
+    try:
+        return CompiledPromotion(promotion)
+    except ValueError:
+        logger.exception("Promotion %s left out: its points rule does not compile", promotion.id)
+        return None
+
+
+class ActivePromotionIndex(object):
+    """
+    Process-local index of the active promotions by (airline_code, partner_code), reloaded after
+    invalidate() or every refresh_interval seconds; expired ones are dropped on access
+    """
+
+    def __init__(self, loader: Callable[[Session], list], refresh_interval: float = 300):
+        self._loader = loader
+        self._refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._generation = 0
+        self._by_key: dict[tuple[str, str], list[CompiledPromotion]] = {}
+        self._by_id: dict[int, CompiledPromotion] = {}
+        self._candidates: dict[tuple[str, str], PromotionCandidates] = {}
+        self._expiries: list[tuple[datetime, int]] = []
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+            self._generation += 1
+
+    def warm(self, db: Session):
+        self._ensure_fresh(db)
+
+    def get(self, db: Session, airline_code: str, partner_code: str,
+            now: datetime | None = None) -> list[CompiledPromotion]:
+        self._ensure_fresh(db)
+        with self._lock:
+            self._drop_expired(now or datetime.now())
+            return list(self._by_key.get((airline_code, partner_code), ()))
+
+    def get_candidates(self, db: Session, airline_code: str, partner_code: str,
+                       now: datetime | None = None) -> PromotionCandidates:
+        self._ensure_fresh(db)
+        with self._lock:
+            self._drop_expired(now or datetime.now())
+            key = (airline_code, partner_code)
+            candidates = self._candidates.get(key)
+            if candidates is None:
+                candidates = self._candidates[key] = PromotionCandidates(self._by_key.get(key, []))
+            return candidates
+
+    def get_by_id(self, db: Session, promotion_id: int, now: datetime | None = None) -> CompiledPromotion | None:
+        self._ensure_fresh(db)
+        with self._lock:
+            self._drop_expired(now or datetime.now())
+            return self._by_id.get(promotion_id)
+
+    def _ensure_fresh(self, db: Session):
+        with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at <= self._refresh_interval:
+                return
+            generation = self._generation
+        by_key, by_id, expiries = self._load(db)
+        with self._lock:
+            self._by_key, self._by_id, self._expiries = by_key, by_id, expiries
+            self._candidates = {}
+            # invalidated while loading: the next access loads again
+            if self._generation == generation:
+                self._loaded_at = time.monotonic()
+
+    def _load(self, db: Session) -> tuple[dict, dict, list]:
+        by_key, by_id, expiries = {}, {}, []
+        for promotion in self._loader(db) or []:
+            promotion = compile_promotion(promotion)
+            if promotion is None:
+                continue
+            by_key.setdefault((promotion.airline_code, promotion.partner_code), []).append(promotion)
+            by_id[promotion.id] = promotion
+            if promotion.expiry is not None:
+                expiries.append((promotion.expiry, promotion.id))
+        heapq.heapify(expiries)
+        return by_key, by_id, expiries
+
+    def _drop_expired(self, now: datetime):
+        while self._expiries and self._expiries[0][0] <= now:
+            _, promotion_id = heapq.heappop(self._expiries)
+            promotion = self._by_id.pop(promotion_id, None)
+            if promotion is not None:
+                key = (promotion.airline_code, promotion.partner_code)
+                self._by_key[key] = [item for item in self._by_key[key] if item.id != promotion_id]
+                self._candidates.pop(key, None)
@@ -1,98 +1,160 @@
-from sympy import sympify, symbols
+from functools import lru_cache
+from typing import Any
+import math
 import re
 
 
-def eval_points_conditions(condition: str, x: float):
+# additional_info keys filled in from the member's monthly rollup rather than sent by the bank
+MONTHLY_AMOUNT_KEY = "member.monthly_amount"
+PREVIOUS_MONTHLY_AMOUNT_KEY = "member.previous_monthly_amount"
+MONTHLY_TRANSACTIONS_KEY = "member.monthly_transactions"
+ROLLUP_CONDITION_KEYS = frozenset([MONTHLY_AMOUNT_KEY, PREVIOUS_MONTHLY_AMOUNT_KEY, MONTHLY_TRANSACTIONS_KEY])
+# True when the member has never been credited with the airline before
+FIRST_TRANSACTION_KEY = "member.first_transaction"
+
+_RANGE_PATTERN = re.compile(r'^\s*(-?\d+(\.\d+)?)\s*([<>]=?)\s*x\s*([<>]=?)\s*(-?\d+(\.\d+)?)\s*$')
+_SINGLE_PATTERN = re.compile(r'^\s*x\s*([<>]=?|==|!=)\s*(-?\d+(\.\d+)?)\s*$')
+
+
+class Interval(object):
+    __slots__ = ("low", "high", "low_inclusive", "high_inclusive")
+
+    def __init__(self, low: float = -math.inf, high: float = math.inf,
+                 low_inclusive: bool = False, high_inclusive: bool = False):
+        self.low = low
+        self.high = high
+        self.low_inclusive = low_inclusive
+        self.high_inclusive = high_inclusive
+
+    def __contains__(self, x: float) -> bool:
+        return ((self.low < x or (self.low_inclusive and self.low == x))
+                and (x < self.high or (self.high_inclusive and x == self.high)))
+
+    def __eq__(self, other):
+        return isinstance(other, Interval) and self.bounds() == other.bounds()
+
+    def __repr__(self):
+        return (f"{'[' if self.low_inclusive else '('}{self.low}, "
+                f"{self.high}{']' if self.high_inclusive else ')'}")
+
+    def bounds(self) -> tuple[float, float, bool, bool]:
+        return self.low, self.high, self.low_inclusive, self.high_inclusive
+
+    def is_empty(self) -> bool:
+        return self.low > self.high or (self.low == self.high and not (self.low_inclusive and self.high_inclusive))
+
+    def intersect(self, other: "Interval") -> "Interval":
+        if self.low > other.low or (self.low == other.low and not self.low_inclusive):
+            low, low_inclusive = self.low, self.low_inclusive
+        else:
+            low, low_inclusive = other.low, other.low_inclusive
+        if self.high < other.high or (self.high == other.high and not self.high_inclusive):
+            high, high_inclusive = self.high, self.high_inclusive
+        else:
+            high, high_inclusive = other.high, other.high_inclusive
+        return Interval(low, high, low_inclusive, high_inclusive)
+
+
+def _half_line(operator: str, value: float) -> Interval:
     """
-    Evaluate the condition for x.
+    The values of x satisfying "x <operator> value"
+    """
+    if operator == "<":
+        return Interval(high=value)
+    elif operator == "<=":
+        return Interval(high=value, high_inclusive=True)
+    elif operator == ">":
+        return Interval(low=value)
+    return Interval(low=value, low_inclusive=True)
+
+
+_MIRRORED_OPERATORS = {"<": ">", "<=": ">=", ">": "<", ">=": "<="}
+
+
+@lru_cache(maxsize=4096)
+def parse_points_condition(condition: str) -> tuple[Interval, ...]:
+    """
+    Parse a condition into the disjoint intervals of x that satisfy it.
     Supports operators: <, <=, >, >=, ==, !=
     Supports range comparisons like 600 < x < 1000
     """
-    # Regular expression to match range comparisons like 600 < x < 1000
-    range_pattern = re.compile(r'^\s*(-?\d+(\.\d+)?)\s*([<>]=?)\s*x\s*([<>]=?)\s*(-?\d+(\.\d+)?)\s*$')
-    single_pattern = re.compile(r'^\s*x\s*([<>]=?|==|!=)\s*(-?\d+(\.\d+)?)\s*$')
-
-    range_match = range_pattern.match(condition)
-    single_match = single_pattern.match(condition)
+    range_match = _RANGE_PATTERN.match(condition)
+    single_match = _SINGLE_PATTERN.match(condition)
 
     if range_match:
-        left_value = float(range_match.group(1))
-        left_operator = range_match.group(3)
-        right_operator = range_match.group(4)
-        right_value = float(range_match.group(5))
-
-        if left_operator == "<":
-            left_result = left_value < x
-        elif left_operator == "<=":
-            left_result = left_value <= x
-        elif left_operator == ">":
-            left_result = left_value > x
-        elif left_operator == ">=":
-            left_result = left_value >= x
-
-        if right_operator == "<":
-            right_result = x < right_value
-        elif right_operator == "<=":
-            right_result = x <= right_value
-        elif right_operator == ">":
-            right_result = x > right_value
-        elif right_operator == ">=":
-            right_result = x >= right_value
-
-        return left_result and right_result
+        # "600 < x" is read as "x > 600"
+        left = _half_line(_MIRRORED_OPERATORS[range_match.group(3)], float(range_match.group(1)))
+        right = _half_line(range_match.group(4), float(range_match.group(5)))
+        intervals = (left.intersect(right),)
 
     elif single_match:
         operator = single_match.group(1)
         right = float(single_match.group(2))
 
-        if operator == "<":
-            return x < right
-        elif operator == "<=":
-            return x <= right
-        elif operator == ">":
-            return x > right
-        elif operator == ">=":
-            return x >= right
-        elif operator == "==":
-            return x == right
+        if operator == "==":
+            intervals = (Interval(right, right, True, True),)
         elif operator == "!=":
-            return x != right
+            intervals = (Interval(high=right), Interval(low=right))
+        else:
+            intervals = (_half_line(operator, right),)
 
     else:
         raise ValueError(f"Invalid condition format: {condition}")
 
+    return tuple(interval for interval in intervals if not interval.is_empty())
+
+
+def eval_points_conditions(condition: str, x: float):
+    """
+    Evaluate the condition for x.
+    Supports operators: <, <=, >, >=, ==, !=
+    Supports range comparisons like 600 < x < 1000
+    """
+    return any(x in interval for interval in parse_points_condition(condition))
 
 
 def calculate_points(x_val: int, formula: str):
+    # sympy takes longer to import than the rest of the app; promotions use utils.promotion_compiler instead
+    from sympy import sympify, symbols
     x = symbols('x')
     formula = sympify(formula)
     result = formula.subs(x, x_val)
     return int(result)
 
 
-def validate_promotions(rule: dict, data: dict):
-    operator_map = {
-        "eq": lambda a, b: a == b,
-        "gt": lambda a, b: a > b,
-        "gte": lambda a, b: a >= b,
-        "lt": lambda a, b: a < b,
-        "lte": lambda a, b: a <= b,
-        "in": lambda a, b: a in b
-    }
+OPERATOR_MAP = {
+    "eq": lambda a, b: a == b,
+    "gt": lambda a, b: a > b,
+    "gte": lambda a, b: a >= b,
+    "lt": lambda a, b: a < b,
+    "lte": lambda a, b: a <= b,
+    "in": lambda a, b: a in b
+}
 
+
+def normalise_condition(condition: dict) -> tuple[str, Any]:
+    """
+    Return the operation and value of a promotion condition. A list value always means "in",
+    and "in" with a single scalar value means membership in a one-element list.
+    """
+    operation = condition.get('op', 'eq')
+    value = condition['value']
+    if isinstance(value, list):
+        operation = 'in'
+    elif operation == 'in' and (value is None or isinstance(value, (bool, int, float))):
+        value = [value]
+    return operation, value
+
+
+def validate_promotions(rule: dict, data: dict):
     if len(data) == 0:
         return False
 
     for key, condition in rule.items():
-        print(key, condition)
         if key not in data:
             return False
 
-        operation = condition.get('op', 'eq')
-        value = condition['value']
-        print(value)
-        if isinstance(value, list):
-            operation = 'in'
-        if not operator_map[operation](data[key], value):
+        operation, value = normalise_condition(condition)
+        if not OPERATOR_MAP[operation](data[key], value):
             return False
     return True
@@ -0,0 +1,53 @@
+import numpy as np
+from typing import Any
+from utils.promotion_compiler import CompiledPromotion, PromotionCandidates
+from utils.promotion_misc import Interval
+
+
+def interval_mask(intervals: tuple[Interval, ...], x: np.ndarray) -> np.ndarray:
+    mask = np.zeros(x.shape, dtype=bool)
+    for interval in intervals:
+        above = x >= interval.low if interval.low_inclusive else x > interval.low
+        below = x <= interval.high if interval.high_inclusive else x < interval.high
+        mask |= above & below
+    return mask
+
+
+def quote_best_promotions(promotions: PromotionCandidates | list[CompiledPromotion], amounts: np.ndarray,
+                          additional_infos: list[dict[str, Any]]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorised select_best_promotion over a batch of amounts sharing the same candidate promotions.
+
+    Each promotion is evaluated once for the whole batch: conditions become masks over the amounts,
+    and for every point condition (in order) the amounts still waiting on that promotion take the
+    formula's points if they beat their current best, which reproduces the first-better-match break
+    of the per-credit loop. Returns the best points and the winning promotion id (0 if none) per amount.
+    """
+    best = np.asarray(amounts, dtype=np.int64).copy()
+    best_id = np.zeros(best.shape, dtype=np.int64)
+    x = best.astype(np.float64)
+
+    if not isinstance(promotions, PromotionCandidates):
+        promotions = PromotionCandidates(promotions)
+    eligible = np.zeros((len(promotions.promotions), best.size), dtype=bool)
+    for column, info in enumerate(additional_infos):
+        for position in promotions.positions_for_info(info):
+            eligible[position, column] = promotions.promotions[position].matches(info)
+
+    for promotion, pending in zip(promotions.promotions, eligible):
+        for _, intervals, formula in promotion.point_conditions.point_conditions:
+            if not pending.any():
+                break
+            index = np.flatnonzero(pending & interval_mask(intervals, x))
+            if index.size == 0:
+                continue
+            with np.errstate(all="ignore"):
+                points = np.broadcast_to(formula(x[index]), index.shape)
+            finite = np.isfinite(points)
+            index, points = index[finite], np.trunc(points[finite]).astype(np.int64)
+            better = points > best[index]
+            index = index[better]
+            best[index] = points[better]
+            best_id[index] = promotion.id
+            pending[index] = False
+    return best, best_id
@@ -0,0 +1,156 @@
+import asyncio
+import itertools
+import logging
+import time
+from typing import Callable, TypeVar
+from sqlalchemy import Select, UpdateBase, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.orm import Session
+
+CHECK_INTERVAL = 5.0
+CHECK_TIMEOUT = 2.0
+# seconds a replica that failed a connection or a health check is passed over
+RETRY_INTERVAL = 10.0
+
+logger = logging.getLogger(__name__)
+T = TypeVar("T")
+
+
+class ReplicaSet(object):
+    """
+    Read replica engines, taken in turn. A replica that fails to connect is passed over for retry_interval
+    seconds; the health check started by start() marks replicas down and back up in the background.
+    """
+
+    def __init__(self, engines: list[AsyncEngine], retry_interval: float = RETRY_INTERVAL):
+        self.engines = engines
+        self.retry_interval = retry_interval
+        self._down_until = {engine: 0.0 for engine in engines}
+        self._turn = itertools.count()
+        self._task = None
+
+    def __len__(self) -> int:
+        return len(self.engines)
+
+    def choose(self) -> AsyncEngine | None:
+        """
+        The next replica that is up, or None if there is none
+        """
+        now = time.monotonic()
+        for _ in range(len(self.engines)):
+            engine = self.engines[next(self._turn) % len(self.engines)]
+            if self._down_until[engine] <= now:
+                return engine
+        return None
+
+    def mark_down(self, engine: AsyncEngine):
+        if self._down_until[engine] <= time.monotonic():
+            logger.warning("Replica %s is down", engine.url.render_as_string())
+        self._down_until[engine] = time.monotonic() + self.retry_interval
+
+    def mark_up(self, engine: AsyncEngine):
+        self._down_until[engine] = 0.0
+
+    def is_up(self, engine: AsyncEngine) -> bool:
+        return self._down_until[engine] <= time.monotonic()
+
+    async def check(self, timeout: float = CHECK_TIMEOUT):
+        for engine in self.engines:
+            try:
+                await asyncio.wait_for(self._ping(engine), timeout)
+            except Exception:
+                self.mark_down(engine)
+            else:
+                self.mark_up(engine)
+
+    @staticmethod
+    async def _ping(engine: AsyncEngine):
+        async with engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+
+    def start(self, interval: float = CHECK_INTERVAL):
+        if self.engines and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for engine in self.engines:
+            await engine.dispose()
+
+    async def _run(self, interval: float):
+        while True:
+            await self.check()
+            await asyncio.sleep(interval)
+
+
+class RoutingSession(Session):
+    """
+    Session whose SELECTs inside read() go to a replica; everything else goes to the primary, its bind.
+    A session keeps to one replica, and stops using it once it writes (flushes, commits or executes
+    anything but a SELECT), so a request always reads its own writes.
+    """
+
+    def __init__(self, replicas: ReplicaSet | None = None, **kwargs):
+        super().__init__(**kwargs)
+        self.replicas = replicas
+        self.replica = None
+        self.wrote = False
+        self._reading = False
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is not None:
+            return bind
+        if self._flushing or isinstance(clause, UpdateBase) or (clause is not None and not isinstance(clause, Select)):
+            self.wrote = True
+        elif self._reading and not self.wrote and isinstance(clause, Select) and clause._for_update_arg is None:
+            replica = self._replica()
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper, clause=clause, **kwargs)
+
+    def commit(self):
+        self.wrote = True
+        super().commit()
+
+    def read(self, function: Callable[[], T], recheck_empty: bool = False) -> T:
+        """
+        function(), with its SELECTs on a replica if there is one up. With recheck_empty, an empty result
+        from the replica is read again on the primary, in case the replica has not caught up with a write yet.
+        """
+        if not self.replicas or self.wrote or self._reading:
+            return function()
+        self._reading = True
+        try:
+            result = function()
+        finally:
+            self._reading = False
+        if recheck_empty and not result and self.replica is not None:
+            return function()
+        return result
+
+    def _replica(self):
+        while self.replica is None:
+            engine = self.replicas.choose()
+            if engine is None:
+                return None
+            try:
+                # connect now, so an unreachable replica is passed over rather than failing the query
+                self.connection(bind_arguments={"bind": engine.sync_engine})
+            except Exception:
+                self.replicas.mark_down(engine)
+            else:
+                self.replica = engine.sync_engine
+        return self.replica
+
+
+def read_from_replica(session: Session) -> bool:
+    """
+    Whether the session has read from a replica, whose data may be behind the primary's
+    """
+    return getattr(session, "replica", None) is not None
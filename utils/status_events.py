@@ -0,0 +1,243 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Callable
+from pydantic import BaseModel
+from sqlalchemy import Engine
+
+EVENT_STREAM_MEDIA_TYPE = "text/event-stream"
+KEEPALIVE_INTERVAL = 15.0
+# NOTIFY channel the credit_status_notify trigger (migration m0007) sends every status change to
+CHANNEL = "credit_status"
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription(object):
+    """
+    Status events for one reference, delivered to the event loop that subscribed
+    """
+
+    def __init__(self, events: "StatusEvents", reference: str):
+        self.events = events
+        self.reference = reference
+        self._loop = asyncio.get_running_loop()
+        self._queue: asyncio.Queue[dict[str, Any]] = asyncio.Queue()
+
+    def put(self, event: dict[str, Any]):
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, event)
+        except RuntimeError:
+            # the subscriber's loop has closed
+            self.close()
+
+    async def get(self, timeout: float | None = None) -> dict[str, Any] | None:
+        """
+        The next event, or None after timeout seconds without one
+        """
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.events.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class StatusEvents(object):
+    """
+    In-process pub/sub of credit status changes by reference. Subscribers wait on asyncio queues;
+    publish() may be called from any thread, normally a Channel's listener, which is what lets every
+    worker see the changes made by the others and by the jobs. Listeners (e.g. caches) are called with
+    the reference of every change, or with None when changes may have been missed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions: dict[str, set[Subscription]] = {}
+        self._listeners: list[Callable[[str | None], None]] = []
+        self.channel: Channel | None = None
+
+    def subscribe(self, reference: str) -> Subscription:
+        subscription = Subscription(self, str(reference))
+        with self._lock:
+            self._subscriptions.setdefault(subscription.reference, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.reference)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.reference]
+
+    def add_listener(self, listener: Callable[[str | None], None]):
+        self._listeners.append(listener)
+
+    def publish(self, reference: str, event: dict[str, Any]):
+        for listener in self._listeners:
+            listener(str(reference))
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(str(reference), ()))
+        for subscription in subscriptions:
+            subscription.put(event)
+
+    def reset(self):
+        for listener in self._listeners:
+            listener(None)
+
+    @property
+    def live(self) -> bool:
+        """
+        Whether changes are currently arriving from a channel
+        """
+        return self.channel is not None and self.channel.listening.is_set()
+
+    @property
+    def subscribers(self) -> int:
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def start(self, channel: "Channel"):
+        self.stop()
+        self.channel = channel
+        channel.start(self)
+
+    def stop(self):
+        if self.channel is not None:
+            self.channel.stop()
+            self.channel = None
+
+
+class Channel(ABC):
+    """
+    Carries status changes from wherever they are made to every worker's StatusEvents. Implementations
+    call events.publish(reference, event) for each change between start() and stop(), and set listening
+    while they can; when listening starts again after a gap, they call events.reset().
+    """
+
+    def __init__(self):
+        self.listening = threading.Event()
+
+    @abstractmethod
+    def start(self, events: StatusEvents):
+        pass
+
+    @abstractmethod
+    def stop(self):
+        pass
+
+
+class PostgresChannel(Channel):
+    """
+    LISTENs for the trigger's NOTIFYs on a dedicated connection, in a background thread. Notifications
+    are sent on commit, so subscribers never see a change that rolled back. A lost connection is
+    re-established after retry_interval seconds; changes made meanwhile are missed, so listeners are reset
+    and subscribers cover the gap by re-reading the credit when they (re)connect.
+    """
+
+    def __init__(self, engine: Engine, channel: str = CHANNEL, poll_interval: float = 1.0,
+                 retry_interval: float = 5.0):
+        super().__init__()
+        self.engine = engine
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self, events: StatusEvents):
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, args=(events,), name="status-events", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, events: StatusEvents):
+        while not self._stopping.is_set():
+            try:
+                self._listen(events)
+            except Exception:
+                logger.exception("Status event listener failed; reconnecting")
+                self.listening.clear()
+                self._stopping.wait(self.retry_interval)
+
+    def _listen(self, events: StatusEvents):
+        # detached, so the connection is closed rather than returned to the pool still listening
+        proxy = self.engine.raw_connection()
+        connection = proxy.driver_connection
+        proxy.detach()
+        try:
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(f'LISTEN "{self.channel}"')
+            events.reset()
+            self.listening.set()
+            while not self._stopping.is_set():
+                if select.select([connection], [], [], self.poll_interval)[0]:
+                    connection.poll()
+                    while connection.notifies:
+                        notify = connection.notifies.pop(0)
+                        event = json.loads(notify.payload)
+                        events.publish(event["reference"], event)
+        finally:
+            self.listening.clear()
+            connection.close()
+
+
+def wants_event_stream(accept: str | None) -> bool:
+    return accept is not None and EVENT_STREAM_MEDIA_TYPE in accept
+
+
+async def wait_for_change(subscription: Subscription, item: BaseModel, known_status: str | None,
+                          final_statuses: tuple[str, ...], timeout: float) -> BaseModel:
+    """
+    Long poll: item with the first status other than known_status, waiting up to timeout seconds for
+    one; item as it is if it already differs, is final, or nothing changes in time.
+    """
+    deadline = asyncio.get_running_loop().time() + timeout
+    while item.status == known_status and item.status not in final_statuses:
+        remaining = deadline - asyncio.get_running_loop().time()
+        event = await subscription.get(remaining) if remaining > 0 else None
+        if event is None:
+            break
+        item = item.model_copy(update={"status": event["status"]})
+    return item
+
+
+async def stream_changes(subscription: Subscription, item: BaseModel, final_statuses: tuple[str, ...],
+                         timeout: float, keepalive: float = KEEPALIVE_INTERVAL) -> AsyncIterator[str]:
+    """
+    Server-sent events: item now and after every status change, until a final status or timeout seconds.
+    A comment line is sent after keepalive quiet seconds so proxies keep the connection open.
+    """
+    with subscription:
+        yield f"event: status\ndata: {item.model_dump_json()}\n\n"
+        deadline = asyncio.get_running_loop().time() + timeout
+        while item.status not in final_statuses:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            event = await subscription.get(min(keepalive, remaining))
+            if event is None:
+                yield ": keepalive\n\n"
+            elif event["status"] != item.status:
+                item = item.model_copy(update={"status": event["status"]})
+                yield f"event: status\ndata: {item.model_dump_json()}\n\n"
+
+
+status_events = StatusEvents()
@@ -1,18 +1,60 @@
 import re
+import threading
+import time
 from fastapi import Depends
+from sqlalchemy import select, bindparam
 from config.database import get_db
 from models.loyalty import LoyaltyModel
 
+# built once with bind parameters, as every accrual validates its program
+PROGRAM_BY_ID = select(LoyaltyModel).where(LoyaltyModel.program_id == bindparam("program_id")).limit(1)
+
 
 def validate_member_id(member_id: str, airline_code: str, db: get_db = Depends()):
-    pattern = db.query(LoyaltyModel).filter(LoyaltyModel.program_id == airline_code).first()
+    pattern = db.scalars(PROGRAM_BY_ID, {"program_id": airline_code}).first()
     if pattern and re.match(pattern.regex_pattern, member_id):
         return True
     return False
 
 
 def validate_airline_code(airline_code: str, db: get_db = Depends()):
-    pattern = db.query(LoyaltyModel).filter(LoyaltyModel.program_id == airline_code).first()
+    pattern = db.scalars(PROGRAM_BY_ID, {"program_id": airline_code}).first()
     if pattern:
         return True
     return False
+
+
+class LoyaltyPatterns(object):
+    """
+    Process-local cache of every program's compiled member ID pattern, reloaded after invalidate()
+    or every refresh_interval seconds
+    """
+
+    def __init__(self, refresh_interval: float = 300):
+        self._refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._generation = 0
+        self._patterns: dict[str, re.Pattern] = {}
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+            self._generation += 1
+
+    def get(self, db) -> dict[str, re.Pattern]:
+        with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at <= self._refresh_interval:
+                return self._patterns
+            generation = self._generation
+        patterns = {program_id: re.compile(regex_pattern) for program_id, regex_pattern
+                    in db.query(LoyaltyModel.program_id, LoyaltyModel.regex_pattern).all()}
+        with self._lock:
+            self._patterns = patterns
+            # invalidated while loading: the next call loads again
+            if self._generation == generation:
+                self._loaded_at = time.monotonic()
+            return patterns
+
+
+loyalty_patterns = LoyaltyPatterns()